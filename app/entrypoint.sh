@@ -1,3 +1,16 @@
 #!/bin/bash
 python ./user_api/manage.py migrate
+python ./user_api/manage.py replay_login_spool
+
+# SERVER_MODE=production runs gunicorn with preforked workers, see
+# user_api/gunicorn.conf.py, anything else Django's development server
+if [ "$SERVER_MODE" = "production" ]; then
+    export DJANGO_DEBUG=${DJANGO_DEBUG:-0}
+    # Set it to the host names served, any host is accepted otherwise
+    export DJANGO_ALLOWED_HOSTS=${DJANGO_ALLOWED_HOSTS:-*}
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    cd user_api && exec gunicorn --config gunicorn.conf.py
+fi
 python ./user_api/manage.py runserver 0.0.0.0:8000
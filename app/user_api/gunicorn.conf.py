@@ -0,0 +1,76 @@
+"""Gunicorn configuration of the production entrypoint
+
+The application is imported and warmed up once in the master process and
+the workers are forked from it, sharing its memory copy-on-write. Database
+connections and pools are closed before forking, every worker opens its
+own before accepting requests.
+
+Environment:
+
+- ``SERVER_INTERFACE``: ``wsgi`` (default) or ``asgi``, which serves the
+  async views with uvicorn workers
+- ``WEB_CONCURRENCY``: number of workers, defaults to the available cores
+- ``WEB_THREADS``: threads per WSGI worker, defaults to 4
+- ``PORT``: defaults to 8000
+"""
+import os
+import time
+
+started = time.monotonic()
+
+
+def available_cores():
+    """Cores this process may run on, honouring CPU affinity"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', available_cores()))
+
+if os.environ.get('SERVER_INTERFACE', 'wsgi') == 'asgi':
+    os.environ.setdefault('ASYNC_VIEWS', '1')
+    wsgi_app = 'user_api.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    # Threads overlap the database round trips, each worker pool holds up
+    # to OPTIONS['pool']['max_size'] connections
+    wsgi_app = 'user_api.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('WEB_THREADS', 4))
+
+
+def on_starting(server):
+    from user.warmup import warm_up, connect
+
+    server.log.info(
+        'Application loaded in %.3fs', time.monotonic() - started)
+    warm_up()
+    connect()
+    server.log.info(
+        'Warm-up done in %.3fs', time.monotonic() - started)
+
+
+def pre_fork(server, worker):
+    from user.pool import close_pools
+
+    close_pools()
+
+
+def post_worker_init(worker):
+    from user.warmup import connect
+
+    connect()
+    worker.log.info(
+        'Worker %s ready %.3fs after start', worker.pid,
+        time.monotonic() - started)
+
+
+def child_exit(server, worker):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,5 +1,15 @@
+import os
+
 from django.apps import AppConfig
 
 
 class UserConfig(AppConfig):
     name = 'user'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .events import discard_inherited_writer
+        from .pool import discard_inherited_pools
+
+        os.register_at_fork(after_in_child=discard_inherited_pools)
+        os.register_at_fork(after_in_child=discard_inherited_writer)
@@ -0,0 +1,145 @@
+import inspect
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from .authentication import (
+    AsyncSignedTokenAuthentication, AsyncTokenAuthentication)
+from .pagination import ReportKeysetPagination, UserKeysetPagination
+from .renderers import FastJSONRenderer
+from .reports import BucketReport
+from .serializers import (
+    ActivityReportBucketSerializer, ActivityReportQuerySerializer,
+    UserListQuerySerializer, user_data, user_values)
+
+JSON_MEDIA_TYPES = ('*/*', 'application/*', 'application/json')
+
+# Same order as the REST_FRAMEWORK authentication classes
+authenticators = [AsyncTokenAuthentication(), AsyncSignedTokenAuthentication()]
+
+
+def accepts_json(request):
+    """Whether the sync view would render the response as JSON"""
+    if 'format' in request.GET:
+        return False
+    accept = request.headers.get('Accept', '*/*')
+    return all(
+        media_type.split(';')[0].strip() in JSON_MEDIA_TYPES
+        for media_type in accept.split(','))
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    response = HttpResponse(
+        FastJSONRenderer().render(data), status=status_code,
+        content_type='application/json')
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def error_response(exc):
+    """Response for an API exception, as DRF's exception handler builds it"""
+    if isinstance(exc.detail, (list, dict)):
+        data = exc.detail
+    else:
+        data = {'detail': exc.detail}
+    response = json_response(data, exc.status_code)
+    if isinstance(exc, (
+            exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        response['WWW-Authenticate'] = authenticators[0].authenticate_header(
+            request=None)
+    return response
+
+
+async def authenticate(request):
+    """Authenticated user of the request
+
+    Raises ``AuthenticationFailed`` for invalid credentials and
+    ``NotAuthenticated`` when there are none.
+    """
+    for authenticator in authenticators:
+        result = authenticator.authenticate(request)
+        if inspect.isawaitable(result):
+            result = await result
+        if result is not None:
+            return result[0]
+    raise exceptions.NotAuthenticated()
+
+
+def dispatch(async_view, sync_view):
+    """View serving JSON GET requests with ``async_view``
+
+    Every other request, including other formats, goes to the sync
+    ``sync_view`` so behaviour stays the same.
+    """
+    sync_view = sync_to_async(sync_view)
+
+    @csrf_exempt
+    async def view(request, *args, **kwargs):
+        if request.method != 'GET' or not accepts_json(request):
+            return await sync_view(request, *args, **kwargs)
+        try:
+            await authenticate(request)
+            return await async_view(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return error_response(exc)
+
+    return view
+
+
+async def user_list(request):
+    params = UserListQuerySerializer(data=request.GET)
+    params.is_valid(raise_exception=True)
+    fields = params.validated_data['fields']
+
+    paginator = UserKeysetPagination()
+    page = await paginator.apaginate_queryset(
+        user_values(User.objects.filter(is_active=True), fields),
+        Request(request))
+    return json_response({
+        'next': paginator.get_next_link(),
+        'results': [user_data(row, fields) for row in page],
+    })
+
+
+async def user_detail(request, pk):
+    try:
+        row = await user_values(User.objects.filter(is_active=True)).aget(
+            pk=pk)
+    except User.DoesNotExist:
+        raise exceptions.NotFound('No User matches the given query.')
+    except (DjangoValidationError, TypeError, ValueError):
+        raise exceptions.NotFound()
+    return json_response(user_data(row))
+
+
+async def report(request, bucket):
+    """Login counts per user and bucket"""
+    params = ActivityReportQuerySerializer(data=request.GET)
+    params.is_valid(raise_exception=True)
+    report = BucketReport(
+        bucket,
+        date_from=params.validated_data.get('from'),
+        date_to=params.validated_data.get('to'),
+        user=params.validated_data.get('user'),
+        fill=params.validated_data['fill'])
+    context = {'bucket': bucket, 'layout': params.validated_data['layout']}
+
+    paginator = ReportKeysetPagination()
+    page = await paginator.apaginate_queryset(report, Request(request))
+    if page is not None:
+        serializer = ActivityReportBucketSerializer(page, context=context)
+        return json_response({
+            'next': paginator.get_next_link(),
+            'results': serializer.data,
+        })
+
+    rows = [row async for row in report.arows()]
+    serializer = ActivityReportBucketSerializer(rows, context=context)
+    return json_response(serializer.data)
@@ -0,0 +1,172 @@
+import datetime
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.utils import timezone
+
+from rest_framework import authentication, exceptions
+
+from .models import TokenRevocation
+
+SIGNED_TOKEN_SALT = 'user.authentication.SignedTokenAuthentication'
+
+DEFAULT_SIGNED_TOKEN = {
+    'ENABLED': False,
+    'MAX_AGE': 24 * 60 * 60,
+    'REVOCATION_REFRESH': 30,
+}
+
+
+def signed_token_setting(name):
+    return getattr(settings, 'SIGNED_TOKEN', {}).get(
+        name, DEFAULT_SIGNED_TOKEN[name])
+
+
+def issue_signed_token(user):
+    """Return a signed access token for the user"""
+    payload = {'id': user.id, 'usr': user.username, 'iat': int(time.time())}
+    return signing.dumps(payload, salt=SIGNED_TOKEN_SALT)
+
+
+class RevocationSet(object):
+    """In-process copy of the recent TokenRevocation rows
+
+    Maps user ids to the time their tokens were revoked. Only revocations
+    younger than the token max age matter, so the set stays small. It is
+    reloaded at most once every ``REVOCATION_REFRESH`` seconds, which is
+    the longest a revoked token can still be accepted by another process.
+    """
+
+    def __init__(self):
+        self.revoked = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def due(self):
+        return self.loaded_at is None or (
+            time.monotonic() - self.loaded_at
+            >= signed_token_setting('REVOCATION_REFRESH'))
+
+    def recent(self):
+        since = timezone.now() - datetime.timedelta(
+            seconds=signed_token_setting('MAX_AGE'))
+        return TokenRevocation.objects.filter(
+            revoked_at__gte=since).values_list('user_id', 'revoked_at')
+
+    def load(self, rows, loaded_at):
+        self.revoked = {
+            user_id: revoked_at.timestamp() for user_id, revoked_at in rows}
+        self.loaded_at = loaded_at
+
+    def refresh(self, force=False):
+        if not force and not self.due():
+            return
+        with self.lock:
+            if not force and not self.due():
+                return
+            now = time.monotonic()
+            self.load(list(self.recent()), now)
+
+    async def arefresh(self):
+        """Refresh with the async ORM, for the async views"""
+        if not self.due():
+            return
+        now = time.monotonic()
+        self.load([row async for row in self.recent()], now)
+
+    def add(self, user_id, revoked_at):
+        self.revoked[user_id] = revoked_at.timestamp()
+
+    def is_revoked(self, user_id, issued_at):
+        self.refresh()
+        revoked_at = self.revoked.get(user_id)
+        return revoked_at is not None and issued_at <= revoked_at
+
+
+revocations = RevocationSet()
+
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    """Authenticate ``Authorization: Bearer <signed token>`` headers
+
+    Tokens are verified with the project secret key, without touching the
+    database. ``request.user`` is an unsaved User instance carrying only the
+    id and username stored in the token.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(auth) == 1:
+            msg = 'Invalid token header. No credentials provided.'
+            raise exceptions.AuthenticationFailed(msg)
+        elif len(auth) > 2:
+            msg = 'Invalid token header. Token string should not contain spaces.'
+            raise exceptions.AuthenticationFailed(msg)
+
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            msg = 'Invalid token header. Token string should not contain invalid characters.'
+            raise exceptions.AuthenticationFailed(msg)
+
+        return self.authenticate_credentials(token)
+
+    def authenticate_credentials(self, token):
+        try:
+            payload = signing.loads(
+                token, salt=SIGNED_TOKEN_SALT,
+                max_age=signed_token_setting('MAX_AGE'))
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+        if revocations.is_revoked(payload['id'], payload['iat']):
+            raise exceptions.AuthenticationFailed('Token has been revoked.')
+
+        user = User(id=payload['id'], username=payload['usr'], is_active=True)
+        user._state.adding = False
+        return (user, token)
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class AsyncSignedTokenAuthentication(SignedTokenAuthentication):
+    """SignedTokenAuthentication for the async views
+
+    ``authenticate`` returns a coroutine when a token is given, the
+    revocations are refreshed with the async ORM.
+    """
+
+    async def authenticate_credentials(self, token):
+        await revocations.arefresh()
+        return super().authenticate_credentials(token)
+
+
+class AsyncTokenAuthentication(authentication.TokenAuthentication):
+    """TokenAuthentication for the async views
+
+    ``authenticate`` returns a coroutine when a key is given, the key and
+    its user are fetched with one async query.
+    """
+
+    async def authenticate_credentials(self, key):
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related('user').aget(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return (token.user, token)
@@ -0,0 +1,142 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from .serializers import UserBulkItemSerializer, UserModelSerializer
+
+UNIQUE_MESSAGE = 'This field must be unique.'
+
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+
+def hash_pool(workers):
+    """Process pool of this worker, started on first use and kept
+
+    The processes come from a forkserver rather than from a fork of the
+    worker: forking a process running request threads could copy locks
+    held by the other threads.
+    """
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['django.contrib.auth.hashers'])
+            _hash_pool = ProcessPoolExecutor(workers, mp_context=context)
+            atexit.register(_hash_pool.shutdown)
+        return _hash_pool
+
+
+def discard_hash_pool(pool):
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is pool:
+            _hash_pool = None
+    pool.shutdown(wait=False)
+
+
+def hash_passwords(passwords):
+    """Hash the passwords, in parallel when there are enough of them
+
+    PBKDF2 is CPU bound and holds the GIL, so the work is spread over a
+    long-lived pool of processes. Small batches are hashed inline because
+    handing them to the pool would cost more than it saves.
+    """
+    workers = getattr(settings, 'BULK_CREATE_HASH_WORKERS', None) or (
+        os.cpu_count() or 1)
+    if workers < 2 or len(passwords) < 2 * workers:
+        return [make_password(password) for password in passwords]
+
+    pool = hash_pool(workers)
+    chunksize = max(1, len(passwords) // (workers * 4))
+    try:
+        return list(pool.map(make_password, passwords, chunksize=chunksize))
+    except BrokenProcessPool:
+        # A pool process died, the next batch gets a new pool
+        discard_hash_pool(pool)
+        raise
+
+
+def find_taken(field, values):
+    """Values of ``field`` already used, found with a single IN query"""
+    return set(User.objects.filter(
+        **{field + '__in': values}).values_list(field, flat=True))
+
+
+def bulk_create_users(items):
+    """Create the users of a batch
+
+    Returns one result per item, in order: ``{'index', 'status', 'user'}``
+    for created users and ``{'index', 'status', 'errors'}`` for rejected
+    ones. Uniqueness is checked once per field for the whole batch, and
+    duplicates inside the batch are rejected after their first occurrence.
+    """
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        serializer = UserBulkItemSerializer(data=item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {
+                'index': index, 'status': 400, 'errors': serializer.errors}
+
+    taken = {
+        'username': find_taken(
+            'username', [data['username'] for index, data in valid]),
+        'email': find_taken(
+            'email', [data['email'] for index, data in valid]),
+    }
+    users = []
+    for index, data in valid:
+        errors = {}
+        for field in ('email', 'username'):
+            if data[field] in taken[field]:
+                errors[field] = [UNIQUE_MESSAGE]
+            taken[field].add(data[field])
+        if errors:
+            results[index] = {'index': index, 'status': 400, 'errors': errors}
+            continue
+
+        users.append((index, User(
+            username=User.normalize_username(data['username']),
+            email=User.objects.normalize_email(data['email']),
+            first_name=data['first_name'],
+            last_name=data['last_name'],
+        ), data['password']))
+
+    hashes = hash_passwords([password for index, user, password in users])
+    for (index, user, password), hashed in zip(users, hashes):
+        user.password = hashed
+
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create([user for index, user, password in users])
+    except IntegrityError:
+        # A concurrent request took some of the names, insert one by one
+        for index, user, password in users:
+            try:
+                with transaction.atomic():
+                    user.save()
+            except IntegrityError:
+                user.pk = None
+                results[index] = {
+                    'index': index, 'status': 400,
+                    'errors': {'non_field_errors': [UNIQUE_MESSAGE]}}
+
+    for index, user, password in users:
+        if results[index] is None:
+            results[index] = {
+                'index': index, 'status': 201,
+                'user': UserModelSerializer(user).data}
+
+    return results
@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from .models import (
+    ActiveUserSketch, ActivityReport, DailyActivity, TopUserCounter)
+
+USERNAME_PREFIX = 'load-'
+PASSWORD = 'load-test-password'
+
+
+def dataset_users():
+    return User.objects.filter(username__startswith=USERNAME_PREFIX)
+
+
+def user_range(cursor):
+    """``(first id, last id)`` of the generated users, ``None`` if empty"""
+    cursor.execute(
+        'SELECT MIN(id), MAX(id) FROM {users} WHERE username LIKE %s'.format(
+            users=User._meta.db_table), [USERNAME_PREFIX + '%'])
+    first, last = cursor.fetchone()
+    return None if first is None else (first, last)
+
+
+def clear():
+    """Delete the generated users and everything they logged
+
+    Events and rollup rows are deleted with one statement each, cascading
+    through the ORM would load every row. Users cannot be removed from the
+    active user sketches and top user counters, they are rebuilt from the
+    remaining events.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not dataset_users().exists():
+            return 0
+        # Real users registered between two generations may have ids in
+        # the range of the generated ones, match on the username
+        for model in (ActivityReport, DailyActivity):
+            cursor.execute(
+                'DELETE FROM {table} WHERE user_id IN ('
+                '  SELECT id FROM {users} WHERE username LIKE %s)'.format(
+                    table=model._meta.db_table, users=User._meta.db_table),
+                [USERNAME_PREFIX + '%'])
+        ActiveUserSketch.objects.rebuild()
+        TopUserCounter.objects.rebuild()
+        return dataset_users().delete()[1].get(User._meta.label, 0)
+
+
+def generate_users(count, seed=0):
+    """Insert ``count`` users with one server side statement
+
+    Every user gets the same password, hashed once, so the load test can log
+    in as any of them. Returns ``(first id, last id)``.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {users} (username, email, password, first_name, '
+            '  last_name, is_superuser, is_staff, is_active, date_joined) '
+            'SELECT %s || lpad(n::text, 8, %s), '
+            "  %s || lpad(n::text, 8, %s) || '@example.com', %s, "
+            "  'Load', 'User ' || n, false, false, true, "
+            "  now() - interval '1 second' * (%s - n) "
+            'FROM generate_series(1, %s) AS n '
+            'ORDER BY n'.format(users=User._meta.db_table),
+            [USERNAME_PREFIX, '0', USERNAME_PREFIX, '0',
+             make_password(PASSWORD, salt='loadtest%d' % seed), count, count])
+        return user_range(cursor)
+
+
+def generate_events(first_id, last_id, count, days=365, user_skew=3.0,
+                    day_skew=2.0, seed=0, batch_size=1000000, progress=None):
+    """Insert ``count`` login events for the users ``first_id..last_id``
+
+    Events are generated inside Postgres in batches of ``batch_size``, one
+    transaction each, and ``setseed`` makes a run reproducible. Both axes
+    are skewed with power laws: with ``user_skew`` above 1 a few users log
+    in very often and most rarely, with ``day_skew`` above 1 recent days
+    get more logins than old ones. Batches walk forward in time, so events
+    are appended in time order as production traffic would. The daily
+    rollup, the active user sketches, the top user counters and
+    ``last_login`` of the generated users are updated at the end.
+    """
+    users = last_id - first_id + 1
+    generated = 0
+    batch_number = 0
+    while generated < count:
+        size = min(batch_size, count - generated)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT setseed(%s)',
+                [((seed * 7919 + batch_number) % 10000) / 10000.0])
+            cursor.execute(
+                'INSERT INTO {events} (user_id, date, logged_at) '
+                'SELECT user_id, (logged_at AT TIME ZONE %s)::date, logged_at '
+                'FROM ('
+                '  SELECT %s + floor(%s * power(random(), %s))::integer'
+                '      AS user_id,'
+                "    now() - interval '1 day' * %s * power("
+                '      1 - (%s + %s * random()), %s) AS logged_at'
+                '  FROM generate_series(1, %s)'
+                '  ORDER BY logged_at'
+                ') AS generated'.format(events=ActivityReport._meta.db_table),
+                [settings.TIME_ZONE, first_id, users, user_skew, days,
+                 generated / count, size / count, day_skew, size])
+        generated += size
+        batch_number += 1
+        if progress:
+            progress(generated)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {rollup} (user_id, date, count) '
+            'SELECT user_id, date, COUNT(*) FROM {events} '
+            'WHERE user_id BETWEEN %s AND %s '
+            'GROUP BY user_id, date '
+            'ON CONFLICT (user_id, date) DO UPDATE '
+            'SET count = EXCLUDED.count'.format(
+                rollup=DailyActivity._meta.db_table,
+                events=ActivityReport._meta.db_table),
+            [first_id, last_id])
+        ActiveUserSketch.objects.add(
+            '(SELECT user_id, date FROM {events} '
+            'WHERE user_id BETWEEN %s AND %s) AS source'.format(
+                events=ActivityReport._meta.db_table),
+            [first_id, last_id])
+        TopUserCounter.objects.add(
+            '(SELECT user_id, date, count FROM {rollup} '
+            'WHERE user_id BETWEEN %s AND %s) AS source'.format(
+                rollup=DailyActivity._meta.db_table),
+            [first_id, last_id])
+        TopUserCounter.objects.trim()
+        cursor.execute(
+            'UPDATE {users} SET last_login = latest.logged_at FROM ('
+            '  SELECT user_id, MAX(logged_at) AS logged_at FROM {events}'
+            '  WHERE user_id BETWEEN %s AND %s GROUP BY user_id'
+            ') AS latest WHERE {users}.id = latest.user_id'.format(
+                users=User._meta.db_table,
+                events=ActivityReport._meta.db_table),
+            [first_id, last_id])
+    return generated
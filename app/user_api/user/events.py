@@ -0,0 +1,258 @@
+import atexit
+import datetime
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ActivityReport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVENT_WRITER = {
+    'BACKEND': 'user.events.SyncEventWriter',
+    'OPTIONS': {},
+}
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_event_writer():
+    """Return the login event writer configured in LOGIN_EVENT_WRITER"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = getattr(
+                    settings, 'LOGIN_EVENT_WRITER', DEFAULT_EVENT_WRITER)
+                backend = import_string(config['BACKEND'])
+                _writer = backend(**config.get('OPTIONS', {}))
+                atexit.register(_writer.close)
+    return _writer
+
+
+def reset_event_writer(**kwargs):
+    """Flush and drop the current writer so the next call rebuilds it"""
+    global _writer
+    if kwargs.get('setting', 'LOGIN_EVENT_WRITER') != 'LOGIN_EVENT_WRITER':
+        return
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+        _writer = None
+
+
+setting_changed.connect(reset_event_writer)
+
+
+def discard_inherited_writer():
+    """Forget the writer inherited through a fork
+
+    Runs in the child process. The writer thread does not survive the fork
+    and the spool file and its lock belong to the parent, so the child
+    closes its copy of the file without flushing or deleting anything and
+    starts its own writer on first use.
+    """
+    global _writer, _writer_lock
+    _writer_lock = threading.Lock()
+    if _writer is not None:
+        _writer.closed = True
+        if hasattr(_writer, 'spool'):
+            _writer.spool.close()
+        _writer = None
+
+
+class SyncEventWriter(object):
+    """Write every login event on the request path"""
+
+    def record(self, user):
+        ActivityReport.objects.record([(user.id, timezone.now())])
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BufferedEventWriter(object):
+    """Buffer login events in memory and write them in batches
+
+    Each event is appended to a local spool file before it is buffered, so
+    a crash loses nothing: spool files left behind by a dead process are
+    replayed when the next writer starts (or by the
+    ``replay_login_spool`` command). The buffer is flushed when it holds
+    ``max_events`` events or every ``max_delay`` seconds.
+
+    Every process writes its own spool file and keeps an exclusive
+    ``flock`` on it, which is how replay tells orphaned files apart from
+    the ones still in use. Replay is at-least-once: events flushed right
+    before a crash may be written twice.
+    """
+
+    def __init__(self, spool_dir, max_events=500, max_delay=1.0, fsync=True,
+                 replay=True):
+        self.spool_dir = spool_dir
+        self.max_events = max_events
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.pending_replay = False
+
+        os.makedirs(spool_dir, exist_ok=True)
+        if replay:
+            replay_spool(spool_dir)
+        self.spool = self.open_spool()
+
+        self.thread = threading.Thread(
+            target=self.run, name='login-event-writer', daemon=True)
+        self.thread.start()
+
+    def open_spool(self):
+        path = os.path.join(
+            self.spool_dir, 'events-%s.spool' % uuid.uuid4().hex)
+        spool = open(path, 'a')
+        fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return spool
+
+    def record(self, user):
+        now = timezone.now()
+        line = json.dumps([user.id, now.isoformat()])
+        with self.lock:
+            self.spool.write(line + '\n')
+            self.spool.flush()
+            if self.fsync:
+                os.fsync(self.spool.fileno())
+            self.buffer.append((user.id, now))
+            full = len(self.buffer) >= self.max_events
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.max_delay)
+            self.wakeup.clear()
+            if self.closed:
+                # close() writes whatever is left from the calling thread
+                break
+            try:
+                self.flush()
+                if self.pending_replay:
+                    self.pending_replay = False
+                    replay_spool(self.spool_dir)
+            except Exception:
+                logger.exception('Could not flush login events')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write the buffered events and discard their spool file"""
+        with self.flush_lock:
+            with self.lock:
+                if not self.buffer:
+                    return
+                events, self.buffer = self.buffer, []
+                spool, self.spool = self.spool, self.open_spool()
+
+            try:
+                write_events(events)
+            except Exception:
+                # Release the spool so the events are replayed later
+                spool.close()
+                self.pending_replay = True
+                raise
+            os.unlink(spool.name)
+            spool.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        os.unlink(self.spool.name)
+        self.spool.close()
+
+
+def parse_event(line):
+    """Return the ``(user_id, logged_at)`` event stored in a spool line
+
+    Older spool files stored the date of the login instead of its time,
+    those events are replayed at midnight.
+    """
+    user_id, logged_at = json.loads(line)
+    logged_at = datetime.datetime.fromisoformat(logged_at)
+    if timezone.is_naive(logged_at):
+        logged_at = timezone.make_aware(logged_at)
+    return user_id, logged_at
+
+
+def write_events(events):
+    """Store events, skipping users deleted since the login
+
+    Returns the number of events written.
+    """
+    user_ids = set(user_id for user_id, logged_at in events)
+    existing = set(User.objects.filter(
+        id__in=user_ids).values_list('id', flat=True))
+    events = [event for event in events if event[0] in existing]
+    ActivityReport.objects.record(events)
+    return len(events)
+
+
+def replay_spool(spool_dir, batch_size=5000):
+    """Write the events of spool files no live process holds a lock on
+
+    Returns the number of events replayed.
+    """
+    replayed = 0
+    for path in sorted(glob.glob(os.path.join(spool_dir, '*.spool'))):
+        try:
+            spool = open(path)
+        except FileNotFoundError:
+            # Replayed and removed by another process since the glob
+            continue
+        with spool:
+            try:
+                fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            if os.fstat(spool.fileno()).st_nlink == 0:
+                # Opened before another process replayed and removed it
+                continue
+
+            events = []
+            for line in spool:
+                try:
+                    events.append(parse_event(line))
+                except (TypeError, ValueError):
+                    # Torn write from the crash, nothing was acknowledged
+                    continue
+                if len(events) >= batch_size:
+                    replayed += write_events(events)
+                    events = []
+            replayed += write_events(events)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    if replayed:
+        logger.info('Replayed %s login events from %s', replayed, spool_dir)
+    return replayed
@@ -0,0 +1,218 @@
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import ExportJob
+from .renderers import CSVRenderer, NDJSONRenderer
+from .reports import BucketReport
+from .serializers import ActivityReportBucketSerializer
+
+logger = logging.getLogger(__name__)
+
+RENDERERS = {
+    'csv': CSVRenderer,
+    'ndjson': NDJSONRenderer,
+}
+
+
+def job_params(data):
+    """JSON parameters of a job from ``ExportJobCreateSerializer`` data"""
+    return {
+        'bucket': data['bucket'],
+        'from': data['from'].isoformat() if data.get('from') else None,
+        'to': data['to'].isoformat() if data.get('to') else None,
+        'user': data.get('user'),
+        'fill': data['fill'],
+        'format': data['format'],
+    }
+
+
+def params_key(params):
+    return hashlib.sha256(json.dumps(
+        params, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def submit(params):
+    """``(job, created)`` for the report of ``params``
+
+    A queued, running or done job for the same parameters is returned
+    rather than a new one. The partial unique constraint on ``key`` keeps
+    concurrent identical requests from both creating a job.
+    """
+    key = params_key(params)
+    while True:
+        job = ExportJob.objects.filter(
+            key=key, status__in=ExportJob.ACTIVE).first()
+        if job is not None:
+            return job, False
+        try:
+            with transaction.atomic():
+                return ExportJob.objects.create(key=key, params=params), True
+        except IntegrityError:
+            continue
+
+
+def path(job):
+    return os.path.join(settings.EXPORT_DIR, job.file)
+
+
+def claim():
+    """Mark the oldest queued job running and return it, ``None`` if none
+
+    ``SKIP LOCKED`` lets several workers poll the table, each job is
+    claimed by one of them.
+    """
+    with transaction.atomic():
+        job = ExportJob.objects.select_for_update(skip_locked=True).filter(
+            status=ExportJob.QUEUED).order_by('id').first()
+        if job is None:
+            return None
+        job.status = ExportJob.RUNNING
+        job.started_at = job.updated_at = timezone.now()
+        job.save(update_fields=['status', 'started_at', 'updated_at'])
+    return job
+
+
+def report(params):
+    def date(value):
+        return value and datetime.date.fromisoformat(value)
+
+    return BucketReport(
+        params['bucket'], date_from=date(params['from']),
+        date_to=date(params['to']), user=params['user'],
+        fill=params['fill'])
+
+
+class Heartbeat(object):
+    """Touch ``updated_at`` of a running job every ``interval`` seconds
+
+    Runs in a thread with its own connection, so the job is not taken for
+    stale while the report query has yet to return its first row. The
+    number of rows written so far is saved along.
+    """
+
+    def __init__(self, job, interval):
+        self.job = job
+        self.interval = interval
+        self.rows = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name='export-heartbeat-%s' % job.id,
+            daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    ExportJob.objects.filter(
+                        pk=self.job.pk, status=ExportJob.RUNNING,
+                    ).update(rows=self.rows, updated_at=timezone.now())
+                except Exception:
+                    logger.exception('Export %s heartbeat failed', self.job.id)
+        finally:
+            connection.close()
+
+
+def run(job, heartbeat=30):
+    """Write the report of ``job`` to a gzipped file in ``EXPORT_DIR``
+
+    Rows are read from the database in chunks and rendered as the
+    streaming report responses are, memory stays bounded whatever the size
+    of the report. ``updated_at`` and ``rows`` are refreshed every
+    ``heartbeat`` seconds. The file is written under a temporary name of
+    its own, a job claimed again after being requeued never shares it, and
+    is renamed once complete.
+    """
+    params = job.params
+    renderer = RENDERERS[params['format']]()
+    serializer = ActivityReportBucketSerializer(
+        context={'bucket': params['bucket']})
+    job.file = 'report-%s-%s.%s.gz' % (
+        params['bucket'], job.id, params['format'])
+    target = path(job)
+    partial = '%s.%s.part' % (target, uuid.uuid4().hex)
+
+    def rows(beat):
+        for row in serializer.iter_representation(report(params).rows()):
+            beat.rows += 1
+            yield row
+        job.rows = beat.rows
+
+    try:
+        os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+        with Heartbeat(job, heartbeat) as beat, gzip.open(partial, 'wb') as f:
+            for chunk in renderer.stream(rows(beat)):
+                f.write(chunk)
+        os.replace(partial, target)
+    except Exception as exc:
+        logger.exception('Export %s failed', job.id)
+        if os.path.exists(partial):
+            os.remove(partial)
+        job.status = ExportJob.FAILED
+        job.error = str(exc)
+    else:
+        job.status = ExportJob.DONE
+        job.expires_at = timezone.now() + datetime.timedelta(
+            seconds=settings.EXPORT_TTL)
+    job.finished_at = job.updated_at = timezone.now()
+    job.save()
+    return job
+
+
+def requeue_stale(timeout):
+    """Queue again the running jobs without progress for ``timeout`` seconds
+
+    Their worker is assumed to have died.
+    """
+    return ExportJob.objects.filter(
+        status=ExportJob.RUNNING,
+        updated_at__lt=timezone.now() - datetime.timedelta(seconds=timeout),
+    ).update(status=ExportJob.QUEUED, rows=0, updated_at=timezone.now())
+
+
+def expire():
+    """Delete the files of the jobs past ``expires_at``"""
+    expired = 0
+    for job in ExportJob.objects.filter(
+            status=ExportJob.DONE, expires_at__lte=timezone.now()):
+        try:
+            os.remove(path(job))
+        except FileNotFoundError:
+            pass
+        mark_expired(job)
+        expired += 1
+    return expired
+
+
+def mark_expired(job):
+    job.status = ExportJob.EXPIRED
+    job.updated_at = timezone.now()
+    job.save(update_fields=['status', 'updated_at'])
+
+
+def process():
+    """Run the queued jobs until none is left, returns how many ran"""
+    count = 0
+    while True:
+        job = claim()
+        if job is None:
+            return count
+        run(job)
+        count += 1
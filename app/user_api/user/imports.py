@@ -0,0 +1,176 @@
+import csv
+import datetime
+import io
+import json
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import (
+    ActiveUserSketch, ActivityReport, DailyActivity, TopUserCounter)
+
+STAGING_TABLE = 'user_login_import'
+
+
+def copy_from(cursor, sql, data):
+    """Run ``COPY ... FROM STDIN`` with the text in ``data``
+
+    Works with both psycopg2 (``copy_expert``) and psycopg 3 (``copy``).
+    """
+    raw = cursor.cursor
+    if hasattr(raw, 'copy_expert'):
+        raw.copy_expert(sql, io.StringIO(data))
+    else:
+        with raw.copy(sql) as copy:
+            copy.write(data)
+
+
+def parse_datetime(value):
+    """Aware datetime of an ISO date or datetime string
+
+    Dates alone are placed at midnight of the current time zone.
+    """
+    logged_at = datetime.datetime.fromisoformat(value.strip())
+    if timezone.is_naive(logged_at):
+        logged_at = timezone.make_aware(logged_at)
+    return logged_at
+
+
+def read_csv(stream):
+    """Yield dicts from a CSV file with a header row"""
+    return csv.DictReader(stream)
+
+
+def read_ndjson(stream):
+    """Yield dicts from a newline delimited JSON file
+
+    Lines that are not valid JSON yield ``None``, the importer counts them
+    as skipped.
+    """
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield None
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+class LoginImporter(object):
+    """Load historical login events into ActivityReport with COPY
+
+    Every record needs a ``date`` and either a ``user_id`` or a
+    ``username``. Records are processed ``batch_size`` at a time, so memory
+    stays bounded whatever the size of the file: usernames of the batch are
+    resolved with one query, the batch is copied into a temporary staging
+    table and moved to ActivityReport, the daily rollup, the active user
+    sketches and the top user counters with set-based statements. Events
+    of unknown users are skipped.
+    """
+    max_cached_users = 100000
+
+    def __init__(self, batch_size=50000):
+        self.batch_size = batch_size
+        self.user_ids = {}
+        self.imported = 0
+        self.skipped = 0
+
+    def run(self, records, progress=None):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE IF NOT EXISTS {staging} '
+                '(user_id integer, date date, logged_at timestamptz)'.format(
+                    staging=STAGING_TABLE))
+        try:
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self.load(batch)
+                    batch = []
+                    if progress:
+                        progress(self)
+            if batch:
+                self.load(batch)
+                if progress:
+                    progress(self)
+            TopUserCounter.objects.trim()
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'DROP TABLE IF EXISTS {staging}'.format(
+                        staging=STAGING_TABLE))
+
+    def resolve(self, usernames):
+        """Map usernames to ids, keeping a bounded cache between batches"""
+        missing = usernames.difference(self.user_ids)
+        if not missing:
+            return
+        if len(self.user_ids) + len(missing) > self.max_cached_users:
+            self.user_ids = {}
+        self.user_ids.update(User.objects.filter(
+            username__in=missing).values_list('username', 'id'))
+
+    def load(self, batch):
+        self.resolve(set(
+            record['username'] for record in batch
+            if isinstance(record, dict) and not record.get('user_id')
+            and isinstance(record.get('username'), str)))
+
+        lines = []
+        for record in batch:
+            try:
+                user_id = record.get('user_id') or self.user_ids.get(
+                    record.get('username'))
+                if not user_id:
+                    raise ValueError('Unknown user')
+                logged_at = parse_datetime(record['date'])
+                lines.append('%d\t%s\t%s\n' % (
+                    int(user_id), timezone.localdate(logged_at).isoformat(),
+                    logged_at.isoformat()))
+            except (AttributeError, KeyError, TypeError, ValueError):
+                self.skipped += 1
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            copy_from(
+                cursor,
+                'COPY {staging} (user_id, date, logged_at) FROM STDIN'.format(
+                    staging=STAGING_TABLE),
+                ''.join(lines))
+            cursor.execute(
+                'INSERT INTO {events} (user_id, date, logged_at) '
+                'SELECT s.user_id, s.date, s.logged_at FROM {staging} s '
+                'JOIN {users} u ON u.id = s.user_id'.format(
+                    events=ActivityReport._meta.db_table,
+                    staging=STAGING_TABLE,
+                    users=User._meta.db_table))
+            inserted = cursor.rowcount
+            cursor.execute(
+                'INSERT INTO {rollup} (user_id, date, count) '
+                'SELECT s.user_id, s.date, COUNT(*) FROM {staging} s '
+                'JOIN {users} u ON u.id = s.user_id '
+                'GROUP BY s.user_id, s.date '
+                'ON CONFLICT (user_id, date) DO UPDATE '
+                'SET count = {rollup}.count + EXCLUDED.count'.format(
+                    rollup=DailyActivity._meta.db_table,
+                    staging=STAGING_TABLE,
+                    users=User._meta.db_table))
+            ActiveUserSketch.objects.add(
+                '(SELECT s.user_id, s.date FROM {staging} s '
+                'JOIN {users} u ON u.id = s.user_id) AS source'.format(
+                    staging=STAGING_TABLE, users=User._meta.db_table))
+            TopUserCounter.objects.add(
+                '(SELECT s.user_id, s.date, COUNT(*) AS count '
+                'FROM {staging} s JOIN {users} u ON u.id = s.user_id '
+                'GROUP BY s.user_id, s.date) AS source'.format(
+                    staging=STAGING_TABLE, users=User._meta.db_table))
+            cursor.execute('TRUNCATE {staging}'.format(staging=STAGING_TABLE))
+
+        self.imported += inserted
+        self.skipped += len(lines) - inserted
@@ -0,0 +1,319 @@
+import asyncio
+import datetime
+import io
+import json
+import math
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+
+from .dataset import PASSWORD, USERNAME_PREFIX
+
+DEFAULT_ROUTES = [
+    'login', 'user-list', 'user-detail', 'report-day', 'report-month']
+
+
+def routes(user_id, today=None):
+    """Requests sent by every route of the load test
+
+    Each route maps to ``(method, path, body)``. ``user_id`` is the user
+    fetched by the detail route. Reports cover the last 30 days and the
+    last year, the ranges dashboards ask for.
+    """
+    today = today or datetime.date.today()
+    month_ago = (today - datetime.timedelta(days=30)).isoformat()
+    year_ago = (today - datetime.timedelta(days=365)).isoformat()
+    return {
+        'login': ('POST', '/user/login/', None),
+        'user-list': ('GET', '/user/', None),
+        'user-detail': ('GET', '/user/%d/' % user_id, None),
+        'report-day': (
+            'GET', '/activityReport/day/?from=%s&to=%s' % (
+                month_ago, today.isoformat()), None),
+        'report-month': (
+            'GET', '/activityReport/month/?from=%s&to=%s' % (
+                year_ago, today.isoformat()), None),
+    }
+
+
+def allowed_host():
+    """Host name passing ALLOWED_HOSTS for in process requests"""
+    # localhost is accepted when ALLOWED_HOSTS is empty and DEBUG is on
+    hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+    return hosts[0].lstrip('.') if hosts else 'localhost'
+
+
+class WSGITarget(object):
+    """Send requests through the Django WSGI handler, without a server
+
+    Unlike the test client, the handler runs the request finished signal,
+    so database connections are returned or closed after every request as
+    they are in production.
+    """
+
+    def __init__(self):
+        self.application = WSGIHandler()
+        self.host = allowed_host()
+
+    def request(self, method, path, body=None, token=None):
+        path, _, query = path.partition('?')
+        content = json.dumps(body).encode() if body is not None else b''
+        environ = {
+            'REQUEST_METHOD': method, 'SCRIPT_NAME': '', 'PATH_INFO': path,
+            'QUERY_STRING': query, 'SERVER_NAME': self.host,
+            'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': self.host, 'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(content), 'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if token:
+            environ['HTTP_AUTHORIZATION'] = 'Token ' + token
+        status = []
+
+        def start_response(status_line, headers, exc_info=None):
+            status.append(int(status_line.split()[0]))
+
+        response = self.application(environ, start_response)
+        try:
+            content = b''.join(response)
+        finally:
+            response.close()
+        return status[0], content
+
+    def close(self):
+        connection.close()
+
+
+class ASGITarget(object):
+    """Send requests through the Django ASGI handler, without a server"""
+
+    def __init__(self):
+        self.application = ASGIHandler()
+        self.host = allowed_host()
+
+    async def request(self, method, path, body=None, token=None):
+        path, _, query = path.partition('?')
+        content = json.dumps(body).encode() if body is not None else b''
+        headers = [
+            (b'host', self.host.encode()),
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(content)).encode())]
+        if token:
+            headers.append((b'authorization', b'Token ' + token.encode()))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'},
+            'http_version': '1.1', 'method': method, 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(),
+            'query_string': query.encode(), 'root_path': '',
+            'headers': headers, 'client': ('127.0.0.1', 0),
+            'server': (self.host, 80),
+        }
+        messages = [
+            {'type': 'http.request', 'body': content, 'more_body': False}]
+        response = {'status': None, 'body': []}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client never disconnects
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['body'].append(message.get('body', b''))
+
+        await self.application(scope, receive, send)
+        return response['status'], b''.join(response['body'])
+
+
+class HTTPTarget(object):
+    """Send requests to a running server"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Token ' + token
+        request = urllib.request.Request(
+            self.url + path, method=method, headers=headers,
+            data=json.dumps(body).encode() if body is not None else None)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.read()
+
+    def close(self):
+        pass
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted ``values``"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'mean': sum(latencies) / len(latencies) * 1000,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def login(number):
+    """Credentials of the generated user ``number``, counted from 0"""
+    return {
+        'username': USERNAME_PREFIX + '%08d' % (number + 1),
+        'password': PASSWORD}
+
+
+def access_token(status, content):
+    if status != 201:
+        raise ValueError('Login of the generated users failed (%d)' % status)
+    return json.loads(content)['access_token']
+
+
+def run_route(target, route, requests, concurrency, users=1, warmup=0):
+    """Send ``requests`` requests of a route from ``concurrency`` threads
+
+    Returns the summary of the route: request and error counts, throughput
+    in requests per second and p50/p95/p99 latency in milliseconds. Logins
+    rotate over the first ``users`` generated users, the other routes
+    authenticate with a token obtained by logging in once.
+    """
+    method, path, body = route
+    token = access_token(*target.request('POST', '/user/login/', login(0)))
+
+    counter = iter(range(warmup + requests))
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def work():
+        try:
+            while True:
+                with lock:
+                    number = next(counter, None)
+                if number is None:
+                    return
+                data = login(number % users) if method == 'POST' else body
+                start = time.perf_counter()
+                status, content = target.request(method, path, data, token)
+                latency = time.perf_counter() - start
+                if number < warmup:
+                    continue
+                with lock:
+                    latencies.append(latency)
+                    if status >= 400:
+                        errors[0] += 1
+        finally:
+            target.close()
+
+    threads = [threading.Thread(target=work) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+async def arun_route(target, route, requests, concurrency, users=1,
+                     warmup=0):
+    """Async version of ``run_route``, with ``concurrency`` tasks"""
+    method, path, body = route
+    token = access_token(
+        *await target.request('POST', '/user/login/', login(0)))
+
+    counter = iter(range(warmup + requests))
+    latencies = []
+    errors = [0]
+
+    async def work():
+        for number in counter:
+            data = login(number % users) if method == 'POST' else body
+            start = time.perf_counter()
+            status, content = await target.request(method, path, data, token)
+            if number < warmup:
+                continue
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[work() for i in range(concurrency)])
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Regressions of ``results`` against ``baseline``
+
+    A route regresses when its p95 latency grows or its throughput drops by
+    more than ``tolerance``, or when it starts failing requests. Returns a
+    list of messages, empty when nothing regressed.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if result['p95'] > previous['p95'] * (1 + tolerance):
+            regressions.append('%s: p95 %.1fms, baseline %.1fms' % (
+                name, result['p95'], previous['p95']))
+        if result['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append('%s: %.0f req/s, baseline %.0f req/s' % (
+                name, result['throughput'], previous['throughput']))
+        if result['errors'] > previous['errors']:
+            regressions.append('%s: %d errors, baseline %d' % (
+                name, result['errors'], previous['errors']))
+    return regressions
+
+
+def startup_time(args, url, cwd=None, env=None, timeout=60):
+    """Seconds from running ``args`` until the server answers ``url``
+
+    Any HTTP response counts, the server is stopped afterwards.
+    """
+    started = time.monotonic()
+    process = subprocess.Popen(
+        args, cwd=cwd, env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    try:
+        while time.monotonic() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(
+                    'Server exited with status %s' % process.returncode)
+            try:
+                urllib.request.urlopen(url, timeout=1).close()
+            except urllib.error.HTTPError:
+                pass
+            except OSError:
+                time.sleep(0.02)
+                continue
+            return time.monotonic() - started
+        raise RuntimeError('Server not answering after %ss' % timeout)
+    finally:
+        process.terminate()
+        process.wait()
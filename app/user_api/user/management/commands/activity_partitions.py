@@ -0,0 +1,48 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from user import partitions
+from user.reports import truncate
+
+
+class Command(BaseCommand):
+    help = (
+        'Maintain the monthly partitions of ActivityReport: create the '
+        'upcoming ones and drop the ones past the retention period')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert', action='store_true',
+            help='Convert ActivityReport to a partitioned table first')
+        parser.add_argument(
+            '--ahead', type=int, default=3,
+            help='Months to create after the current one')
+        parser.add_argument(
+            '--retention-months', type=int,
+            default=getattr(settings, 'ACTIVITY_REPORT_RETENTION_MONTHS', None),
+            help='Drop partitions older than this number of months')
+
+    def handle(self, *args, **options):
+        if options['convert'] and partitions.convert(ahead=options['ahead']):
+            self.stdout.write('Converted ActivityReport to a partitioned table')
+
+        this_month = truncate(datetime.date.today(), 'month')
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                raise CommandError(
+                    'ActivityReport is not partitioned, run with --convert')
+
+            created = partitions.create_partitions(
+                cursor, this_month,
+                partitions.add_months(this_month, options['ahead']))
+            for name in created:
+                self.stdout.write('Created partition %s' % name)
+
+            if options['retention_months'] is not None:
+                before = partitions.add_months(
+                    this_month, -options['retention_months'])
+                for name in partitions.drop_partitions(cursor, before):
+                    self.stdout.write('Dropped partition %s' % name)
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from user import dataset
+from user.loadtest import (
+    DEFAULT_ROUTES, ASGITarget, WSGITarget, arun_route, routes,
+    run_route)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare a read route served by the async views under ASGI with the '
+        'sync viewsets under WSGI, on the generated dataset')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--route', choices=DEFAULT_ROUTES[1:], default='user-list')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument(
+            '--concurrency', type=int, default=50,
+            help='Requests in flight on the ASGI worker')
+        parser.add_argument(
+            '--wsgi-threads', type=int, default=4,
+            help='Threads of the WSGI worker')
+        parser.add_argument(
+            '--query-delay', type=float, default=0,
+            help='Milliseconds added to every SQL statement to simulate a '
+            'slow database')
+
+    def handle(self, *args, **options):
+        if not dataset.dataset_users().exists():
+            raise CommandError("No generated users, run 'generate_dataset'")
+        if options['query_delay']:
+            delay = options['query_delay'] / 1000
+
+            def slow_execute(execute, sql, params, many, context):
+                time.sleep(delay)
+                return execute(sql, params, many, context)
+
+            def add_delay(sender, connection, **kwargs):
+                connection.execute_wrappers.insert(0, slow_execute)
+
+            connection_created.connect(add_delay, weak=False)
+
+        route = routes(dataset.dataset_users().earliest('id').id)[
+            options['route']]
+        results = [('wsgi', options['wsgi_threads'], run_route(
+            WSGITarget(), route, options['requests'],
+            options['wsgi_threads']))]
+        with override_settings(ROOT_URLCONF='user_api.asgi_urls'):
+            results.append(('asgi', options['concurrency'], asyncio.run(
+                arun_route(
+                    ASGITarget(), route, options['requests'],
+                    options['concurrency']))))
+
+        self.stdout.write('%-5s %11s %8s %6s %10s %9s %9s %9s' % (
+            'path', 'concurrency', 'requests', 'errors', 'req/s', 'p50 ms',
+            'p95 ms', 'p99 ms'))
+        for name, concurrency, result in results:
+            self.stdout.write(
+                '%-5s %11d %8d %6d %10.1f %9.1f %9.1f %9.1f' % (
+                    name, concurrency, result['requests'], result['errors'],
+                    result['throughput'], result['p50'], result['p95'],
+                    result['p99']))
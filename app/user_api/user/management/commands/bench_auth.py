@@ -0,0 +1,53 @@
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from user.authentication import (
+    SignedTokenAuthentication, issue_signed_token, revocations)
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-request cost of authtoken and signed token auth'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        username = 'bench-auth-%s' % uuid.uuid4().hex
+        if User.objects.filter(username=username).exists():
+            raise CommandError('User %s already exists' % username)
+        # The throwaway user and its token are rolled back with the rest
+        with transaction.atomic():
+            self.bench(username, options)
+            transaction.set_rollback(True)
+
+    def bench(self, username, options):
+        user = User.objects.create(username=username)
+        token = Token.objects.create(user=user)
+        factory = APIRequestFactory()
+        cases = [
+            ('authtoken', TokenAuthentication(), 'Token ' + token.key),
+            ('signed', SignedTokenAuthentication(),
+             'Bearer ' + issue_signed_token(user)),
+        ]
+        revocations.refresh(force=True)
+        for name, backend, header in cases:
+            request = factory.get('/user/', HTTP_AUTHORIZATION=header)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for i in range(options['requests']):
+                    backend.authenticate(request)
+                elapsed = time.perf_counter() - start
+
+            self.stdout.write(
+                '%-9s %8.1f us/request  %5.2f queries/request' % (
+                    name, elapsed / options['requests'] * 1e6,
+                    len(queries) / options['requests']))
@@ -0,0 +1,84 @@
+import tempfile
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from user.events import BufferedEventWriter, SyncEventWriter
+from user.models import ActivityReport
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare login event throughput of the sync and buffered writers, '
+        'in a scratch database created and dropped by the command')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=5000)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument(
+            '--mode', choices=['sync', 'buffered', 'both'], default='both')
+        parser.add_argument('--max-events', type=int, default=500)
+        parser.add_argument('--no-fsync', action='store_true')
+
+    def handle(self, *args, **options):
+        # The writers commit from their own threads and record() updates
+        # the shared activity sketches and counters, which cannot be
+        # rolled back or cleaned up afterwards
+        name = '%s_bench_login_%s' % (
+            connection.settings_dict['NAME'], uuid.uuid4().hex[:8])
+        test_settings = connection.settings_dict['TEST']
+        connection.settings_dict['TEST'] = dict(test_settings, NAME=name)
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=False, serialize=False)
+        try:
+            self.bench(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            connection.settings_dict['TEST'] = test_settings
+
+    def bench(self, options):
+        username = 'bench-login-%s' % uuid.uuid4().hex
+        if User.objects.filter(username=username).exists():
+            raise CommandError('User %s already exists' % username)
+        user = User.objects.create(username=username, is_active=False)
+        modes = ['sync', 'buffered'] if options['mode'] == 'both' else [
+            options['mode']]
+        for mode in modes:
+            with tempfile.TemporaryDirectory() as spool_dir:
+                if mode == 'sync':
+                    writer = SyncEventWriter()
+                else:
+                    writer = BufferedEventWriter(
+                        spool_dir, max_events=options['max_events'],
+                        fsync=not options['no_fsync'])
+                elapsed = self.run(writer, user, options)
+
+            recorded = ActivityReport.objects.filter(user=user).count()
+            self.stdout.write(
+                '%-9s %7d events  %7.2fs  %9.0f events/s' % (
+                    mode, recorded, elapsed, recorded / elapsed))
+            ActivityReport.objects.filter(user=user).delete()
+
+    def run(self, writer, user, options):
+        per_thread = options['events'] // options['threads']
+
+        def work():
+            try:
+                for i in range(per_thread):
+                    writer.record(user)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=work) for i in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+        return time.perf_counter() - start
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from user import dataset
+from user.loadtest import DEFAULT_ROUTES, WSGITarget, routes, run_route
+from user.pool import close_pools, pools
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the cost per request of a route with fresh database '
+        'connections and with the connection pool')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--route', choices=DEFAULT_ROUTES[1:], default='user-detail')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=4)
+
+    def handle(self, *args, **options):
+        if not dataset.dataset_users().exists():
+            raise CommandError("No generated users, run 'generate_dataset'")
+        route = routes(dataset.dataset_users().earliest('id').id)[
+            options['route']]
+        # Shared by the connections of every thread
+        database_options = connections.settings['default']['OPTIONS']
+        pool_options = database_options.get('pool') or {
+            'min_size': options['concurrency'],
+            'max_size': options['concurrency']}
+
+        # Without the pool every Django connection is a new Postgres one
+        connects = [0]
+
+        def count_connect(sender, connection, **kwargs):
+            connects[0] += 1
+
+        connection_created.connect(count_connect, weak=False)
+        self.stdout.write('%-7s %8s %10s %9s %9s %9s %9s' % (
+            'mode', 'requests', 'req/s', 'mean ms', 'p50 ms', 'p95 ms',
+            'connects'))
+        try:
+            for mode in ('direct', 'pool'):
+                close_pools()
+                if mode == 'pool':
+                    database_options['pool'] = pool_options
+                else:
+                    database_options.pop('pool', None)
+                connects[0] = 0
+                result = run_route(
+                    WSGITarget(), route, options['requests'],
+                    options['concurrency'])
+                if mode == 'pool':
+                    connects[0] = sum(
+                        pool.get_stats().get('connections_num', 0)
+                        for alias, pool in pools())
+                self.stdout.write(
+                    '%-7s %8d %10.1f %9.2f %9.2f %9.2f %9d' % (
+                        mode, result['requests'], result['throughput'],
+                        result['mean'], result['p50'], result['p95'],
+                        connects[0]))
+        finally:
+            close_pools()
+            database_options['pool'] = pool_options
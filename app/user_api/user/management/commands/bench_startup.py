@@ -0,0 +1,51 @@
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from user.loadtest import startup_time
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the cold start of the production server: the time from '
+        'running gunicorn until it answers a first request')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3)
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument(
+            '--interface', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--max-seconds', type=float,
+            help='Fail when the median start time is above this')
+
+    def handle(self, *args, **options):
+        env = dict(
+            os.environ, PORT=str(options['port']),
+            WEB_CONCURRENCY=str(options['workers']),
+            SERVER_INTERFACE=options['interface'], DJANGO_DEBUG='0',
+            DJANGO_ALLOWED_HOSTS='127.0.0.1')
+        url = 'http://127.0.0.1:%s/openapi.json' % options['port']
+        args = [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py']
+
+        times = []
+        for run in range(options['runs']):
+            try:
+                times.append(startup_time(
+                    args, url, cwd=settings.BASE_DIR, env=env))
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            self.stdout.write('run %d: %.3fs' % (run + 1, times[-1]))
+
+        times.sort()
+        median = times[len(times) // 2]
+        self.stdout.write(
+            'min %.3fs median %.3fs max %.3fs' % (times[0], median, times[-1]))
+        if options['max_seconds'] is not None and (
+                median > options['max_seconds']):
+            raise CommandError(
+                'Start time %.3fs above %.3fs' % (
+                    median, options['max_seconds']))
@@ -0,0 +1,62 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework.renderers import JSONRenderer
+
+from user.renderers import FastJSONRenderer
+from user.serializers import UserModelSerializer, user_data, user_values
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the user list serialization with UserModelSerializer and '
+        'JSONRenderer against the values() fast path and FastJSONRenderer')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        count = options['users']
+        ids = list(User.objects.order_by('id').values_list(
+            'id', flat=True)[:count])
+        if len(ids) < count:
+            raise CommandError(
+                'Only %d users, run generate_dataset --users %d' % (
+                    len(ids), count))
+        queryset = User.objects.filter(id__lte=ids[-1]).order_by('id')
+
+        def serializer_path():
+            data = UserModelSerializer(queryset.all(), many=True).data
+            return data, JSONRenderer().render(data)
+
+        def fast_path():
+            data = [user_data(row) for row in user_values(queryset)]
+            return data, FastJSONRenderer().render(data)
+
+        if serializer_path()[1] != fast_path()[1]:
+            raise CommandError('The fast path output differs')
+
+        self.stdout.write('%-12s %10s %12s %12s %12s' % (
+            'path', 'rows', 'total rows/s', 'build ms', 'render ms'))
+        for name, build, renderer in [
+                ('serializer', lambda: UserModelSerializer(
+                    queryset.all(), many=True).data, JSONRenderer()),
+                ('fast', lambda: [
+                    user_data(row) for row in user_values(queryset)],
+                 FastJSONRenderer())]:
+            build_time = render_time = 0
+            for i in range(options['repeat']):
+                start = time.perf_counter()
+                data = build()
+                built = time.perf_counter()
+                renderer.render(data)
+                build_time += built - start
+                render_time += time.perf_counter() - built
+            total = build_time + render_time
+            self.stdout.write('%-12s %10d %12.0f %12.1f %12.1f' % (
+                name, count, count * options['repeat'] / total,
+                build_time * 1000 / options['repeat'],
+                render_time * 1000 / options['repeat']))
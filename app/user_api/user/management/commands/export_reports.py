@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from user import exports
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the queued report exports and delete the expired export '
+        'files')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            help='Keep running, looking for new exports every this many '
+                 'seconds')
+        parser.add_argument(
+            '--stale-after', type=float, default=600,
+            help='Queue again the running exports without progress for '
+                 'this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = exports.requeue_stale(options['stale_after'])
+            expired = exports.expire()
+            done = exports.process()
+            if done or requeued or expired or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(
+                    'Ran %s exports, requeued %s, expired %s' % (
+                        done, requeued, expired)))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
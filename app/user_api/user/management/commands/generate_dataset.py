@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user import dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate load test users and skewed login histories, '
+        'e.g. --users 1000000 --events 100000000')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--events', type=int, default=1000000)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--user-skew', type=float, default=3.0)
+        parser.add_argument('--day-skew', type=float, default=2.0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000000)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete a previously generated dataset first')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be positive')
+        if options['clear']:
+            deleted = dataset.clear()
+            self.stdout.write('Deleted %d generated users' % deleted)
+        elif dataset.dataset_users().exists():
+            raise CommandError(
+                'A generated dataset already exists, use --clear to replace it')
+
+        start = time.perf_counter()
+        first_id, last_id = dataset.generate_users(
+            options['users'], seed=options['seed'])
+        self.stdout.write('%d users in %.2fs' % (
+            options['users'], time.perf_counter() - start))
+
+        start = time.perf_counter()
+
+        def progress(generated):
+            elapsed = time.perf_counter() - start
+            self.stdout.write('%d events, %.0f rows/s' % (
+                generated, generated / elapsed))
+
+        generated = dataset.generate_events(
+            first_id, last_id, options['events'], days=options['days'],
+            user_skew=options['user_skew'], day_skew=options['day_skew'],
+            seed=options['seed'], batch_size=options['batch_size'],
+            progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            'Generated %d users and %d login events in %.2fs, '
+            "run 'manage.py loadtest' to benchmark" % (
+                options['users'], generated, time.perf_counter() - start)))
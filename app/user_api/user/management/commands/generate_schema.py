@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from user import schema
+
+
+class Command(BaseCommand):
+    help = 'Write the OpenAPI schema served at /openapi.json'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default=settings.OPENAPI_SCHEMA_FILE,
+            help='Schema file, defaults to OPENAPI_SCHEMA_FILE')
+
+    def handle(self, *args, **options):
+        content = schema.generate()
+        with open(options['output'], 'wb') as f:
+            f.write(content)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Wrote the OpenAPI schema to %s (%s bytes)' % (
+                options['output'], len(content))))
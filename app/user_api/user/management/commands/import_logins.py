@@ -0,0 +1,46 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user.imports import READERS, LoginImporter
+
+
+class Command(BaseCommand):
+    help = (
+        'Import historical login events from a CSV or NDJSON file with '
+        'user_id or username and date fields')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, '-' for stdin")
+        parser.add_argument('--format', choices=sorted(READERS))
+        parser.add_argument('--batch-size', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format']
+        if not file_format:
+            file_format = 'ndjson' if path.endswith(
+                ('.ndjson', '.jsonl')) else 'csv'
+
+        importer = LoginImporter(batch_size=options['batch_size'])
+        start = time.perf_counter()
+
+        def progress(importer):
+            elapsed = time.perf_counter() - start
+            self.stdout.write('%d imported, %d skipped, %.0f rows/s' % (
+                importer.imported, importer.skipped,
+                (importer.imported + importer.skipped) / elapsed))
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='')
+        except OSError as exc:
+            raise CommandError(exc)
+        with stream:
+            importer.run(READERS[file_format](stream), progress=progress)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d login events in %.2fs (%.0f rows/s), skipped %d' % (
+                importer.imported, elapsed, importer.imported / elapsed,
+                importer.skipped)))
@@ -0,0 +1,84 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user import dataset
+from user.loadtest import (
+    DEFAULT_ROUTES, HTTPTarget, WSGITarget, compare, routes, run_route)
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the API routes concurrently against the generated dataset, '
+        'report p50/p95/p99 latency and throughput and flag regressions '
+        'against a stored baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--routes', nargs='+', choices=DEFAULT_ROUTES,
+            default=DEFAULT_ROUTES)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--warmup', type=int, default=50)
+        parser.add_argument(
+            '--login-users', type=int, default=1000,
+            help='Number of generated users the login route rotates over')
+        parser.add_argument(
+            '--url', help='Base URL of a running server, requests go '
+            'through the Django handler in process otherwise')
+        parser.add_argument('--baseline', default='loadtest-baseline.json')
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Store the results as the new baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Allowed relative change before flagging a regression')
+
+    def handle(self, *args, **options):
+        if not dataset.dataset_users().exists():
+            raise CommandError("No generated users, run 'generate_dataset'")
+        target = HTTPTarget(options['url']) if options['url'] else (
+            WSGITarget())
+        available = routes(dataset.dataset_users().earliest('id').id)
+
+        results = {}
+        self.stdout.write('%-14s %8s %6s %10s %9s %9s %9s' % (
+            'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms',
+            'p99 ms'))
+        for name in options['routes']:
+            try:
+                result = run_route(
+                    target, available[name], options['requests'],
+                    options['concurrency'], users=options['login_users'],
+                    warmup=options['warmup'])
+            except ValueError as exc:
+                raise CommandError(exc)
+            results[name] = result
+            self.stdout.write('%-14s %8d %6d %10.1f %9.1f %9.1f %9.1f' % (
+                name, result['requests'], result['errors'],
+                result['throughput'], result['p50'], result['p95'],
+                result['p99']))
+
+        baseline_path = options['baseline']
+        if options['save_baseline']:
+            with open(baseline_path, 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write('Baseline saved to %s' % baseline_path)
+            return
+        if not os.path.exists(baseline_path):
+            self.stdout.write(
+                'No baseline at %s, use --save-baseline to store one' % (
+                    baseline_path))
+            return
+
+        with open(baseline_path) as baseline_file:
+            regressions = compare(
+                results, json.load(baseline_file), options['tolerance'])
+        for regression in regressions:
+            self.stderr.write('Regression: ' + regression)
+        if regressions:
+            raise CommandError('%d regressions against %s' % (
+                len(regressions), baseline_path))
+        self.stdout.write(self.style.SUCCESS(
+            'No regression against %s' % baseline_path))
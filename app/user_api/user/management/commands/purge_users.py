@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from user.purge import purge_users
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete the users removed through the API and their login events, '
+        'in small batches')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Rows deleted per statement')
+        parser.add_argument(
+            '--pause', type=float, default=0.1,
+            help='Seconds to wait between batches')
+        parser.add_argument(
+            '--interval', type=float,
+            help='Keep running, looking for new users every this many '
+                 'seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            users, events = purge_users(
+                options['batch_size'], options['pause'])
+            if users or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(
+                    'Purged %s users and %s login events' % (users, events)))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
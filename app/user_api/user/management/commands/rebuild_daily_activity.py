@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from user.models import ActiveUserSketch, DailyActivity, TopUserCounter
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the daily login rollup, the active user sketches and the '
+        'top user counters from the raw ActivityReport rows')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rows = DailyActivity.objects.rebuild()
+            ActiveUserSketch.objects.rebuild()
+            TopUserCounter.objects.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt daily activity rollup: %s rows' % rows))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from user.events import replay_spool
+
+
+class Command(BaseCommand):
+    help = 'Write the login events left in spool files by stopped processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--spool-dir',
+            help='Spool directory, defaults to the LOGIN_EVENT_WRITER one')
+
+    def handle(self, *args, **options):
+        spool_dir = options['spool_dir']
+        if not spool_dir:
+            config = getattr(settings, 'LOGIN_EVENT_WRITER', {})
+            spool_dir = config.get('OPTIONS', {}).get('spool_dir')
+        if not spool_dir:
+            self.stdout.write('No login event spool configured')
+            return
+
+        replayed = replay_spool(spool_dir)
+        self.stdout.write(self.style.SUCCESS(
+            'Replayed %s login events' % replayed))
@@ -0,0 +1,187 @@
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+from django.http import HttpResponse
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY,
+    generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from .pool import pools
+
+# Requests are labelled with the URL name resolved by Django, for the DRF
+# routers that is '<basename>-<action>', e.g. 'user-login'
+REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests',
+    ['route', 'method', 'status'])
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request',
+    ['route', 'method'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Size of non streaming response bodies',
+    ['route'],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000))
+REQUEST_QUERIES = Histogram(
+    'http_request_sql_queries', 'SQL statements executed by a request',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+REQUEST_SQL_TIME = Histogram(
+    'http_request_sql_duration_seconds', 'Time a request spent in SQL',
+    ['route'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5))
+LOGIN_EVENT_WRITE = Histogram(
+    'login_event_write_duration_seconds',
+    'Time spent recording a login event on the request path',
+    buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .5))
+
+
+class QueryRecorder(object):
+    """Database execute wrapper counting statements and their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware(object):
+    """Record latency, response size and SQL usage of every request"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start, recorder)
+        return response
+
+    def observe(self, request, response, elapsed, recorder):
+        match = request.resolver_match
+        route = match.url_name if match and match.url_name else 'unmatched'
+        REQUESTS.labels(route, request.method, response.status_code).inc()
+        REQUEST_LATENCY.labels(route, request.method).observe(elapsed)
+        REQUEST_QUERIES.labels(route).observe(recorder.count)
+        REQUEST_SQL_TIME.labels(route).observe(recorder.duration)
+        if not response.streaming:
+            RESPONSE_SIZE.labels(route).observe(len(response.content))
+
+
+class PoolCollector(object):
+    """Connection pool statistics, read from psycopg_pool when scraped
+
+    Pools are per process: in multiprocess mode only the pools of the
+    worker serving the scrape are reported, labelled with its pid.
+    """
+
+    def collect(self):
+        labels = ['alias', 'pid']
+        gauges = {
+            'pool_size': GaugeMetricFamily(
+                'db_pool_connections', 'Connections held by the pool',
+                labels=labels),
+            'pool_available': GaugeMetricFamily(
+                'db_pool_available_connections',
+                'Idle connections ready to be handed out', labels=labels),
+            'pool_max': GaugeMetricFamily(
+                'db_pool_max_connections', 'Largest size of the pool',
+                labels=labels),
+            'requests_waiting': GaugeMetricFamily(
+                'db_pool_waiting_requests',
+                'Requests waiting for a connection', labels=labels),
+        }
+        utilization = GaugeMetricFamily(
+            'db_pool_utilization',
+            'Connections in use over the largest size of the pool',
+            labels=labels)
+        counters = {
+            'requests_num': CounterMetricFamily(
+                'db_pool_requests', 'Connections requested from the pool',
+                labels=labels),
+            'requests_errors': CounterMetricFamily(
+                'db_pool_request_errors',
+                'Connection requests that timed out or failed',
+                labels=labels),
+            'requests_wait_ms': CounterMetricFamily(
+                'db_pool_wait_seconds',
+                'Time spent waiting for a connection', labels=labels),
+            'usage_ms': CounterMetricFamily(
+                'db_pool_usage_seconds',
+                'Time connections spent out of the pool', labels=labels),
+            'connections_num': CounterMetricFamily(
+                'db_pool_connects', 'Connections opened by the pool',
+                labels=labels),
+            'connections_ms': CounterMetricFamily(
+                'db_pool_connect_seconds', 'Time spent opening connections',
+                labels=labels),
+        }
+
+        pid = str(os.getpid())
+        for alias, pool in pools():
+            stats = pool.get_stats()
+            values = [alias, pid]
+            for key, gauge in gauges.items():
+                gauge.add_metric(values, stats.get(key, 0))
+            in_use = stats.get('pool_size', 0) - stats.get('pool_available', 0)
+            utilization.add_metric(
+                values, in_use / stats['pool_max'] if stats.get(
+                    'pool_max') else 0)
+            for key, counter in counters.items():
+                value = stats.get(key, 0)
+                counter.add_metric(
+                    values, value / 1000 if key.endswith('_ms') else value)
+
+        yield from gauges.values()
+        yield utilization
+        yield from counters.values()
+
+
+REGISTRY.register(PoolCollector())
+
+
+def metrics_registry():
+    """Registry to expose
+
+    When ``PROMETHEUS_MULTIPROC_DIR`` is set every worker process writes
+    its samples to mmap-backed files in that directory, and the values of
+    all the workers are aggregated when scraped.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(PoolCollector())
+        return registry
+    return REGISTRY
+
+
+def metrics_view(request):
+    """Expose the metrics in the Prometheus text format"""
+    return HttpResponse(
+        generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
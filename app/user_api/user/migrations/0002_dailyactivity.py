@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyActivity',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'date'), name='dailyactivity_user_date')],
+            },
+        ),
+        migrations.RunSQL(
+            'INSERT INTO user_dailyactivity (user_id, date, count) '
+            'SELECT user_id, date, COUNT(*) FROM user_activityreport '
+            'GROUP BY user_id, date',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:21
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Build the indexes without locking writes on large tables
+    atomic = False
+
+    dependencies = [
+        ('user', '0002_dailyactivity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='activityreport',
+            index=models.Index(fields=['user', 'date'], name='activityreport_user_date'),
+        ),
+        AddIndexConcurrently(
+            model_name='dailyactivity',
+            index=models.Index(fields=['date', 'user'], name='dailyactivity_date_user'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0003_report_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenRevocation',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('user_id', models.IntegerField(unique=True)),
+                ('revoked_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:33
+
+from django.conf import settings
+from django.db import migrations
+
+
+def partition_activity_report(apps, schema_editor):
+    """Opt-in: only runs when ACTIVITY_REPORT_PARTITIONING is enabled
+
+    Later conversions are done with ``activity_partitions --convert``.
+    """
+    if not getattr(settings, 'ACTIVITY_REPORT_PARTITIONING', False):
+        return
+
+    from user.partitions import convert
+    convert()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0004_tokenrevocation'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            partition_activity_report, migrations.RunPython.noop),
+    ]
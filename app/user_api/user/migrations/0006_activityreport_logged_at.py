@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:35
+
+import django.contrib.postgres.indexes
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 50000
+
+
+def backfill_logged_at(apps, schema_editor):
+    """Older events only know their day, they are placed at midnight UTC
+
+    Rows are updated by ranges of ids, each batch committed on its own, so
+    no long transaction holds the locks of the whole table.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(id), MAX(id) FROM user_activityreport')
+        first, last = cursor.fetchone()
+        if first is None:
+            return
+        for start in range(first, last + 1, BATCH_SIZE):
+            cursor.execute(
+                "UPDATE user_activityreport "
+                "SET logged_at = date::timestamp AT TIME ZONE 'UTC' "
+                "WHERE id >= %s AND id < %s AND logged_at IS NULL",
+                [start, start + BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    # The backfill commits batch by batch
+    atomic = False
+
+    dependencies = [
+        ('user', '0005_partition_activityreport'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activityreport',
+            name='logged_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_logged_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='activityreport',
+            name='logged_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='activityreport',
+            index=django.contrib.postgres.indexes.BrinIndex(autosummarize=True, fields=['logged_at'], name='activityreport_logged_at'),
+        ),
+    ]
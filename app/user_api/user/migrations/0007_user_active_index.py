@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:20
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    # Build the index without locking writes on the user table
+    atomic = False
+
+    dependencies = [
+        ('user', '0006_activityreport_logged_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # auth_user belongs to django.contrib.auth, the user list pages
+        # through active users in id order
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS user_active_id '
+            'ON auth_user (id) WHERE is_active',
+            reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS user_active_id',
+        ),
+    ]
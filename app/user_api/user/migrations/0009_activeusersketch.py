@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:42
+
+from django.db import migrations, models
+
+# Sketch layout of user.sketches: levels of 2048 bytes, one bit for each of
+# the 16384 registers. Bits are set from the highest level of the rank down
+# and stop at the first one already set, the lower ones are set too.
+ADD_FUNCTION = """
+CREATE OR REPLACE FUNCTION user_sketch_add(
+    sketch bytea, registers integer[], ranks integer[]) RETURNS bytea AS $$
+DECLARE
+    i integer;
+    level integer;
+BEGIN
+    FOR i IN 1 .. coalesce(array_length(registers, 1), 0) LOOP
+        IF length(sketch) < ranks[i] * 2048 THEN
+            sketch := sketch || decode(
+                repeat('00', ranks[i] * 2048 - length(sketch)), 'hex');
+        END IF;
+        FOR level IN REVERSE ranks[i] - 1 .. 0 LOOP
+            EXIT WHEN get_bit(sketch, level * 16384 + registers[i]) = 1;
+            sketch := set_bit(sketch, level * 16384 + registers[i], 1);
+        END LOOP;
+    END LOOP;
+    RETURN sketch;
+END
+$$ LANGUAGE plpgsql IMMUTABLE
+"""
+
+COVERS_FUNCTION = """
+CREATE OR REPLACE FUNCTION user_sketch_covers(
+    sketch bytea, registers integer[], ranks integer[]) RETURNS boolean AS $$
+    SELECT coalesce(bool_and(CASE
+        WHEN length(sketch) < r.rank * 2048 THEN false
+        ELSE get_bit(sketch, (r.rank - 1) * 16384 + r.register) = 1
+    END), true)
+    FROM unnest(registers, ranks) AS r(register, rank)
+$$ LANGUAGE sql IMMUTABLE
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0008_userpurge'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActiveUserSketch',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('span', models.CharField(choices=[('day', 'day'), ('month', 'month')], max_length=5)),
+                ('date', models.DateField()),
+                ('registers', models.BinaryField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('span', 'date'), name='activeusersketch_span_date')],
+            },
+        ),
+        migrations.RunSQL(
+            ADD_FUNCTION,
+            reverse_sql='DROP FUNCTION user_sketch_add(bytea, integer[], integer[])',
+        ),
+        migrations.RunSQL(
+            COVERS_FUNCTION,
+            reverse_sql='DROP FUNCTION user_sketch_covers(bytea, integer[], integer[])',
+        ),
+        # Sketch the logins recorded so far
+        migrations.RunSQL(
+            "INSERT INTO user_activeusersketch (span, date, registers) "
+            "SELECT span, start, user_sketch_add(''::bytea, array_agg(register), array_agg(rank)) "
+            "FROM ("
+            "  SELECT span, start, (hash & 16383)::integer AS register,"
+            "    MAX(51 - length(ltrim((hash >> 14)::bit(50)::text, '0'))) AS rank"
+            "  FROM ("
+            "    SELECT date, hashint4extended(user_id, 0) AS hash"
+            "    FROM user_activityreport"
+            "  ) AS hashed, LATERAL (VALUES"
+            "    ('day', date), ('month', date_trunc('month', date)::date)"
+            "  ) AS spans(span, start)"
+            "  GROUP BY span, start, register"
+            ") AS ranked GROUP BY span, start",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
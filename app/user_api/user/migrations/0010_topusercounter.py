@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_activeusersketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopUserCounter',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('span', models.CharField(choices=[('day', 'day'), ('month', 'month')], max_length=5)),
+                ('date', models.DateField()),
+                ('user_id', models.IntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('error', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('span', 'date', 'user_id'), name='topusercounter_span_date_user')],
+            },
+        ),
+        # Exact counters of the top 1000 users of every day and month logged
+        # so far
+        migrations.RunSQL(
+            "INSERT INTO user_topusercounter (span, date, user_id, count, error) "
+            "SELECT span, start, user_id, count, 0 FROM ("
+            "  SELECT span, start, user_id, SUM(count) AS count, row_number() OVER ("
+            "    PARTITION BY span, start ORDER BY SUM(count) DESC, user_id"
+            "  ) AS position"
+            "  FROM user_dailyactivity, LATERAL (VALUES"
+            "    ('day', date), ('month', date_trunc('month', date)::date)"
+            "  ) AS spans(span, start)"
+            "  GROUP BY span, start, user_id"
+            ") AS ranked WHERE position <= 1000",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
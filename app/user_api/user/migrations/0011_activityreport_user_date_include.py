@@ -0,0 +1,94 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+TABLE = 'user_activityreport'
+OLD_INDEX = 'activityreport_user_date'
+NEW_INDEX = 'activityreport_user_date_incl'
+COLUMNS = {
+    OLD_INDEX: '(user_id, date)',
+    NEW_INDEX: '(user_id, date) INCLUDE (logged_at, id)',
+}
+
+
+def create_index(cursor, name):
+    """Build the index ``name`` without blocking writes
+
+    ``CONCURRENTLY`` is not supported on partitioned tables: the index is
+    then created on the parent only, built concurrently on each partition
+    and attached, it becomes valid once every partition has it.
+    """
+    from user.partitions import bounds, is_partitioned
+
+    if not is_partitioned(cursor):
+        cursor.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+            'ON {table} {columns}'.format(
+                name=name, table=TABLE, columns=COLUMNS[name]))
+        return
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {columns}'.format(
+            name=name, table=TABLE, columns=COLUMNS[name]))
+    for partition, bound in bounds(cursor):
+        partition_index = '%s_%s' % (partition, name)
+        cursor.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} '
+            'ON {partition} {columns}'.format(
+                index=partition_index, partition=partition,
+                columns=COLUMNS[name]))
+        cursor.execute('ALTER INDEX {name} ATTACH PARTITION {index}'.format(
+            name=name, index=partition_index))
+
+
+def drop_index(cursor, name):
+    """Drop the index ``name``, concurrently unless the table is partitioned
+
+    Dropping a partitioned index is a catalog change, the lock it takes on
+    the table is short.
+    """
+    from user.partitions import is_partitioned
+
+    cursor.execute('DROP INDEX {concurrently} IF EXISTS {name}'.format(
+        concurrently='' if is_partitioned(cursor) else 'CONCURRENTLY',
+        name=name))
+
+
+def replace_index(old, new):
+    def replace(apps, schema_editor):
+        with schema_editor.connection.cursor() as cursor:
+            create_index(cursor, new)
+            drop_index(cursor, old)
+    return replace
+
+
+class Migration(migrations.Migration):
+
+    # The covering index is built next to the old one without locking
+    # writes, the old one is dropped once it is ready
+    atomic = False
+
+    dependencies = [
+        ('user', '0010_topusercounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    replace_index(OLD_INDEX, NEW_INDEX),
+                    replace_index(NEW_INDEX, OLD_INDEX)),
+            ],
+            state_operations=[
+                migrations.RemoveIndex(
+                    model_name='activityreport',
+                    name='activityreport_user_date',
+                ),
+                migrations.AddIndex(
+                    model_name='activityreport',
+                    index=models.Index(fields=['user', 'date'], include=('logged_at', 'id'), name='activityreport_user_date_incl'),
+                ),
+            ],
+        ),
+    ]
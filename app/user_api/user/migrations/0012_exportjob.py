@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0011_activityreport_user_date_include'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=64)),
+                ('params', models.JSONField()),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed'), ('expired', 'expired')], default='queued', max_length=7)),
+                ('rows', models.PositiveBigIntegerField(default=0)),
+                ('file', models.CharField(blank=True, max_length=100)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('expires_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='exportjob_status_id')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running', 'done'])), fields=('key',), name='exportjob_active_key')],
+            },
+        ),
+    ]
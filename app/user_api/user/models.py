@@ -1,8 +1,397 @@
-from django.db import models
+from django.db import connection, models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import BrinIndex
+from django.utils import timezone
+
+from . import sketches
+
+
+class ActivityReportManager(models.Manager):
+
+    def record(self, events):
+        """Store login events, update the rollup, summaries and ``last_login``
+
+        ``events`` is a list of ``(user_id, logged_at)`` tuples. Everything
+        is done by one statement: the events are unnested from arrays and
+        fed to data-modifying CTEs, so a login costs a single round trip
+        and a batch of any size costs the same. The event dates are given
+        explicitly, ``bulk_create`` would overwrite them through
+        ``auto_now_add``.
+        """
+        if not events:
+            return
+        user_ids = [user_id for user_id, logged_at in events]
+        dates = [timezone.localdate(logged_at) for user_id, logged_at in events]
+        timestamps = [logged_at for user_id, logged_at in events]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'WITH events AS ('
+                '  SELECT * FROM unnest('
+                '    %s::integer[], %s::date[], %s::timestamptz[]'
+                '  ) AS e(user_id, date, logged_at)'
+                '), inserted AS ('
+                '  INSERT INTO {events} (user_id, date, logged_at)'
+                '  SELECT user_id, date, logged_at FROM events'
+                '), rollup AS ('
+                '  INSERT INTO {rollup} (user_id, date, count)'
+                '  SELECT user_id, date, COUNT(*) FROM events'
+                '  GROUP BY user_id, date'
+                '  ON CONFLICT (user_id, date) DO UPDATE'
+                '  SET count = {rollup}.count + EXCLUDED.count'
+                '), {sketch}, {top} '
+                'UPDATE {users} SET last_login = latest.logged_at FROM ('
+                '  SELECT user_id, MAX(logged_at) AS logged_at FROM events'
+                '  GROUP BY user_id'
+                ') AS latest '
+                'WHERE {users}.id = latest.user_id AND ('
+                '  {users}.last_login IS NULL'
+                '  OR {users}.last_login < latest.logged_at'
+                ')'.format(
+                    events=self.model._meta.db_table,
+                    rollup=DailyActivity._meta.db_table,
+                    sketch=ActiveUserSketch.objects.add_sql('events'),
+                    top=TopUserCounter.objects.add_sql(
+                        '(SELECT user_id, date, 1 AS count FROM events)'
+                        ' AS logins'),
+                    users=User._meta.db_table),
+                [user_ids, dates, timestamps])
 
 
 class ActivityReport(models.Model):
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, models.CASCADE)
     date = models.DateField(auto_now_add=True)
+    logged_at = models.DateTimeField(default=timezone.now)
+
+    objects = ActivityReportManager()
+
+    class Meta:
+        indexes = [
+            # Covers the timeline of a user, read with index-only scans
+            models.Index(
+                fields=['user', 'date'], include=['logged_at', 'id'],
+                name='activityreport_user_date_incl'),
+            # Rows are appended in time order, a BRIN index stays tiny and
+            # lets time range scans skip unrelated block ranges
+            BrinIndex(
+                fields=['logged_at'], name='activityreport_logged_at',
+                autosummarize=True),
+        ]
+
+
+class DailyActivityManager(models.Manager):
+
+    def rebuild(self):
+        """Recompute the whole rollup from the raw login events"""
+        table = self.model._meta.db_table
+        source = ActivityReport._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {table}'.format(table=table))
+            cursor.execute(
+                'INSERT INTO {table} (user_id, date, count) '
+                'SELECT user_id, date, COUNT(*) FROM {source} '
+                'GROUP BY user_id, date'.format(table=table, source=source))
+            return cursor.rowcount
+
+
+class DailyActivity(models.Model):
+    """Number of logins per user and day, kept in sync with ActivityReport"""
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, models.CASCADE)
+    date = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    objects = DailyActivityManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'date'], name='dailyactivity_user_date'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['date', 'user'], name='dailyactivity_date_user'),
+        ]
+
+
+class ActiveUserSketchManager(models.Manager):
+
+    def add_sql(self, source):
+        """CTEs adding the users of ``source`` to the day and month sketches
+
+        ``source`` is a table, CTE or aliased subquery with ``user_id`` and
+        ``date`` columns. User ids are hashed with ``hashint4extended``,
+        the low bits of the hash pick the register and the leading zeros
+        of the others give the rank. The ranks of a day, and of its month,
+        are added by the ``user_sketch_add`` function (migration 0009).
+        Ranks already in the sketch are filtered out before the upsert:
+        ``ON CONFLICT`` locks the row even when its ``WHERE`` is false, and
+        every login would wait on the transactions holding the day and
+        month rows. Only the first login of a user in the day or the month
+        at most reaches the upsert.
+        """
+        return (
+            'sketch_ranks AS ('
+            '  SELECT span, start, array_agg(register) AS registers,'
+            '    array_agg(rank) AS ranks FROM ('
+            '      SELECT span, start, (hash & {mask})::integer AS register,'
+            '        MAX({max_rank} - length(ltrim((hash >> {precision})'
+            "          ::bit({bits})::text, '0'))) AS rank"
+            '      FROM ('
+            '        SELECT date, hashint4extended(user_id, 0) AS hash'
+            '        FROM {source}'
+            '      ) AS hashed, LATERAL (VALUES'
+            "        ('day', date), ('month', date_trunc('month', date)::date)"
+            '      ) AS spans(span, start)'
+            '      GROUP BY span, start, register'
+            '  ) AS ranked GROUP BY span, start'
+            '), sketches AS ('
+            '  INSERT INTO {sketch} (span, date, registers)'
+            '  SELECT span, start,'
+            "    user_sketch_add(''::bytea, registers, ranks)"
+            '  FROM sketch_ranks WHERE NOT EXISTS ('
+            '    SELECT 1 FROM {sketch} s'
+            '    WHERE s.span = sketch_ranks.span'
+            '    AND s.date = sketch_ranks.start'
+            '    AND user_sketch_covers('
+            '      s.registers, sketch_ranks.registers, sketch_ranks.ranks)'
+            '  )'
+            '  ON CONFLICT (span, date) DO UPDATE SET registers = ('
+            '    SELECT user_sketch_add({sketch}.registers,'
+            '      sketch_ranks.registers, sketch_ranks.ranks)'
+            '    FROM sketch_ranks WHERE sketch_ranks.span = EXCLUDED.span'
+            '    AND sketch_ranks.start = EXCLUDED.date'
+            '  ) WHERE NOT ('
+            '    SELECT user_sketch_covers({sketch}.registers,'
+            '      sketch_ranks.registers, sketch_ranks.ranks)'
+            '    FROM sketch_ranks WHERE sketch_ranks.span = EXCLUDED.span'
+            '    AND sketch_ranks.start = EXCLUDED.date'
+            '  )'
+            ')'.format(
+                source=source, sketch=self.model._meta.db_table,
+                mask=sketches.REGISTERS - 1, precision=sketches.PRECISION,
+                bits=64 - sketches.PRECISION, max_rank=sketches.MAX_RANK))
+
+    def add(self, source, params=None):
+        """Add the users of ``source`` to the sketches, see ``add_sql``"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'WITH {sketch} SELECT 1'.format(sketch=self.add_sql(source)),
+                params)
+
+    def rebuild(self):
+        """Recompute every sketch from the raw login events"""
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {table}'.format(
+                table=self.model._meta.db_table))
+        self.add(ActivityReport._meta.db_table)
+
+
+class ActiveUserSketch(models.Model):
+    """HyperLogLog sketch of the users who logged in on a day or a month
+
+    ``date`` is the day, or the first day of the month. Month sketches
+    spare reading the sketch of every day of long ranges. See
+    ``user.sketches`` for the layout of ``registers``.
+    """
+    SPANS = [('day', 'day'), ('month', 'month')]
+
+    id = models.AutoField(primary_key=True)
+    span = models.CharField(max_length=5, choices=SPANS)
+    date = models.DateField()
+    registers = models.BinaryField()
+
+    objects = ActiveUserSketchManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['span', 'date'], name='activeusersketch_span_date'),
+        ]
+
+
+class TopUserCounterManager(models.Manager):
+
+    def add_sql(self, source):
+        """CTEs counting the logins of ``source`` in the Space-Saving summaries
+
+        ``source`` is a table, CTE or aliased subquery with ``user_id``,
+        ``date`` and ``count`` columns. Every day and month keeps counters
+        for at most about ``CAPACITY`` users. A user without a counter gets
+        one starting at the floor of the summary, the ``CAPACITY``-th
+        highest count, which is recorded as its error. Rather than
+        replacing the lowest counter right away, counters below the floor
+        are deleted by the next statement adding a counter to the summary,
+        so a summary only exceeds ``CAPACITY`` by the users of one batch.
+        The floor is only looked up for users without a counter, the other
+        logins are a single counter update.
+        """
+        return (
+            'top_counts AS ('
+            '  SELECT span, start, user_id, SUM(count) AS count'
+            '  FROM {source}, LATERAL (VALUES'
+            "    ('day', date), ('month', date_trunc('month', date)::date)"
+            '  ) AS spans(span, start)'
+            '  GROUP BY span, start, user_id'
+            '), top_floors AS ('
+            '  SELECT span, start, COALESCE(('
+            '    SELECT count FROM {table} t'
+            '    WHERE t.span = pieces.span AND t.date = pieces.start'
+            '    ORDER BY count DESC OFFSET {offset} LIMIT 1'
+            '  ), 0) AS floor'
+            '  FROM (SELECT DISTINCT span, start FROM top_counts c'
+            '    WHERE NOT EXISTS ('
+            '      SELECT 1 FROM {table} t WHERE t.span = c.span'
+            '      AND t.date = c.start AND t.user_id = c.user_id'
+            '    )'
+            '  ) AS pieces'
+            '), top_trimmed AS ('
+            '  DELETE FROM {table} t USING top_floors f'
+            '  WHERE t.span = f.span AND t.date = f.start'
+            '  AND t.count < f.floor'
+            '  AND NOT EXISTS ('
+            '    SELECT 1 FROM top_counts c WHERE c.span = t.span'
+            '    AND c.start = t.date AND c.user_id = t.user_id'
+            '  )'
+            '), top_counters AS ('
+            '  INSERT INTO {table} (span, date, user_id, count, error)'
+            '  SELECT span, start, user_id,'
+            '    COALESCE(floor, 0) + count, COALESCE(floor, 0)'
+            '  FROM top_counts LEFT JOIN top_floors USING (span, start)'
+            '  ON CONFLICT (span, date, user_id) DO UPDATE'
+            '  SET count = {table}.count + EXCLUDED.count - EXCLUDED.error'
+            ')'.format(
+                source=source, table=self.model._meta.db_table,
+                offset=self.model.CAPACITY - 1))
+
+    def add(self, source, params=None):
+        """Count the logins of ``source``, see ``add_sql``
+
+        A batch may add many counters, bulk loads call ``trim`` once done.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'WITH {top} SELECT 1'.format(top=self.add_sql(source)),
+                params)
+
+    def trim(self):
+        """Delete the counters below the floor of every summary"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {table} t USING ('
+                '  SELECT span, date, count AS floor FROM ('
+                '    SELECT span, date, count, row_number() OVER ('
+                '      PARTITION BY span, date ORDER BY count DESC'
+                '    ) AS position FROM {table}'
+                '  ) AS ranked WHERE position = %s'
+                ') AS f '
+                'WHERE t.span = f.span AND t.date = f.date '
+                'AND t.count < f.floor'.format(
+                    table=self.model._meta.db_table),
+                [self.model.CAPACITY])
+
+    def rebuild(self):
+        """Recompute every summary from the daily rollup
+
+        Counts are exact and the summaries keep the top users of every day
+        and month.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {table}'.format(
+                table=self.model._meta.db_table))
+        self.add(DailyActivity._meta.db_table)
+        self.trim()
+
+
+class TopUserCounter(models.Model):
+    """Space-Saving counter of the logins of a user in a day or a month
+
+    ``count`` overestimates the logins by at most ``error``. Users without
+    a counter logged in at most as often as the lowest counter of the
+    summary, when it is full. ``user_id`` is not a foreign key: counters of
+    deleted users are kept so the error bounds stay valid. ``count`` is not
+    indexed so incrementing a counter is a HOT update, the floor of a
+    summary is found by sorting its counters.
+    """
+    SPANS = [('day', 'day'), ('month', 'month')]
+    # Counters kept per day and month
+    CAPACITY = 1000
+
+    id = models.AutoField(primary_key=True)
+    span = models.CharField(max_length=5, choices=SPANS)
+    date = models.DateField()
+    user_id = models.IntegerField()
+    count = models.PositiveIntegerField()
+    error = models.PositiveIntegerField(default=0)
+
+    objects = TopUserCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['span', 'date', 'user_id'],
+                name='topusercounter_span_date_user'),
+        ]
+
+
+class TokenRevocation(models.Model):
+    """Signed tokens of the user issued before ``revoked_at`` are invalid
+
+    ``user_id`` is not a foreign key so the row outlives a deleted user.
+    """
+    id = models.AutoField(primary_key=True)
+    user_id = models.IntegerField(unique=True)
+    revoked_at = models.DateTimeField(db_index=True)
+
+
+class UserPurge(models.Model):
+    """User deleted through the API whose data is still to be removed
+
+    The request only deactivates the user, ``purge_users`` deletes the
+    login events in small batches and then the user itself.
+    """
+    id = models.AutoField(primary_key=True)
+    user = models.OneToOneField(User, models.CASCADE)
+    requested_at = models.DateTimeField(default=timezone.now)
+
+
+class ExportJob(models.Model):
+    """Activity report computed in the background and written to a file
+
+    ``key`` is a hash of ``params``: while a job is queued, running or
+    done, identical requests get it rather than a new one. ``rows`` counts
+    the rows written so far. See ``user.exports``.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    EXPIRED = 'expired'
+    STATUSES = [
+        (QUEUED, QUEUED), (RUNNING, RUNNING), (DONE, DONE), (FAILED, FAILED),
+        (EXPIRED, EXPIRED)]
+    ACTIVE = [QUEUED, RUNNING, DONE]
+
+    id = models.AutoField(primary_key=True)
+    key = models.CharField(max_length=64)
+    params = models.JSONField()
+    status = models.CharField(max_length=7, choices=STATUSES, default=QUEUED)
+    rows = models.PositiveBigIntegerField(default=0)
+    file = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    expires_at = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['key'], condition=models.Q(status__in=[
+                    'queued', 'running', 'done']),
+                name='exportjob_active_key'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'id'], name='exportjob_status_id'),
+        ]
@@ -0,0 +1,213 @@
+import datetime
+from base64 import b64decode, b64encode
+from itertools import islice
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Pagination on the key of the last row of the page
+
+    The next page is fetched with a ``WHERE`` on that key instead of an
+    ``OFFSET``, so deep pages cost the same as the first one. Subclasses
+    fetch ``page_size + 1`` rows, the extra one telling a next page exists,
+    and define how the key is read from a row and written in the cursor.
+    """
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_key(self, row):
+        raise NotImplementedError(
+            'KeysetPagination subclasses must implement get_key()')
+
+    def encode_cursor(self, key):
+        raise NotImplementedError(
+            'KeysetPagination subclasses must implement encode_cursor()')
+
+    def decode_cursor(self, cursor):
+        raise NotImplementedError(
+            'KeysetPagination subclasses must implement decode_cursor()')
+
+    def end_page(self, rows):
+        """Keep ``page_size`` rows, the extra one tells a next page exists"""
+        self.next_key = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            self.next_key = self.get_key(rows[-1])
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if self.next_key is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(
+            url, self.page_size_query_param, self.page_size)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.next_key))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class UserKeysetPagination(KeysetPagination):
+    """Pagination of ``user_values`` rows on the user id
+
+    Every page is a range scan of ``page_size + 1`` ids, so listing costs
+    the same whatever the size of the table.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.end_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Async version of ``paginate_queryset`` for the async views"""
+        return self.end_page(
+            [row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(id__gt=self.decode_cursor(cursor))
+        return queryset.order_by('id')[:self.page_size + 1]
+
+    def get_key(self, row):
+        return row[0]
+
+    def encode_cursor(self, key):
+        return b64encode(str(key).encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            return int(b64decode(cursor.encode('ascii')).decode('ascii'))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class ReportKeysetPagination(KeysetPagination):
+    """Keyset pagination for bucketed activity reports
+
+    Reports stay unpaginated unless ``page_size`` or ``cursor`` is given.
+    The cursor encodes the (bucket, user id) of the last row of the page.
+    """
+
+    def paginate_queryset(self, report, request, view=None):
+        if not self.start_page(report, request):
+            return None
+        return self.end_page(list(islice(report.rows(), self.page_size + 1)))
+
+    async def apaginate_queryset(self, report, request, view=None):
+        """Async version of ``paginate_queryset`` for the async views"""
+        if not self.start_page(report, request):
+            return None
+        rows = []
+        report_rows = report.arows()
+        try:
+            async for row in report_rows:
+                rows.append(row)
+                if len(rows) > self.page_size:
+                    break
+        finally:
+            await report_rows.aclose()
+        return self.end_page(rows)
+
+    def start_page(self, report, request):
+        """Set up the page, ``False`` when the report is not paginated"""
+        if (self.page_size_query_param not in request.query_params
+                and self.cursor_query_param not in request.query_params):
+            return False
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            report.after = self.decode_cursor(cursor)
+        return True
+
+    def get_key(self, row):
+        return row['date'], row['user_id']
+
+    def encode_cursor(self, key):
+        date, user_id = key
+        value = '%s:%s' % (date.isoformat(), user_id)
+        return b64encode(value.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            bucket, user_id = b64decode(cursor.encode('ascii')).decode(
+                'ascii').rsplit(':', 1)
+            if 'T' in bucket:
+                return datetime.datetime.fromisoformat(bucket), int(user_id)
+            return datetime.date.fromisoformat(bucket), int(user_id)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class UserActivityPagination(KeysetPagination):
+    """Keyset pagination of a ``UserActivity`` timeline
+
+    The cursor encodes the (logged_at, id) of the last event of the page,
+    or the start of its last bucket.
+    """
+
+    def paginate_queryset(self, activity, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.bucket = activity.bucket
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            activity.after = self.decode_cursor(cursor)
+        return self.end_page(activity.rows(self.page_size + 1))
+
+    def get_key(self, row):
+        if self.bucket is None:
+            return row['logged_at'], row['id']
+        return row['bucket']
+
+    def encode_cursor(self, key):
+        if self.bucket is None:
+            value = '%s|%s' % (key[0].isoformat(), key[1])
+        else:
+            value = key.isoformat()
+        return b64encode(value.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            value = b64decode(cursor.encode('ascii')).decode('ascii')
+            if self.bucket is None:
+                logged_at, event_id = value.split('|')
+                return datetime.datetime.fromisoformat(logged_at), int(
+                    event_id)
+            if self.bucket == 'hour':
+                return datetime.datetime.fromisoformat(value)
+            return datetime.date.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
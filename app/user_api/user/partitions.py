@@ -0,0 +1,199 @@
+import datetime
+
+from django.db import connection, transaction
+
+from .models import ActivityReport
+from .reports import next_bucket, truncate
+
+
+def table_name():
+    return ActivityReport._meta.db_table
+
+
+def partition_name(month):
+    return '%s_p%04d_%02d' % (table_name(), month.year, month.month)
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+        [table_name()])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def convert(ahead=3):
+    """Turn ActivityReport into a table partitioned by month on ``date``
+
+    Existing rows are copied into monthly partitions and the indexes of the
+    old table are recreated on the new one, which makes this an offline
+    operation: the table is locked for the whole copy. A default partition
+    catches rows outside the created months. Does nothing if the table is
+    already partitioned.
+    """
+    table = table_name()
+    old = table + '_old'
+    with transaction.atomic(), connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return False
+
+        # Deferred foreign key checks would prevent dropping the old table
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(
+            'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE'.format(table=table))
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = %s "
+            "AND indexname NOT IN ("
+            "  SELECT conname FROM pg_constraint"
+            "  WHERE conrelid = to_regclass(%s) AND contype = 'p')",
+            [table, table])
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'", [table])
+        foreign_keys = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            'SELECT MIN(date), MAX(date), MAX(id) FROM {table}'.format(
+                table=table))
+        first, last, last_id = cursor.fetchone()
+
+        cursor.execute('ALTER TABLE {table} RENAME TO {old}'.format(
+            table=table, old=old))
+        # Same columns, without the id default owned by the old table
+        cursor.execute(
+            'CREATE TABLE {table} (LIKE {old}) '
+            'PARTITION BY RANGE (date)'.format(table=table, old=old))
+        cursor.execute(
+            'CREATE TABLE {table}_default PARTITION OF {table} '
+            'DEFAULT'.format(table=table))
+
+        this_month = truncate(datetime.date.today(), 'month')
+        create_partitions(
+            cursor, truncate(first, 'month') if first else this_month,
+            max(add_months(this_month, ahead),
+                truncate(last, 'month') if last else this_month))
+
+        cursor.execute(
+            'INSERT INTO {table} SELECT * FROM {old}'.format(
+                table=table, old=old))
+        cursor.execute('DROP TABLE {old}'.format(old=old))
+
+        cursor.execute(
+            'CREATE SEQUENCE {table}_id_seq AS integer START WITH %s '
+            'OWNED BY {table}.id'.format(table=table), [(last_id or 0) + 1])
+        cursor.execute(
+            "ALTER TABLE {table} ALTER COLUMN id "
+            "SET DEFAULT nextval('{table}_id_seq')".format(table=table))
+        # Partition keys must be part of the primary key
+        cursor.execute(
+            'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey '
+            'PRIMARY KEY (id, date)'.format(table=table))
+        for index in indexes:
+            cursor.execute(index)
+        for foreign_key in foreign_keys:
+            cursor.execute('ALTER TABLE {table} ADD {foreign_key}'.format(
+                table=table, foreign_key=foreign_key))
+
+    return True
+
+
+def add_months(month, count):
+    """First day of the month ``count`` months after (or before) ``month``"""
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def bounds(cursor):
+    """``(name, bound)`` of the partitions, as ``pg_get_expr`` shows them"""
+    cursor.execute(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s)", [table_name()])
+    return cursor.fetchall()
+
+
+def partitions(cursor):
+    """``(name, first day)`` of the monthly partitions, oldest first"""
+    months = []
+    for name, bound in bounds(cursor):
+        if bound == 'DEFAULT':
+            continue
+        # FOR VALUES FROM ('2020-12-01') TO ('2021-01-01')
+        months.append((name, datetime.date.fromisoformat(bound.split("'")[1])))
+    return sorted(months, key=lambda partition: partition[1])
+
+
+def default_partition(cursor):
+    """Name of the default partition, ``None`` if there is none"""
+    for name, bound in bounds(cursor):
+        if bound == 'DEFAULT':
+            return name
+    return None
+
+
+def create_partitions(cursor, first, last):
+    """Create the missing monthly partitions from ``first`` to ``last``
+
+    Returns the names of the created partitions. Postgres refuses to create
+    a partition for rows already in the default partition, so when the
+    default holds rows of a created month it is detached, its rows of the
+    month are moved to the new partition and it is attached back. The
+    parent table is locked until the end of the transaction.
+    """
+    table = table_name()
+    existing = set(name for name, month in partitions(cursor))
+    default = default_partition(cursor)
+    detached = False
+    created = []
+    month = truncate(first, 'month')
+    while month <= last:
+        name = partition_name(month)
+        end = next_bucket(month, 'month')
+        if name not in existing:
+            moved = False
+            if default:
+                cursor.execute(
+                    'SELECT 1 FROM {default} WHERE date >= %s AND date < %s '
+                    'LIMIT 1'.format(default=default), [month, end])
+                moved = cursor.fetchone() is not None
+            if moved and not detached:
+                cursor.execute(
+                    'ALTER TABLE {table} DETACH PARTITION {default}'.format(
+                        table=table, default=default))
+                detached = True
+            cursor.execute(
+                'CREATE TABLE {name} PARTITION OF {table} '
+                'FOR VALUES FROM (%s) TO (%s)'.format(name=name, table=table),
+                [month, end])
+            if moved:
+                cursor.execute(
+                    'WITH moved AS ('
+                    '  DELETE FROM {default} WHERE date >= %s AND date < %s'
+                    '  RETURNING *'
+                    ') INSERT INTO {name} SELECT * FROM moved'.format(
+                        default=default, name=name), [month, end])
+            created.append(name)
+        month = end
+    if detached:
+        cursor.execute(
+            'ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT'.format(
+                table=table, default=default))
+    return created
+
+
+def drop_partitions(cursor, before):
+    """Detach and drop the partitions holding only dates before ``before``
+
+    Returns the names of the dropped partitions. Dropping a partition is a
+    catalog operation, the cost does not depend on the number of rows.
+    The daily rollup is not touched, so reports keep the counts.
+    """
+    dropped = []
+    for name, month in partitions(cursor):
+        if next_bucket(month, 'month') > before:
+            break
+        cursor.execute('ALTER TABLE {table} DETACH PARTITION {name}'.format(
+            table=table_name(), name=name))
+        cursor.execute('DROP TABLE {name}'.format(name=name))
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,38 @@
+from django.db import connections
+from django.db.backends.postgresql.base import DatabaseWrapper
+
+# Pools inherited from the parent process. They stay referenced so they are
+# never garbage collected, and closed, in a forked child
+_inherited = []
+
+
+def pools():
+    """``(alias, pool)`` of the connection pools created by this process"""
+    return list(DatabaseWrapper._connection_pools.items())
+
+
+def close_pools():
+    """Return the connections and close the pools
+
+    To be called before forking workers: the pools are recreated on first
+    use in each process.
+    """
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+    for alias, pool in pools():
+        pool.close()
+        DatabaseWrapper._connection_pools.pop(alias, None)
+
+
+def discard_inherited_pools():
+    """Forget the pools and connections inherited through a fork
+
+    Runs in the child process. The pool worker threads do not survive the
+    fork and the sockets are shared with the parent, so nothing is closed
+    (psycopg never closes a connection opened by another process) and the
+    child opens its own connections when it needs them.
+    """
+    for connection in connections.all(initialized_only=True):
+        connection.connection = None
+    _inherited.extend(DatabaseWrapper._connection_pools.values())
+    DatabaseWrapper._connection_pools.clear()
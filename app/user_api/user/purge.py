@@ -0,0 +1,70 @@
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from rest_framework.authtoken.models import Token
+
+from .models import ActivityReport, DailyActivity, UserPurge
+
+
+def soft_delete(user):
+    """Deactivate ``user`` and queue the removal of its data
+
+    Saving the inactive user revokes its signed tokens and its API tokens
+    are deleted, so the user is gone for the API right away.
+    """
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        Token.objects.filter(user=user).delete()
+        UserPurge.objects.get_or_create(user=user)
+
+
+def delete_batch(model, user_id, batch_size):
+    """Delete at most ``batch_size`` rows of ``model`` for the user"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        # (id, date) is the primary key once ActivityReport is partitioned
+        cursor.execute(
+            'DELETE FROM {table} WHERE (id, date) IN ('
+            '  SELECT id, date FROM {table} WHERE user_id = %s LIMIT %s'
+            ')'.format(table=table), [user_id, batch_size])
+        return cursor.rowcount
+
+
+def purge_user(user_id, batch_size=5000, pause=0.1):
+    """Delete the login events of a deactivated user, then the user
+
+    Every batch is a statement of its own, committed before the next one,
+    so no transaction holds more than ``batch_size`` row locks and the
+    ``pause`` between batches leaves room for the API queries. The user is
+    deleted last, when cascading has almost nothing left to remove. Returns
+    the number of login events deleted.
+    """
+    deleted = 0
+    for model in (ActivityReport, DailyActivity):
+        while True:
+            count = delete_batch(model, user_id, batch_size)
+            if model is ActivityReport:
+                deleted += count
+            if count < batch_size:
+                break
+            time.sleep(pause)
+    User.objects.filter(id=user_id, is_active=False).delete()
+    UserPurge.objects.filter(user_id=user_id).delete()
+    return deleted
+
+
+def purge_users(batch_size=5000, pause=0.1):
+    """Purge the users queued by ``soft_delete``, oldest first
+
+    Returns the number of users and login events deleted.
+    """
+    users = events = 0
+    # Users activated again since are left alone
+    queued = UserPurge.objects.filter(user__is_active=False).order_by(
+        'requested_at').values_list('user_id', flat=True)
+    for user_id in list(queued):
+        events += purge_user(user_id, batch_size, pause)
+        users += 1
+    return users, events
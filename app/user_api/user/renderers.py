@@ -0,0 +1,126 @@
+import csv
+import io
+import json
+
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class StreamingRenderer(renderers.BaseRenderer):
+    """Renderer able to stream report rows
+
+    ``stream`` turns an iterable of rows into an iterable of encoded chunks
+    so the view can hand it to a ``StreamingHttpResponse``. Rows are
+    grouped in chunks of ``rows_per_chunk`` to avoid one write per row.
+    """
+    charset = 'utf-8'
+    rows_per_chunk = 500
+
+    def render_row(self, row):
+        raise NotImplementedError(
+            'StreamingRenderer subclasses must implement render_row()')
+
+    def stream(self, rows):
+        lines = []
+        for row in rows:
+            lines.append(self.render_row(row))
+            if len(lines) >= self.rows_per_chunk:
+                yield ''.join(lines).encode(self.charset)
+                lines = []
+        if lines:
+            yield ''.join(lines).encode(self.charset)
+
+    async def astream(self, rows):
+        """Async version of ``stream`` for an async iterable of rows"""
+        lines = []
+        async for row in rows:
+            lines.append(self.render_row(row))
+            if len(lines) >= self.rows_per_chunk:
+                yield ''.join(lines).encode(self.charset)
+                lines = []
+        if lines:
+            yield ''.join(lines).encode(self.charset)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = [data]
+        return b''.join(self.stream(data))
+
+
+class CSVRenderer(StreamingRenderer):
+    """Report rows as ``user, date, count`` lines
+
+    Values are quoted by ``csv.writer`` when they hold a comma, a quote or
+    a line break; they are joined with ``', '`` so the lines read back with
+    ``skipinitialspace``.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator='')
+
+    def quote(self, value):
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.writer.writerow([value])
+        return self.buffer.getvalue()
+
+    def render_row(self, row):
+        return ', '.join(self.quote(value) for value in row.values()) + '\n'
+
+
+class NDJSONRenderer(StreamingRenderer):
+    """Report rows as newline delimited JSON objects"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render_row(self, row):
+        return json.dumps(
+            row, cls=encoders.JSONEncoder, ensure_ascii=False,
+            separators=(',', ':')) + '\n'
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """JSONRenderer encoding with orjson, with the same output
+
+    orjson writes compact UTF-8 like the default JSONRenderer settings;
+    the line and paragraph separators are escaped afterwards as DRF does.
+    Types orjson does not know, and datetimes whose format differs, go
+    through DRF's encoder. Indented output, other JSON settings, a missing
+    orjson or values it rejects fall back to the stdlib encoder.
+
+    orjson formats some floats differently (``1e16`` instead of
+    ``1e+16``), only use it for payloads without floats.
+    """
+    options = 0
+    if orjson is not None:
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii
+                or not self.compact
+                or self.get_indent(
+                    accepted_media_type, renderer_context or {}) is not None):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default,
+                option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+                b'\xe2\x80\xa9', b'\\u2029')
+        return ret
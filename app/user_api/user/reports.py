@@ -0,0 +1,549 @@
+import datetime
+
+from django.db.models import (
+    CharField, Count, DateField, DateTimeField, F, Func, Q, Sum, Value)
+from django.db.models.functions import Trunc
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+
+from . import sketches
+from .models import (
+    ActiveUserSketch, ActivityReport, DailyActivity, TopUserCounter)
+
+
+# Supported buckets and the format used to label them
+BUCKETS = {
+    'hour': '%d/%m/%Y %H:00',
+    'day': '%d/%m/%Y',
+    'week': '%d/%m/%Y',
+    'month': '%m/%Y',
+    'year': '%Y',
+}
+
+# The same labels as written by ``to_char`` in the database
+SQL_BUCKETS = {
+    'hour': 'DD/MM/YYYY HH24:00',
+    'day': 'DD/MM/YYYY',
+    'week': 'DD/MM/YYYY',
+    'month': 'MM/YYYY',
+    'year': 'YYYY',
+}
+
+
+def truncate(date, bucket):
+    """Return the start of the bucket containing ``date``"""
+    if bucket == 'hour':
+        return date.replace(minute=0, second=0, microsecond=0)
+    if bucket == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    if bucket == 'month':
+        return date.replace(day=1)
+    if bucket == 'year':
+        return date.replace(month=1, day=1)
+    return date
+
+
+def next_bucket(date, bucket):
+    """Return the start of the bucket following ``date``"""
+    if bucket == 'hour':
+        return date + datetime.timedelta(hours=1)
+    if bucket == 'week':
+        return date + datetime.timedelta(days=7)
+    if bucket == 'month':
+        if date.month == 12:
+            return date.replace(year=date.year + 1, month=1)
+        return date.replace(month=date.month + 1)
+    if bucket == 'year':
+        return date.replace(year=date.year + 1)
+    return date + datetime.timedelta(days=1)
+
+
+def start_of_day(date):
+    """Aware datetime for midnight of ``date`` in the current time zone"""
+    return timezone.make_aware(
+        datetime.datetime.combine(date, datetime.time.min))
+
+
+class BucketReport(object):
+    """Login counts per user grouped in hour, day, week, month or year buckets
+
+    Counts are summed from the DailyActivity rollup, or counted from the
+    ActivityReport timestamps for hourly buckets, and grouped with
+    ``date_trunc`` in the database, so only one row per (bucket, user)
+    leaves Postgres. Rows are ordered by bucket and then by user id and
+    are read ``chunk_size`` rows at a time.
+
+    Daily rows are grouped on the plain ``date`` column and come out of
+    the ``dailyactivity_date_user`` index in order, a page or a chunk
+    costs the same whatever the size of the report. Hour, week, month and
+    year buckets group on a truncated value no index is ordered by:
+    Postgres sorts every remaining row of the requested range before
+    returning the first one, once per page or streamed report. Bound them
+    with ``from`` and ``to``.
+
+    ``after`` is an optional (bucket, user id) key: only rows sorting after
+    it are returned, which is what keyset pagination relies on.
+    """
+    chunk_size = 2000
+
+    def __init__(self, bucket, date_from=None, date_to=None, user=None,
+                 fill=False):
+        if bucket not in BUCKETS:
+            raise ValueError('Unknown bucket %r' % bucket)
+        self.bucket = bucket
+        self.date_from = date_from
+        self.date_to = date_to
+        self.user = user
+        self.fill = fill
+        self.after = None
+
+        # Bounds are applied on the raw column so indexes can be used,
+        # ``end`` is exclusive
+        if bucket == 'hour':
+            self.field = 'logged_at'
+            self.start = date_from and start_of_day(date_from)
+            self.end = date_to and start_of_day(
+                date_to + datetime.timedelta(days=1))
+        else:
+            self.field = 'date'
+            self.start = date_from
+            self.end = date_to and date_to + datetime.timedelta(days=1)
+
+    def source(self):
+        """Queryset and aggregate the counts are computed from"""
+        if self.bucket == 'hour':
+            return ActivityReport.objects.all(), Count('id')
+        return DailyActivity.objects.all(), Sum('count')
+
+    def filtered(self):
+        """Rows matching the report filters"""
+        queryset, count = self.source()
+        if self.start:
+            queryset = queryset.filter(**{self.field + '__gte': self.start})
+        if self.end:
+            queryset = queryset.filter(**{self.field + '__lt': self.end})
+        if self.bucket == 'hour':
+            # ``date`` is the local date of ``logged_at``, bounding it too
+            # lets Postgres prune the monthly partitions
+            if self.date_from:
+                queryset = queryset.filter(date__gte=self.date_from)
+            if self.date_to:
+                queryset = queryset.filter(
+                    date__lt=self.date_to + datetime.timedelta(days=1))
+        if self.user:
+            queryset = queryset.filter(user__username=self.user)
+        return queryset
+
+    def keyset(self, after=None):
+        """Rows whose bucket and user sort after ``after``
+
+        ``after`` defaults to ``self.after``. The condition is written on
+        the raw column rather than on the truncated bucket, and bounded
+        below by the bucket, so index scans start at the bucket.
+        """
+        queryset = self.filtered()
+        after = after or self.after
+        if after:
+            bucket, user_id = after
+            end = next_bucket(bucket, self.bucket)
+            queryset = queryset.filter(
+                Q(**{self.field + '__gte': end})
+                | Q(**{
+                    self.field + '__lt': end,
+                    'user_id__gt': user_id}),
+                **{self.field + '__gte': bucket})
+            if self.bucket == 'hour':
+                queryset = queryset.filter(
+                    date__gte=timezone.localdate(bucket))
+        return queryset
+
+    def queryset(self, after=None):
+        """Aggregated ``(user_id, user__username, bucket, label, count)`` rows
+
+        ``label`` is the bucket already formatted by the database, so rows
+        need no date formatting once fetched. Hourly buckets are truncated
+        in the current time zone and are labelled in it too.
+        """
+        if self.bucket == 'day':
+            # Rollup rows are already daily: grouping on the plain column
+            # lets Postgres read them in ``dailyactivity_date_user`` order
+            bucket = F('date')
+        else:
+            bucket = Trunc(
+                self.field, self.bucket, output_field=(
+                    DateTimeField() if self.bucket == 'hour'
+                    else DateField()))
+        queryset, count = self.source()
+        return self.keyset(after).annotate(
+            bucket=bucket,
+            label=Func(
+                F('bucket'), Value(SQL_BUCKETS[self.bucket]),
+                function='to_char', output_field=CharField()),
+        ).values(
+            'user_id', 'user__username', 'bucket', 'label'
+        ).annotate(count=count).order_by('bucket', 'user_id')
+
+    def users(self):
+        """Users appearing in the report, ordered by id"""
+        return self.filtered().values_list(
+            'user_id', 'user__username').distinct().order_by('user_id')
+
+    def rows(self):
+        """Yield ``{'user_id', 'user', 'date', 'label', 'count'}`` report rows
+
+        ``date`` is the start of the bucket and ``label`` its formatted
+        value.
+        """
+        rows = self.query_rows()
+        if self.fill:
+            rows = self.fill_rows(rows)
+
+        for row in rows:
+            yield self.row(row)
+
+    async def arows(self):
+        """Async version of ``rows``, reading with the async ORM"""
+        rows = self.aquery_rows()
+        try:
+            if self.fill:
+                users = [user async for user in self.users()]
+                async for row in self.afill_rows(rows, users):
+                    yield self.row(row)
+            else:
+                async for row in rows:
+                    yield self.row(row)
+        finally:
+            await rows.aclose()
+
+    def query_rows(self):
+        """Rows of ``queryset``, ``chunk_size`` at a time
+
+        Daily rows are read ``chunk_size`` per query, each query starting
+        after the last row of the previous one: a server-side cursor is
+        declared ``WITH HOLD`` in autocommit mode, which Postgres
+        materializes in full before the first row is fetched. The other
+        buckets are sorted in full before their first row anyway, they are
+        read through one server-side cursor rather than sorted again for
+        every chunk.
+        """
+        if self.bucket != 'day':
+            yield from self.queryset().iterator(chunk_size=self.chunk_size)
+            return
+        after = None
+        while True:
+            chunk = list(self.queryset(after)[:self.chunk_size])
+            yield from chunk
+            if len(chunk) < self.chunk_size:
+                return
+            after = chunk[-1]['bucket'], chunk[-1]['user_id']
+
+    async def aquery_rows(self):
+        """Async version of ``query_rows``"""
+        if self.bucket != 'day':
+            rows = self.queryset().aiterator(chunk_size=self.chunk_size)
+            try:
+                async for row in rows:
+                    yield row
+            finally:
+                await rows.aclose()
+            return
+        after = None
+        while True:
+            chunk = [
+                row async for row in self.queryset(after)[:self.chunk_size]]
+            for row in chunk:
+                yield row
+            if len(chunk) < self.chunk_size:
+                return
+            after = chunk[-1]['bucket'], chunk[-1]['user_id']
+
+    def row(self, row):
+        return {
+            'user_id': row['user_id'],
+            'user': row['user__username'],
+            'date': row['bucket'],
+            'label': row['label'],
+            'count': row['count'],
+        }
+
+    def fill_rows(self, rows):
+        """Add zero count rows for the buckets where a user has no logins"""
+        filler = self.filler(list(self.users()))
+        rows = iter(rows)
+        try:
+            wanted = next(filler)
+            while True:
+                if wanted is None:
+                    wanted = filler.send(next(rows, None))
+                else:
+                    yield wanted
+                    wanted = next(filler)
+        except StopIteration:
+            return
+
+    async def afill_rows(self, rows, users):
+        """Async version of ``fill_rows``"""
+        filler = self.filler(users)
+        try:
+            wanted = next(filler)
+            while True:
+                if wanted is None:
+                    try:
+                        row = await rows.__anext__()
+                    except StopAsyncIteration:
+                        row = None
+                    wanted = filler.send(row)
+                else:
+                    yield wanted
+                    wanted = next(filler)
+        except StopIteration:
+            return
+
+    def filler(self, users):
+        """Generator merging the rows with zero count rows
+
+        It does no I/O so the sync and async readers can share it: it
+        yields ``None`` when it needs the next aggregated row, which is sent
+        back (``None`` once there are no more), and the rows to output
+        otherwise.
+        """
+        if not users:
+            return
+
+        pending = yield None
+        if self.start:
+            current = truncate(self.start, self.bucket)
+        elif pending is not None:
+            current = pending['bucket']
+        else:
+            return
+        date_format = BUCKETS[self.bucket]
+        last = None
+        if self.end:
+            last = truncate(
+                self.end - datetime.timedelta(microseconds=1)
+                if self.bucket == 'hour' else self.date_to, self.bucket)
+        after_user = None
+        if self.after and self.after[0] >= current:
+            current, after_user = self.after
+
+        while True:
+            if last is not None and current > last:
+                break
+            if last is None and pending is None:
+                break
+            label = current.strftime(date_format)
+            for user_id, username in users:
+                if after_user is not None and user_id <= after_user:
+                    continue
+                if (pending is not None and pending['bucket'] == current
+                        and pending['user_id'] == user_id):
+                    yield pending
+                    pending = yield None
+                else:
+                    yield {
+                        'user_id': user_id,
+                        'user__username': username,
+                        'bucket': current,
+                        'label': label,
+                        'count': 0,
+                    }
+            current = next_bucket(current, self.bucket)
+            after_user = None
+
+
+class UserActivity(object):
+    """Login events of one user, or their counts per bucket, oldest first
+
+    Everything is read from the ``activityreport_user_date_incl`` index,
+    which covers the columns used, with an index-only scan of the range of
+    the user: the cost depends on the history of the user alone and the
+    user table is not joined. ``after`` is the key of the last row of the
+    previous page, ``(logged_at, id)`` for events and the start of the
+    bucket otherwise.
+    """
+
+    def __init__(self, user_id, bucket=None, date_from=None, date_to=None):
+        if bucket is not None and bucket not in BUCKETS:
+            raise ValueError('Unknown bucket %r' % bucket)
+        self.user_id = user_id
+        self.bucket = bucket
+        self.date_from = date_from
+        self.date_to = date_to
+        self.after = None
+
+    def filtered(self):
+        queryset = ActivityReport.objects.filter(user_id=self.user_id)
+        if self.date_from:
+            queryset = queryset.filter(date__gte=self.date_from)
+        if self.date_to:
+            queryset = queryset.filter(date__lte=self.date_to)
+        return queryset
+
+    def queryset(self):
+        """``{'id', 'logged_at'}`` events or ``{'bucket', 'count'}`` rows
+
+        Daily counts are grouped on the date itself, which the index is
+        ordered on, so a page stops reading at its last day.
+        """
+        queryset = self.filtered()
+        if self.bucket is None:
+            if self.after:
+                logged_at, event_id = self.after
+                queryset = queryset.filter(
+                    Q(logged_at__gt=logged_at)
+                    | Q(logged_at=logged_at, id__gt=event_id),
+                    date__gte=timezone.localdate(logged_at))
+            return queryset.order_by(
+                'date', 'logged_at', 'id').values('id', 'logged_at')
+
+        field = 'logged_at' if self.bucket == 'hour' else 'date'
+        if self.after:
+            start = next_bucket(self.after, self.bucket)
+            queryset = queryset.filter(**{field + '__gte': start})
+            if self.bucket == 'hour':
+                queryset = queryset.filter(
+                    date__gte=timezone.localdate(start))
+        if self.bucket == 'day':
+            bucket = F('date')
+        else:
+            bucket = Trunc(
+                field, self.bucket, output_field=(
+                    DateTimeField() if self.bucket == 'hour'
+                    else DateField()))
+        return queryset.values(bucket=bucket).annotate(
+            count=Count('*')).order_by('bucket')
+
+    def rows(self, limit):
+        """The first ``limit`` rows, buckets get their ``label``"""
+        rows = list(self.queryset()[:limit])
+        if self.bucket is not None:
+            date_format = BUCKETS[self.bucket]
+            for row in rows:
+                row['label'] = row['bucket'].strftime(date_format)
+        return rows
+
+
+def sketch_keys(date_from, date_to):
+    """``(span, date)`` of the sketches covering the days of a range
+
+    Whole months are covered by their month sketch, the other days by
+    their day sketch.
+    """
+    keys = []
+    current = date_from
+    while current <= date_to:
+        if current.day == 1 and next_bucket(
+                current, 'month') <= date_to + datetime.timedelta(days=1):
+            keys.append(('month', current))
+            current = next_bucket(current, 'month')
+        else:
+            keys.append(('day', current))
+            current += datetime.timedelta(days=1)
+    return keys
+
+
+def active_users(date_from, date_to, bucket=None):
+    """Estimated number of distinct users who logged in within a range
+
+    Counts are estimated from the HyperLogLog sketches of ActiveUserSketch
+    merged in memory, see ``user.sketches`` for their error. With a
+    ``bucket`` (day, week, month or year) the count of every bucket in the
+    range is given too, the first and last buckets only counting the days
+    within the range. A range of whole months reads one sketch per month,
+    so its cost does not depend on the number of days or logins.
+    """
+    if bucket is None:
+        periods = [(date_from, date_to)]
+    else:
+        periods = []
+        current = truncate(date_from, bucket)
+        while current <= date_to:
+            end = next_bucket(current, bucket)
+            periods.append((
+                max(current, date_from),
+                min(end - datetime.timedelta(days=1), date_to)))
+            current = end
+
+    keys = [sketch_keys(start, end) for start, end in periods]
+    wanted = {'day': [], 'month': []}
+    for span, date in set(key for period in keys for key in period):
+        wanted[span].append(date)
+    found = {
+        (span, date): sketches.Sketch.from_bytes(registers)
+        for span, date, registers in ActiveUserSketch.objects.filter(
+            Q(span='day', date__in=wanted['day'])
+            | Q(span='month', date__in=wanted['month'])
+        ).values_list('span', 'date', 'registers')}
+
+    total = sketches.Sketch()
+    counts = []
+    for (start, end), period in zip(periods, keys):
+        sketch = sketches.Sketch()
+        for key in period:
+            if key in found:
+                sketch.update(found[key])
+        total.update(sketch)
+        counts.append({
+            'date': truncate(start, bucket or 'day').strftime(
+                BUCKETS[bucket or 'day']),
+            'active_users': sketch.estimate(),
+        })
+
+    result = {
+        'from': date_from,
+        'to': date_to,
+        'active_users': total.estimate(),
+        'standard_error': sketches.STANDARD_ERROR,
+    }
+    if bucket is not None:
+        result['buckets'] = counts
+    return result
+
+
+def top_users(date_from, date_to, limit=100, exact=False):
+    """Users who logged in the most within a range, as ``(user, count, error)``
+
+    The Space-Saving summaries of TopUserCounter covering the range are
+    merged by the database, reading at most ``TopUserCounter.CAPACITY``
+    counters per month and per remaining day. A user without a counter in
+    part of the range is counted the floor of that summary, so ``count``
+    never underestimates and overestimates by at most ``error``. With
+    ``exact`` the counts are summed from the daily rollup instead.
+    """
+    if exact:
+        return [
+            (row['user__username'], row['count'], 0)
+            for row in DailyActivity.objects.filter(
+                date__gte=date_from, date__lte=date_to,
+            ).values('user_id', 'user__username').annotate(
+                count=Sum('count')).order_by('-count', 'user_id')[:limit]]
+
+    keys = sketch_keys(date_from, date_to)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'WITH floors AS ('
+            '  SELECT span, date, COALESCE(('
+            '    SELECT count FROM {table} t'
+            '    WHERE t.span = pieces.span AND t.date = pieces.date'
+            '    ORDER BY count DESC OFFSET {offset} LIMIT 1'
+            '  ), 0) AS floor'
+            '  FROM unnest(%s::varchar[], %s::date[]) AS pieces(span, date)'
+            '), merged AS ('
+            '  SELECT user_id, SUM(count) AS count,'
+            '    SUM(count - error) AS lower, SUM(floor) AS counted_floor'
+            '  FROM {table} t JOIN floors USING (span, date)'
+            '  GROUP BY user_id'
+            ') '
+            'SELECT u.username, m.count + total.floor - m.counted_floor,'
+            '  m.count + total.floor - m.counted_floor - m.lower '
+            'FROM merged m JOIN {users} u ON u.id = m.user_id,'
+            '  (SELECT SUM(floor) AS floor FROM floors) AS total '
+            'ORDER BY 2 DESC, m.user_id LIMIT %s'.format(
+                table=TopUserCounter._meta.db_table,
+                offset=TopUserCounter.CAPACITY - 1,
+                users=User._meta.db_table),
+            [[span for span, date in keys], [date for span, date in keys],
+             limit])
+        return cursor.fetchall()
@@ -0,0 +1,75 @@
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+from rest_framework.request import Request
+
+info = openapi.Info(
+    title="User API",
+    default_version='v1',
+    description="An API for users",
+    contact=openapi.Contact(email="feus2006@gmail.com"),
+    license=openapi.License(name="BSD License"),
+)
+
+# The schema loaded from OPENAPI_SCHEMA_FILE, as (content, etag)
+_schema = None
+
+
+def generate(request=None):
+    """OpenAPI schema of the API as JSON bytes
+
+    The viewsets are introspected from the sync URLs, the async views
+    serving some of them under ASGI are plain functions the generator
+    cannot describe.
+    """
+    generator = OpenAPISchemaGenerator(info, urlconf='user_api.urls')
+    schema = generator.get_schema(request, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def etag(content):
+    return '"%s"' % hashlib.sha256(content).hexdigest()[:32]
+
+
+def load():
+    """``(content, etag)`` of the schema, read once per process
+
+    The schema is generated at build time by ``generate_schema``. When the
+    file is missing it is generated once here and kept in memory.
+    """
+    global _schema
+    if _schema is None:
+        try:
+            with open(settings.OPENAPI_SCHEMA_FILE, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            content = generate()
+        _schema = content, etag(content)
+    return _schema
+
+
+def schema_etag(request):
+    if settings.DEBUG:
+        return None
+    return load()[1]
+
+
+@condition(etag_func=schema_etag)
+def schema_view(request):
+    """The OpenAPI schema, generated on each request only in DEBUG"""
+    if settings.DEBUG:
+        response = HttpResponse(
+            generate(Request(request)), content_type='application/json')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    content = load()[0]
+    response = HttpResponse(content, content_type='application/json')
+    response['Cache-Control'] = 'public, max-age=%s' % (
+        settings.OPENAPI_SCHEMA_MAX_AGE)
+    return response
@@ -1,11 +1,15 @@
-from django.contrib.auth import password_validation, authenticate
+from django.conf import settings
+from django.contrib.auth import password_validation
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
+from rest_framework.reverse import reverse
 from rest_framework.validators import UniqueValidator
 
-from .models import ActivityReport
+from .authentication import issue_signed_token, signed_token_setting
+from .models import ActivityReport, ExportJob, TopUserCounter
 
 
 class UserModelSerializer(serializers.ModelSerializer):
@@ -15,17 +19,65 @@ class UserModelSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'first_name', 'last_name', 'email')
 
 
+USER_FIELDS = UserModelSerializer.Meta.fields
+
+
+def user_values(queryset, fields=USER_FIELDS):
+    """Only the ``fields`` columns, as tuples starting with the id"""
+    return queryset.values_list(
+        'id', *(field for field in fields if field != 'id'))
+
+
+def user_data(values, fields=USER_FIELDS):
+    """UserModelSerializer output for the ``user_values`` of a user
+
+    Every exposed field is rendered as stored, so a dict in field order is
+    the same representation without building and running field objects.
+    ``fields`` must be in ``USER_FIELDS`` order.
+    """
+    if fields[0] != 'id':
+        values = values[1:]
+    return dict(zip(fields, values))
+
+
+class UserListQuerySerializer(serializers.Serializer):
+    """``fields`` limits the users to a comma separated list of fields"""
+
+    fields = serializers.CharField(required=False)
+
+    def validate_fields(self, value):
+        fields = {field.strip() for field in value.split(',')} - {''}
+        unknown = fields.difference(USER_FIELDS)
+        if unknown:
+            raise serializers.ValidationError(
+                'Unknown fields: %s.' % ', '.join(sorted(unknown)))
+        if not fields:
+            raise serializers.ValidationError('No fields given.')
+        return tuple(field for field in USER_FIELDS if field in fields)
+
+    def validate(self, data):
+        data.setdefault('fields', USER_FIELDS)
+        return data
+
+
 class UserLoginSerializer(serializers.Serializer):
 
     username = serializers.CharField(min_length=4, max_length=20)
     password = serializers.CharField(min_length=8, max_length=64)
 
     def validate(self, data):
-        """Validate the credentials"""
-        # authenticate the user
-        user = authenticate(
-            username=data['username'], password=data['password'])
-        if not user:
+        """Validate the credentials
+
+        The user is fetched together with its token in one query, instead
+        of ``authenticate()`` followed by a token lookup.
+        """
+        user = User.objects.select_related('auth_token').filter(
+            username=data['username']).first()
+        if user is None:
+            # Run the hasher anyway so missing users take as long to reject
+            User().set_password(data['password'])
+        if (user is None or not user.check_password(data['password'])
+                or not user.is_active):
             raise serializers.ValidationError('Invalid credentials.')
 
         # Save the user in the context
@@ -34,8 +86,20 @@ class UserLoginSerializer(serializers.Serializer):
 
     def create(self, data):
         """Generate or retrieve token"""
-        token, created = Token.objects.get_or_create(user=self.context['user'])
-        return self.context['user'], token.key
+        user = self.context['user']
+        if signed_token_setting('ENABLED'):
+            return user, issue_signed_token(user)
+
+        try:
+            token = user.auth_token
+        except Token.DoesNotExist:
+            # First login, the token was not found by the user query
+            try:
+                with transaction.atomic():
+                    token = Token.objects.create(user=user)
+            except IntegrityError:
+                token = Token.objects.get(user=user)
+        return user, token.key
 
 
 class UserCreateSerializer(serializers.Serializer):
@@ -73,6 +137,25 @@ class UserCreateSerializer(serializers.Serializer):
         return user
 
 
+class UserBulkItemSerializer(UserCreateSerializer):
+    """One user of a bulk create, uniqueness is checked for the whole batch"""
+
+    email = serializers.EmailField()
+    username = serializers.CharField(min_length=4, max_length=20)
+
+
+class UserBulkCreateSerializer(serializers.ListSerializer):
+
+    child = serializers.DictField()
+    max_length = 1000
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', getattr(
+            settings, 'BULK_CREATE_MAX_USERS', self.max_length))
+        kwargs.setdefault('allow_empty', False)
+        super().__init__(*args, **kwargs)
+
+
 class UserUpdateSerializer(UserCreateSerializer):
 
     def update(self, instance, data):
@@ -99,33 +182,125 @@ class ActivityReportSerializer(serializers.ModelSerializer):
         fields = ('user', 'date', 'count')
 
 
-class ActivityReportDaySerializer(serializers.BaseSerializer):
+class DateRangeQuerySerializer(serializers.Serializer):
+
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
 
-    def to_representation(self, queryset):
-        data = []
-        for row in queryset:
-            data.append(
-                {
-                    'user': row['user__username'],
-                    'date': row['date'].strftime("%d/%m/%Y"),
-                    'count': row['count']
-                }
-            )
+    def get_fields(self):
+        """Expose the date range as the ``from`` and ``to`` parameters"""
+        fields = super().get_fields()
+        fields['from'] = fields.pop('date_from')
+        fields['to'] = fields.pop('date_to')
+        return fields
+
+    def validate(self, data):
+        """Validate the date range"""
+        if data.get('from') and data.get('to') and data['from'] > data['to']:
+            raise serializers.ValidationError(
+                "'from' must be before 'to'.")
 
         return data
 
 
-class ActivityReportMonthSerializer(serializers.BaseSerializer):
+class ActivityReportQuerySerializer(DateRangeQuerySerializer):
+
+    user = serializers.CharField(required=False, max_length=150)
+    fill = serializers.BooleanField(required=False, default=False)
+    layout = serializers.ChoiceField(
+        choices=['rows', 'columns'], required=False, default='rows')
+
 
-    def to_representation(self, queryset):
-        data = []
-        for row in queryset:
-            data.append(
-                {
-                    'user': row['user__username'],
-                    'date': row['date'].strftime("%m/%Y"),
-                    'count': row['count']
-                }
-            )
+class ActiveUsersQuerySerializer(DateRangeQuerySerializer):
 
-        return data
\ No newline at end of file
+    bucket = serializers.ChoiceField(
+        choices=['day', 'week', 'month', 'year'], required=False)
+
+
+class ExportJobCreateSerializer(ActivityReportQuerySerializer):
+
+    bucket = serializers.ChoiceField(
+        choices=['hour', 'day', 'week', 'month', 'year'])
+    format = serializers.ChoiceField(
+        choices=['csv', 'ndjson'], required=False, default='csv')
+    layout = None
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = (
+            'id', 'status', 'params', 'rows', 'error', 'created_at',
+            'started_at', 'finished_at', 'expires_at', 'download')
+
+    def get_download(self, job):
+        if job.status != ExportJob.DONE:
+            return None
+        return reverse(
+            'export-download', args=[job.id],
+            request=self.context.get('request'))
+
+
+class UserActivityQuerySerializer(DateRangeQuerySerializer):
+
+    bucket = serializers.ChoiceField(
+        choices=['hour', 'day', 'week', 'month', 'year'], required=False)
+
+
+class TopUsersQuerySerializer(DateRangeQuerySerializer):
+
+    limit = serializers.IntegerField(
+        required=False, default=100, min_value=1,
+        max_value=TopUserCounter.CAPACITY)
+    exact = serializers.BooleanField(required=False, default=False)
+
+
+class ActivityReportBucketSerializer(serializers.BaseSerializer):
+    """Report rows as a list of objects, or as columns
+
+    With the ``columns`` layout in the context the report is one object of
+    ``user``, ``date`` and ``count`` lists. Usernames are sent once in
+    ``users`` and ``user`` holds indexes into it, which keeps reports
+    dominated by a few users small.
+    """
+
+    def to_representation(self, rows):
+        if self.context.get('layout') == 'columns':
+            return self.columns(rows)
+        return list(self.iter_representation(rows))
+
+    def iter_representation(self, rows):
+        """Lazily format report rows, used to stream large reports"""
+        for row in rows:
+            yield self.row_representation(row)
+
+    async def aiter_representation(self, rows):
+        """Async version of ``iter_representation``"""
+        async for row in rows:
+            yield self.row_representation(row)
+
+    def row_representation(self, row):
+        return {
+            'user': row['user'],
+            'date': row['label'],
+            'count': row['count']
+        }
+
+    def columns(self, rows):
+        users = []
+        indexes = {}
+        user = []
+        date = []
+        count = []
+        for row in rows:
+            index = indexes.get(row['user'])
+            if index is None:
+                index = indexes[row['user']] = len(users)
+                users.append(row['user'])
+            user.append(index)
+            date.append(row['label'])
+            count.append(row['count'])
+        return {'users': users, 'user': user, 'date': date, 'count': count}
@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .authentication import revocations
+from .models import TokenRevocation
+
+
+def revoke_tokens(user_id):
+    """Invalidate the signed tokens issued so far to the user"""
+    now = timezone.now()
+    TokenRevocation.objects.update_or_create(
+        user_id=user_id, defaults={'revoked_at': now})
+    revocations.add(user_id, now)
+
+
+@receiver(post_save, sender=User)
+def revoke_inactive_user_tokens(sender, instance, created, **kwargs):
+    if not created and not instance.is_active:
+        revoke_tokens(instance.id)
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    revoke_tokens(instance.id)
@@ -0,0 +1,97 @@
+"""HyperLogLog sketches of user ids
+
+A sketch has ``REGISTERS`` registers, each holding the highest rank of the
+user ids hashed to it (see ``ActiveUserSketchManager.add_sql``). Rather than
+one byte per register, it is stored as one bitmap per rank: bit ``r`` of
+level ``k`` is set when register ``r`` holds a rank above ``k``. The levels
+are ``LEVEL_BYTES`` long and stop at the highest rank seen, so a day with a
+few hundred users takes a few kilobytes, mostly zeros compressed by TOAST.
+With this layout merging sketches is an OR of big integers per level and
+the estimate only needs the population count of each level.
+
+Estimates use the improved estimator of Ertl, "New cardinality estimation
+algorithms for HyperLogLog sketches" (2017), which is unbiased from a
+single user to billions of them. The relative standard error is
+``STANDARD_ERROR`` (0.81%): 95% of the estimates are within 1.6% of the
+exact count. Small counts are close to exact.
+"""
+import math
+
+PRECISION = 14
+REGISTERS = 1 << PRECISION
+LEVEL_BYTES = REGISTERS // 8
+# Ranks go from 1 to the number of hash bits left after the register + 1
+MAX_RANK = 64 - PRECISION + 1
+STANDARD_ERROR = 1.04 / math.sqrt(REGISTERS)
+
+
+class Sketch(object):
+    """Mergeable HyperLogLog sketch, ``levels`` are the bitmaps as ints"""
+
+    def __init__(self, levels=None):
+        self.levels = levels or []
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls([
+            int.from_bytes(data[start:start + LEVEL_BYTES], 'little')
+            for start in range(0, len(data), LEVEL_BYTES)])
+
+    def to_bytes(self):
+        return b''.join(
+            level.to_bytes(LEVEL_BYTES, 'little') for level in self.levels)
+
+    def update(self, other):
+        """Merge ``other`` into this sketch"""
+        for number, level in enumerate(other.levels):
+            if number < len(self.levels):
+                self.levels[number] |= level
+            else:
+                self.levels.append(level)
+
+    def histogram(self):
+        """Number of registers holding each rank, from 0 to ``MAX_RANK``"""
+        at_least = [REGISTERS] + [level.bit_count() for level in self.levels]
+        at_least += [0] * (MAX_RANK + 2 - len(at_least))
+        return [at_least[rank] - at_least[rank + 1]
+                for rank in range(MAX_RANK + 1)]
+
+    def estimate(self):
+        """Estimated number of distinct users"""
+        counts = self.histogram()
+        if counts[0] == REGISTERS:
+            return 0
+        z = REGISTERS * tau(1 - counts[MAX_RANK] / REGISTERS)
+        for rank in range(MAX_RANK - 1, 0, -1):
+            z = 0.5 * (z + counts[rank])
+        z += REGISTERS * sigma(counts[0] / REGISTERS)
+        return round(REGISTERS ** 2 / (2 * math.log(2) * z))
+
+
+def sigma(x):
+    if x == 1:
+        return math.inf
+    y = 1
+    z = x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def tau(x):
+    if x == 0 or x == 1:
+        return 0
+    y = 1
+    z = 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
@@ -1,11 +1,47 @@
+from io import StringIO
 from json import dumps
+import csv
+import json
 import datetime
-
+import decimal
+import fcntl
+import gc
+import gzip
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APITestCase, APIClient
-
-from .models import ActivityReport
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import (
+    APITestCase, APITransactionTestCase, APIClient, APIRequestFactory)
+
+from . import bulk, dataset, events, exports, reports, schema, sketches
+from .authentication import (
+    SignedTokenAuthentication, issue_signed_token, revocations)
+from .events import BufferedEventWriter, get_event_writer, replay_spool
+from .loadtest import compare, percentile
+from .models import (
+    ActiveUserSketch, ActivityReport, DailyActivity, ExportJob,
+    TopUserCounter, UserPurge)
+from .pool import pools
+from .purge import purge_users, soft_delete
+from .renderers import FastJSONRenderer
+from .serializers import UserModelSerializer
+from .signals import revoke_tokens
+from .views import UserViewSet
+from .warmup import connect, views, warm_up
 
 
 class UserLoginTest(APITestCase):
@@ -29,6 +65,62 @@ class UserLoginTest(APITestCase):
         self.assertEqual(True, 'user' in response.json().keys())
         self.assertEqual(True, 'access_token' in response.json().keys())
 
+    def test_login_updates_daily_activity(self):
+        data = {'username': 'jhon', 'password': '12345678as'}
+
+        for i in range(2):
+            self.client.post(
+                '/user/login/', dumps(data),
+                content_type='application/json'
+            )
+
+        self.assertEqual(ActivityReport.objects.count(), 2)
+        self.assertEqual(DailyActivity.objects.count(), 1)
+        self.assertEqual(DailyActivity.objects.get().count, 2)
+
+    def test_login_query_budget(self):
+        user = User.objects.get(username='jhon')
+        Token.objects.create(user=user)
+        data = {'username': 'jhon', 'password': '12345678as'}
+
+        # User and token SELECT, then one statement for every write
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                '/user/login/', dumps(data),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+
+        user.refresh_from_db()
+        self.assertIsNotNone(user.last_login)
+        self.assertEqual(ActivityReport.objects.count(), 1)
+
+    def test_login_query_budget_new_token(self):
+        data = {'username': 'jhon', 'password': '12345678as'}
+
+        # Plus the token creation on the first login
+        with self.assertNumQueries(5):
+            response = self.client.post(
+                '/user/login/', dumps(data),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Token.objects.count(), 1)
+
+    def test_login_inactive(self):
+        User.objects.filter(username='jhon').update(is_active=False)
+        data = {'username': 'jhon', 'password': '12345678as'}
+
+        response = self.client.post(
+            '/user/login/', dumps(data),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            ['Invalid credentials.'],
+            response.json().get('non_field_errors'))
+
     def test_login_invalid_password(self):
         data = {'username': 'jhon', 'password': '12345678at'}
 
@@ -192,6 +284,24 @@ class UserUpdateTest(APITestCase):
             ['This field is required.'],
             response.json().get('last_name'))
 
+    def test_update_deleted_user(self):
+        data = {
+            'username': 'jhon2', 'email': 'jhon2@example.com',
+            'first_name': 'Jhon2', 'last_name': 'Doe2',
+            'password': '12345678as1', 'password_confirmation': '12345678as1'
+        }
+        soft_delete(self.user2)
+        client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+        response = client.put(
+            '/user/%s/' % self.user2.id, dumps(data),
+            content_type='application/json')
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual('Invalid user id.', response.json().get('detail'))
+        self.user2.refresh_from_db()
+        self.assertEqual('jhon1', self.user2.username)
+
     def test_update_no_token(self):
         client = APIClient()
         data = {
@@ -249,7 +359,50 @@ class UserListTest(APITestCase):
             HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
         response = client.get('/user/')
         self.assertEqual(200, response.status_code)
-        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertEqual(None, response.json()['next'])
+
+    def test_list_pages(self):
+        client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+        User.objects.create_user(
+            username='jhon2', email='jhon2@example.com', password='12345678as',
+            is_active=False)
+        User.objects.create_user(
+            username='jhon3', email='jhon3@example.com', password='12345678as')
+        usernames = []
+        url = '/user/?page_size=2'
+        while url:
+            response = client.get(url)
+            self.assertEqual(200, response.status_code)
+            self.assertLessEqual(len(response.json()['results']), 2)
+            usernames.extend(
+                user['username'] for user in response.json()['results'])
+            url = response.json()['next']
+        self.assertListEqual(['jhon', 'jhon1', 'jhon3'], usernames)
+
+    def test_list_fields(self):
+        client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+        response = client.get('/user/?fields=username,email&page_size=1')
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(
+            [{'username': 'jhon', 'email': 'jhon@example.com'}],
+            response.json()['results'])
+        response = client.get(response.json()['next'])
+        self.assertListEqual(
+            [{'username': 'jhon1', 'email': 'jhon1@example.com'}],
+            response.json()['results'])
+
+    def test_list_invalid_fields(self):
+        client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+        response = client.get('/user/?fields=username,password')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(
+            ['Unknown fields: password.'], response.json().get('fields'))
+        response = client.get('/user/?cursor=abc')
+        self.assertEqual(404, response.status_code)
 
     def test_list_no_token(self):
         client = APIClient()
@@ -339,9 +492,42 @@ class UserDeleteTest(APITestCase):
     def test_delete_ok(self):
         client = APIClient(
             HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+        Token.objects.get_or_create(user=self.user2)
         response = client.delete('/user/%s/' % self.user2.id)
         self.assertEqual(204, response.status_code)
+        self.assertEqual(User.objects.count(), 2)
+        self.assertFalse(User.objects.get(pk=self.user2.id).is_active)
+        self.assertFalse(Token.objects.filter(user=self.user2).exists())
+        self.assertTrue(UserPurge.objects.filter(user=self.user2).exists())
+
+        response = client.delete('/user/%s/' % self.user2.id)
+        self.assertEqual(404, response.status_code)
+
+        out = StringIO()
+        call_command('purge_users', stdout=out)
+        self.assertIn('Purged 1 users', out.getvalue())
         self.assertEqual(User.objects.count(), 1)
+        self.assertFalse(UserPurge.objects.exists())
+
+    def test_purge_batches(self):
+        ActivityReport.objects.record([
+            (user.id, datetime.datetime(
+                2020, 12, day, tzinfo=datetime.timezone.utc))
+            for day in range(1, 8) for user in (self.user, self.user2)])
+        soft_delete(self.user2)
+        self.assertEqual((1, 7), purge_users(batch_size=2, pause=0))
+        self.assertFalse(User.objects.filter(pk=self.user2.id).exists())
+        self.assertEqual(
+            7, ActivityReport.objects.filter(user=self.user).count())
+        self.assertEqual(
+            7, DailyActivity.objects.filter(user=self.user).count())
+
+    def test_purge_skips_active_users(self):
+        soft_delete(self.user2)
+        self.user2.is_active = True
+        self.user2.save()
+        self.assertEqual((0, 0), purge_users())
+        self.assertTrue(User.objects.filter(pk=self.user2.id).exists())
 
     def test_delete_invalid_id(self):
         client = APIClient(
@@ -398,6 +584,8 @@ class ActivityReportTest(APITestCase):
         a3.date = datetime.date(2020, 11, 18)
         a3.save()
 
+        call_command('rebuild_daily_activity', stdout=StringIO())
+
     def test_report_day_ok(self):
         client = APIClient(
             HTTP_AUTHORIZATION='Token ' + self.user1.auth_token.key)
@@ -465,3 +653,1570 @@ class ActivityReportTest(APITestCase):
         self.assertEqual(
             'Invalid token.',
             response.json().get('detail'))
+
+
+class DailyActivityRebuildTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+
+    def test_rebuild(self):
+        for day in (18, 18, 19):
+            report = ActivityReport.objects.create(user=self.user)
+            report.date = datetime.date(2020, 12, day)
+            report.save()
+        DailyActivity.objects.create(
+            user=self.user, date=datetime.date(2020, 1, 1), count=7)
+
+        call_command('rebuild_daily_activity', stdout=StringIO())
+
+        self.assertListEqual(
+            [(datetime.date(2020, 12, 18), 2), (datetime.date(2020, 12, 19), 1)],
+            list(DailyActivity.objects.order_by('date').values_list(
+                'date', 'count'))
+        )
+
+
+class ActivityReportBucketTest(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+        Token.objects.get_or_create(user=self.user1)
+        self.user2 = User.objects.create_user(
+            username='jhon1', email='jhon1@example.com', password='12345678as')
+
+        for user, date in (
+                (self.user1, datetime.date(2020, 12, 18)),
+                (self.user1, datetime.date(2020, 12, 18)),
+                (self.user1, datetime.date(2020, 12, 21)),
+                (self.user2, datetime.date(2020, 10, 2)),
+                (self.user2, datetime.date(2021, 1, 5))):
+            report = ActivityReport.objects.create(user=user)
+            report.date = date
+            report.save()
+        call_command('rebuild_daily_activity', stdout=StringIO())
+
+        self.client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user1.auth_token.key)
+
+    def test_report_month_groups_days(self):
+        response = self.client.get('/activityReport/month/')
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(
+            [
+                {'user': 'jhon1', 'date': '10/2020', 'count': 1},
+                {'user': 'jhon', 'date': '12/2020', 'count': 3},
+                {'user': 'jhon1', 'date': '01/2021', 'count': 1}
+            ],
+            response.json()
+        )
+
+    def test_report_week(self):
+        response = self.client.get('/activityReport/week/?user=jhon')
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(
+            [
+                {'user': 'jhon', 'date': '14/12/2020', 'count': 2},
+                {'user': 'jhon', 'date': '21/12/2020', 'count': 1}
+            ],
+            response.json()
+        )
+
+    def test_report_year(self):
+        response = self.client.get('/activityReport/year/')
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(
+            [
+                {'user': 'jhon', 'date': '2020', 'count': 3},
+                {'user': 'jhon1', 'date': '2020', 'count': 1},
+                {'user': 'jhon1', 'date': '2021', 'count': 1}
+            ],
+            response.json()
+        )
+
+    def test_report_date_range(self):
+        response = self.client.get(
+            '/activityReport/day/?from=2020-12-19&to=2021-01-31')
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(
+            [
+                {'user': 'jhon', 'date': '21/12/2020', 'count': 1},
+                {'user': 'jhon1', 'date': '05/01/2021', 'count': 1}
+            ],
+            response.json()
+        )
+
+    def test_report_fill(self):
+        response = self.client.get(
+            '/activityReport/month/?from=2020-11-10&to=2021-01-31&fill=true')
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(
+            [
+                {'user': 'jhon', 'date': '11/2020', 'count': 0},
+                {'user': 'jhon1', 'date': '11/2020', 'count': 0},
+                {'user': 'jhon', 'date': '12/2020', 'count': 3},
+                {'user': 'jhon1', 'date': '12/2020', 'count': 0},
+                {'user': 'jhon', 'date': '01/2021', 'count': 0},
+                {'user': 'jhon1', 'date': '01/2021', 'count': 1}
+            ],
+            response.json()
+        )
+
+    def test_report_csv(self):
+        response = self.client.get('/activityReport/month/?format=csv')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/csv', response['Content-Type'])
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            'jhon1, 10/2020, 1\n'
+            'jhon, 12/2020, 3\n'
+            'jhon1, 01/2021, 1\n',
+            b''.join(response.streaming_content).decode())
+
+    def test_report_csv_quoting(self):
+        self.user2.username = 'doe, "jhon"'
+        self.user2.save()
+        response = self.client.get('/activityReport/year/?format=csv')
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(
+            'jhon, 2020, 3\n'
+            '"doe, ""jhon""", 2020, 1\n'
+            '"doe, ""jhon""", 2021, 1\n',
+            content)
+        self.assertEqual(
+            [['jhon', '2020', '3'], ['doe, "jhon"', '2020', '1'],
+             ['doe, "jhon"', '2021', '1']],
+            list(csv.reader(StringIO(content), skipinitialspace=True)))
+
+    def test_report_csv_chunks(self):
+        expected = b''.join(self.client.get(
+            '/activityReport/day/?format=csv').streaming_content)
+        self.assertEqual(4, len(expected.splitlines()))
+        with mock.patch.object(reports.BucketReport, 'chunk_size', 2):
+            response = self.client.get('/activityReport/day/?format=csv')
+            self.assertEqual(
+                expected, b''.join(response.streaming_content))
+
+    def test_day_plan_reads_index_in_order(self):
+        report = reports.BucketReport('day')
+        report.after = (datetime.date(2020, 12, 18), self.user1.id)
+        sql, params = report.queryset(
+        )[:report.chunk_size].query.sql_with_params()
+        with transaction.atomic(), connection.cursor() as cursor:
+            # The tables are tiny, scanning and sorting them would always
+            # win: only a plan reading the index in order avoids a sort
+            for setting in ('enable_seqscan', 'enable_bitmapscan',
+                            'enable_sort'):
+                cursor.execute('SET LOCAL %s = off' % setting)
+            cursor.execute('EXPLAIN ' + sql, params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn('dailyactivity_date_user', plan)
+        self.assertIn('Index Cond: (date >=', plan)
+        self.assertNotRegex(plan, r'(^|-> +)Sort ')
+
+    def test_report_csv_errors(self):
+        response = self.client.get(
+            '/activityReport/month/?format=csv&from=yesterday')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual('application/json', response['Content-Type'])
+        self.assertIn('from', response.json())
+
+        response = APIClient().get(
+            '/activityReport/day/', HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(401, response.status_code)
+        self.assertEqual('application/json', response['Content-Type'])
+        self.assertIn('detail', response.json())
+
+    def test_report_ndjson(self):
+        response = self.client.get(
+            '/activityReport/day/?user=jhon',
+            HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            '{"user":"jhon","date":"18/12/2020","count":2}\n'
+            '{"user":"jhon","date":"21/12/2020","count":1}\n',
+            b''.join(response.streaming_content).decode())
+
+    def test_report_columns(self):
+        response = self.client.get(
+            '/activityReport/month/?from=2020-11-10&to=2021-01-31&fill=true'
+            '&layout=columns')
+        self.assertEqual(200, response.status_code)
+        self.assertDictEqual(
+            {
+                'users': ['jhon', 'jhon1'],
+                'user': [0, 1, 0, 1, 0, 1],
+                'date': [
+                    '11/2020', '11/2020', '12/2020', '12/2020', '01/2021',
+                    '01/2021'],
+                'count': [0, 0, 3, 0, 0, 1],
+            },
+            response.json()
+        )
+
+    def test_report_columns_size(self):
+        DailyActivity.objects.bulk_create(
+            DailyActivity(
+                user=user, date=datetime.date(2019, 1, 1)
+                + datetime.timedelta(days=day), count=day + 1)
+            for day in range(300) for user in (self.user1, self.user2))
+        rows = self.client.get('/activityReport/day/')
+        columns = self.client.get('/activityReport/day/?layout=columns')
+        self.assertEqual(
+            [row['count'] for row in rows.json()], columns.json()['count'])
+        self.assertLess(len(columns.content) * 2, len(rows.content))
+
+    def test_report_invalid_range(self):
+        response = self.client.get(
+            '/activityReport/day/?from=2021-01-01&to=2020-01-01')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(
+            ["'from' must be before 'to'."],
+            response.json().get('non_field_errors'))
+
+
+class ActivityReportPaginationTest(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+        Token.objects.get_or_create(user=self.user1)
+        self.user2 = User.objects.create_user(
+            username='jhon1', email='jhon1@example.com', password='12345678as')
+        for day in (1, 2, 3):
+            for user in (self.user1, self.user2):
+                DailyActivity.objects.create(
+                    user=user, date=datetime.date(2020, 12, day), count=day)
+
+        self.client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user1.auth_token.key)
+
+    def fetch_all(self, url):
+        results = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(200, response.status_code)
+            results.extend(response.json()['results'])
+            url = response.json()['next']
+        return results
+
+    def test_pages_match_full_report(self):
+        expected = self.client.get('/activityReport/day/').json()
+        self.assertEqual(6, len(expected))
+        response = self.client.get('/activityReport/day/?page_size=4')
+        self.assertEqual(4, len(response.json()['results']))
+        self.assertListEqual(
+            expected, self.fetch_all('/activityReport/day/?page_size=4'))
+
+    def test_pages_with_fill(self):
+        url = '/activityReport/day/?from=2020-11-30&to=2020-12-04&fill=true'
+        expected = self.client.get(url).json()
+        self.assertEqual(10, len(expected))
+        self.assertListEqual(expected, self.fetch_all(url + '&page_size=3'))
+
+    def test_pages_with_columns(self):
+        expected = self.client.get('/activityReport/day/?layout=columns')
+        response = self.client.get(
+            '/activityReport/day/?layout=columns&page_size=4')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            expected.json()['date'][:4], response.json()['results']['date'])
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(
+            expected.json()['count'][4:], response.json()['results']['count'])
+        self.assertEqual(None, response.json()['next'])
+
+    def test_last_page(self):
+        response = self.client.get('/activityReport/month/?page_size=5')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(None, response.json()['next'])
+        self.assertEqual(2, len(response.json()['results']))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/activityReport/day/?cursor=abc')
+        self.assertEqual(404, response.status_code)
+
+
+class BufferedEventWriterTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+        self.spool_dir = tempfile.mkdtemp()
+
+    def test_flush(self):
+        writer = BufferedEventWriter(self.spool_dir, max_delay=3600)
+        writer.record(self.user)
+        writer.record(self.user)
+        self.assertEqual(ActivityReport.objects.count(), 0)
+        self.assertEqual(1, len(os.listdir(self.spool_dir)))
+
+        writer.close()
+        self.assertEqual(ActivityReport.objects.count(), 2)
+        self.assertEqual(DailyActivity.objects.get().count, 2)
+        self.assertEqual([], os.listdir(self.spool_dir))
+
+    def test_replay(self):
+        path = os.path.join(self.spool_dir, 'events-crashed.spool')
+        with open(path, 'w') as spool:
+            spool.write('[%s, "2020-12-18"]\n' % self.user.id)
+            spool.write('[%s, "2020-12-18"]\n' % self.user.id)
+            spool.write('[%s, "2020-12-19"]\n' % (self.user.id + 1000))
+            spool.write('[%s, "2020-1' % self.user.id)
+
+        self.assertEqual(2, replay_spool(self.spool_dir))
+        self.assertEqual(
+            [(datetime.date(2020, 12, 18), 2)],
+            list(DailyActivity.objects.values_list('date', 'count')))
+        self.assertEqual(ActivityReport.objects.count(), 2)
+        self.assertEqual([], os.listdir(self.spool_dir))
+
+    def test_replay_race(self):
+        path = os.path.join(self.spool_dir, 'events-crashed.spool')
+        with open(path, 'w') as spool:
+            spool.write('[%s, "2020-12-18"]\n' % self.user.id)
+        flock = fcntl.flock
+
+        def replayed_meanwhile(spool, operation):
+            # Another process replays and removes the file while this one
+            # waits for the lock
+            flock(spool, operation)
+            os.unlink(path)
+
+        with mock.patch('fcntl.flock', replayed_meanwhile):
+            self.assertEqual(0, replay_spool(self.spool_dir))
+        self.assertEqual(ActivityReport.objects.count(), 0)
+
+        with open(path, 'w') as spool:
+            spool.write('[%s, "2020-12-18"]\n' % self.user.id)
+        with mock.patch('glob.glob', return_value=[path, path + '.gone']):
+            self.assertEqual(1, replay_spool(self.spool_dir))
+        self.assertEqual(ActivityReport.objects.count(), 1)
+
+    def test_login(self):
+        config = {
+            'BACKEND': 'user.events.BufferedEventWriter',
+            'OPTIONS': {'spool_dir': self.spool_dir, 'max_delay': 3600},
+        }
+        with override_settings(LOGIN_EVENT_WRITER=config):
+            response = self.client.post(
+                '/user/login/',
+                dumps({'username': 'jhon', 'password': '12345678as'}),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(ActivityReport.objects.count(), 0)
+            get_event_writer().flush()
+            self.assertEqual(ActivityReport.objects.count(), 1)
+
+    def test_fork(self):
+        config = {
+            'BACKEND': 'user.events.BufferedEventWriter',
+            'OPTIONS': {'spool_dir': self.spool_dir, 'max_delay': 3600},
+        }
+        with override_settings(LOGIN_EVENT_WRITER=config):
+            writer = get_event_writer()
+            writer.record(self.user)
+            spool = writer.spool.name
+
+            pid = os.fork()
+            if pid == 0:
+                # Child: the parent's writer and spool are left alone
+                ok = events._writer is None and writer.spool.closed
+                os._exit(0 if ok else 1)
+
+            pid, status = os.waitpid(pid, 0)
+            self.assertEqual(0, os.waitstatus_to_exitcode(status))
+            self.assertTrue(os.path.exists(spool))
+            self.assertIs(writer, get_event_writer())
+            writer.flush()
+            self.assertEqual(ActivityReport.objects.count(), 1)
+
+
+@override_settings(SIGNED_TOKEN={'ENABLED': True, 'MAX_AGE': 60})
+class SignedTokenTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+
+    def login(self):
+        response = self.client.post(
+            '/user/login/',
+            dumps({'username': 'jhon', 'password': '12345678as'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json().get('access_token')
+
+    def test_login_issues_signed_token(self):
+        token = self.login()
+        self.assertEqual(Token.objects.count(), 0)
+
+        client = APIClient(HTTP_AUTHORIZATION='Bearer ' + token)
+        response = client.get('/user/%s/' % self.user.id)
+        self.assertEqual(200, response.status_code)
+
+    def test_authenticate_without_queries(self):
+        token = issue_signed_token(self.user)
+        request = APIRequestFactory().get(
+            '/user/', HTTP_AUTHORIZATION='Bearer ' + token)
+        revocations.refresh(force=True)
+
+        with self.assertNumQueries(0):
+            user, auth = SignedTokenAuthentication().authenticate(request)
+        self.assertEqual(self.user.id, user.id)
+        self.assertEqual('jhon', user.username)
+
+    def test_invalid_token(self):
+        client = APIClient(HTTP_AUTHORIZATION='Bearer 1212212212')
+        response = client.get('/user/')
+        self.assertEqual(401, response.status_code)
+        self.assertEqual('Invalid token.', response.json().get('detail'))
+
+    def test_expired_token(self):
+        token = issue_signed_token(self.user)
+        client = APIClient(HTTP_AUTHORIZATION='Bearer ' + token)
+        with override_settings(SIGNED_TOKEN={'MAX_AGE': -1}):
+            response = client.get('/user/')
+        self.assertEqual(401, response.status_code)
+        self.assertEqual('Token has expired.', response.json().get('detail'))
+
+    def test_inactive_user_revoked(self):
+        token = self.login()
+        self.user.is_active = False
+        self.user.save()
+
+        client = APIClient(HTTP_AUTHORIZATION='Bearer ' + token)
+        response = client.get('/user/')
+        self.assertEqual(401, response.status_code)
+        self.assertEqual(
+            'Token has been revoked.', response.json().get('detail'))
+
+    def test_deleted_user_revoked_after_refresh(self):
+        token = self.login()
+        user_id = self.user.id
+        self.user.delete()
+        # Simulate a process that only learns about it from the database
+        revocations.revoked.pop(user_id)
+        revocations.refresh(force=True)
+
+        client = APIClient(HTTP_AUTHORIZATION='Bearer ' + token)
+        response = client.get('/user/')
+        self.assertEqual(401, response.status_code)
+
+
+class UserBulkCreateTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+        Token.objects.get_or_create(user=self.user)
+        self.client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+
+    def item(self, name, **kwargs):
+        data = {
+            'username': name, 'email': '%s@example.com' % name,
+            'first_name': 'Jhon', 'last_name': 'Doe',
+            'password': '12345678as', 'password_confirmation': '12345678as'
+        }
+        data.update(kwargs)
+        return data
+
+    @override_settings(BULK_CREATE_HASH_WORKERS=2)
+    def test_bulk_create_ok(self):
+        items = [self.item('user%s' % i) for i in range(4)]
+        # Token, one IN query per unique field, one INSERT in a savepoint
+        with self.assertNumQueries(6):
+            response = self.client.post(
+                '/user/bulk/', dumps(items), content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(
+            ['user0', 'user1', 'user2', 'user3'],
+            [result['user']['username'] for result in response.json()])
+        self.assertTrue(
+            User.objects.get(username='user3').check_password('12345678as'))
+
+    @override_settings(BULK_CREATE_HASH_WORKERS=2)
+    def test_hash_pool_reused(self):
+        hashed = bulk.hash_passwords(['12345678as'] * 4)
+        pool = bulk.hash_pool(2)
+        bulk.hash_passwords(['12345678as'] * 4)
+        self.assertIs(pool, bulk.hash_pool(2))
+        self.assertTrue(all(
+            check_password('12345678as', value) for value in hashed))
+
+    def test_bulk_create_errors(self):
+        items = [
+            self.item('user1'),
+            self.item('jhon'),
+            self.item('user1', email='other@example.com'),
+            self.item('user2', password_confirmation='12345678at'),
+            self.item('user3'),
+        ]
+        response = self.client.post(
+            '/user/bulk/', dumps(items), content_type='application/json')
+
+        self.assertEqual(response.status_code, 207)
+        results = response.json()
+        self.assertEqual(
+            [201, 400, 400, 400, 201],
+            [result['status'] for result in results])
+        self.assertEqual(
+            {'email': ['This field must be unique.'],
+             'username': ['This field must be unique.']},
+            results[1]['errors'])
+        self.assertEqual(
+            {'username': ['This field must be unique.']},
+            results[2]['errors'])
+        self.assertEqual(
+            ['Passwords do not match.'],
+            results[3]['errors']['non_field_errors'])
+        self.assertEqual(User.objects.count(), 3)
+
+    @override_settings(BULK_CREATE_MAX_USERS=2)
+    def test_bulk_create_too_many(self):
+        items = [self.item('user%s' % i) for i in range(3)]
+        response = self.client.post(
+            '/user/bulk/', dumps(items), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_bulk_create_no_token(self):
+        response = APIClient().post(
+            '/user/bulk/', dumps([self.item('user1')]),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+
+class ImportLoginsTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+        self.directory = tempfile.mkdtemp()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as stream:
+            stream.write(content)
+        return path
+
+    def test_import_csv(self):
+        path = self.write(
+            'logins.csv',
+            'username,date\n'
+            'jhon,2020-12-18\n'
+            'jhon,2020-12-18T10:00:00+00:00\n'
+            'jhon,2020-12-19\n'
+            'nobody,2020-12-19\n'
+            'jhon,not a date\n')
+        out = StringIO()
+        call_command('import_logins', path, '--batch-size', '2', stdout=out)
+
+        self.assertIn('Imported 3 login events', out.getvalue())
+        self.assertIn('skipped 2', out.getvalue())
+        self.assertListEqual(
+            [(datetime.date(2020, 12, 18), 2), (datetime.date(2020, 12, 19), 1)],
+            list(DailyActivity.objects.order_by('date').values_list(
+                'date', 'count'))
+        )
+        self.assertEqual(ActivityReport.objects.count(), 3)
+
+    def test_import_ndjson(self):
+        path = self.write(
+            'logins.ndjson',
+            '{"user_id": %d, "date": "2020-11-01"}\n'
+            '{"user_id": %d, "date": "2020-11-01"}\n' % (
+                self.user.id, self.user.id + 1000))
+        call_command('import_logins', path, stdout=StringIO())
+
+        self.assertEqual(
+            [datetime.date(2020, 11, 1)],
+            list(ActivityReport.objects.values_list('date', flat=True)))
+
+    def test_import_ndjson_invalid_lines(self):
+        path = self.write(
+            'logins.ndjson',
+            '{"user_id": %d, "date": "2020-11-01"}\n'
+            '{"user_id": %d, "date":\n'
+            '["jhon", "2020-11-02"]\n'
+            '{"username": ["jhon"], "date": "2020-11-02"}\n'
+            '\n'
+            '{"username": "jhon", "date": "2020-11-03"}\n' % (
+                self.user.id, self.user.id))
+        out = StringIO()
+        call_command('import_logins', path, stdout=out)
+
+        self.assertIn('Imported 2 login events', out.getvalue())
+        self.assertIn('skipped 3', out.getvalue())
+        self.assertEqual(
+            [datetime.date(2020, 11, 1), datetime.date(2020, 11, 3)],
+            list(ActivityReport.objects.order_by('date').values_list(
+                'date', flat=True)))
+
+
+class ActivityPartitionsTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+        for date in (datetime.date(2020, 11, 18), datetime.date(2020, 12, 18)):
+            report = ActivityReport.objects.create(user=self.user)
+            report.date = date
+            report.save()
+
+    def partitions(self):
+        from .partitions import partitions
+        with connection.cursor() as cursor:
+            return [name for name, month in partitions(cursor)]
+
+    def test_convert_and_retention(self):
+        out = StringIO()
+        call_command(
+            'activity_partitions', '--convert', '--ahead', '1', stdout=out)
+        self.assertIn('Converted ActivityReport', out.getvalue())
+
+        names = self.partitions()
+        self.assertEqual('user_activityreport_p2020_11', names[0])
+        self.assertEqual('user_activityreport_p2020_12', names[1])
+        self.assertEqual(2, ActivityReport.objects.count())
+
+        # New events keep getting ids and land in the current partition
+        report = ActivityReport.objects.create(user=self.user)
+        self.assertGreater(report.id, 0)
+        self.assertEqual(3, ActivityReport.objects.count())
+
+        call_command(
+            'activity_partitions', '--retention-months', '0', '--ahead', '1',
+            stdout=StringIO())
+        self.assertEqual(2, len(self.partitions()))
+        self.assertEqual(
+            [report.id],
+            list(ActivityReport.objects.values_list('id', flat=True)))
+
+    def test_create_with_rows_in_default(self):
+        from .partitions import add_months
+        call_command(
+            'activity_partitions', '--convert', '--ahead', '1',
+            stdout=StringIO())
+        month = add_months(
+            reports.truncate(datetime.date.today(), 'month'), 3)
+        report = ActivityReport.objects.create(user=self.user)
+        report.date = month
+        report.save()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM user_activityreport_default')
+            self.assertEqual([(report.id,)], cursor.fetchall())
+
+        out = StringIO()
+        call_command('activity_partitions', '--ahead', '3', stdout=out)
+        name = 'user_activityreport_p%04d_%02d' % (month.year, month.month)
+        self.assertIn('Created partition %s' % name, out.getvalue())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM {name}'.format(name=name))
+            self.assertEqual([(report.id,)], cursor.fetchall())
+            cursor.execute('SELECT id FROM user_activityreport_default')
+            self.assertEqual([], cursor.fetchall())
+        self.assertEqual(3, ActivityReport.objects.count())
+
+    def test_not_partitioned(self):
+        with self.assertRaises(CommandError):
+            call_command('activity_partitions', stdout=StringIO())
+
+
+class ActivityReportHourTest(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+        Token.objects.get_or_create(user=self.user1)
+        self.user2 = User.objects.create_user(
+            username='jhon1', email='jhon1@example.com', password='12345678as')
+
+        utc = datetime.timezone.utc
+        ActivityReport.objects.record([
+            (self.user1.id, datetime.datetime(2020, 12, 18, 9, 5, tzinfo=utc)),
+            (self.user1.id, datetime.datetime(2020, 12, 18, 9, 55, tzinfo=utc)),
+            (self.user2.id, datetime.datetime(2020, 12, 18, 9, 30, tzinfo=utc)),
+            (self.user2.id, datetime.datetime(2020, 12, 18, 11, 0, tzinfo=utc)),
+            (self.user2.id, datetime.datetime(2020, 12, 19, 0, 1, tzinfo=utc)),
+        ])
+
+        self.client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user1.auth_token.key)
+
+    def test_report_hour(self):
+        response = self.client.get('/activityReport/hour/?to=2020-12-18')
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(
+            [
+                {'user': 'jhon', 'date': '18/12/2020 09:00', 'count': 2},
+                {'user': 'jhon1', 'date': '18/12/2020 09:00', 'count': 1},
+                {'user': 'jhon1', 'date': '18/12/2020 11:00', 'count': 1}
+            ],
+            response.json()
+        )
+
+    def test_report_hour_fill_and_pages(self):
+        url = '/activityReport/hour/?from=2020-12-18&to=2020-12-18&fill=true'
+        expected = self.client.get(url).json()
+        self.assertEqual(48, len(expected))
+        self.assertEqual(
+            {'user': 'jhon', 'date': '18/12/2020 09:00', 'count': 2},
+            expected[18])
+
+        results = []
+        url += '&page_size=7'
+        while url:
+            response = self.client.get(url).json()
+            results.extend(response['results'])
+            url = response['next']
+        self.assertListEqual(expected, results)
+
+    def test_report_hour_date_bounds(self):
+        report = reports.BucketReport(
+            'hour', date_from=datetime.date(2020, 12, 18),
+            date_to=datetime.date(2020, 12, 18))
+        report.after = (
+            datetime.datetime(2020, 12, 18, 9, tzinfo=datetime.timezone.utc),
+            self.user1.id)
+        sql = str(report.queryset().query)
+        self.assertIn('"user_activityreport"."date" >= 2020-12-18', sql)
+        self.assertIn('"user_activityreport"."date" < 2020-12-19', sql)
+        self.assertEqual(
+            [('jhon1', 1), ('jhon1', 1)],
+            [(row['user'], row['count']) for row in report.rows()])
+
+    def test_events_keep_time(self):
+        self.assertEqual(
+            datetime.datetime(2020, 12, 19, 0, 1, tzinfo=datetime.timezone.utc),
+            ActivityReport.objects.filter(
+                date=datetime.date(2020, 12, 19)).get().logged_at)
+
+
+class MetricsTest(APITestCase):
+
+    def setUp(self):
+        User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+
+    def test_metrics(self):
+        data = {'username': 'jhon', 'password': '12345678as'}
+        self.client.post(
+            '/user/login/', dumps(data), content_type='application/json')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn(
+            'http_requests_total{method="POST",route="user-login",'
+            'status="201"}', body)
+        self.assertIn(
+            'http_request_duration_seconds_count{method="POST",'
+            'route="user-login"}', body)
+        self.assertIn('http_request_sql_queries_count{route="user-login"}', body)
+        self.assertIn('http_response_size_bytes_count{route="user-login"}', body)
+        self.assertIn('login_event_write_duration_seconds_count', body)
+
+    def test_metrics_multiprocess(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ['PROMETHEUS_MULTIPROC_DIR'] = directory
+            try:
+                response = self.client.get('/metrics')
+            finally:
+                del os.environ['PROMETHEUS_MULTIPROC_DIR']
+        self.assertEqual(200, response.status_code)
+
+
+class GenerateDatasetTest(APITestCase):
+
+    def test_generate_dataset(self):
+        call_command(
+            'generate_dataset', users=50, events=1000, batch_size=300,
+            stdout=StringIO())
+
+        users = User.objects.filter(username__startswith='load-')
+        self.assertEqual(50, users.count())
+        self.assertEqual(1000, ActivityReport.objects.count())
+        self.assertEqual(
+            1000, sum(DailyActivity.objects.values_list('count', flat=True)))
+        # Skewed towards the first users
+        first = ActivityReport.objects.filter(
+            user__username__lte='load-00000010').count()
+        self.assertGreater(first, 500)
+        self.assertTrue(users.get(username='load-00000001').check_password(
+            'load-test-password'))
+
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', users=10, events=10)
+        call_command(
+            'generate_dataset', users=10, events=10, clear=True,
+            stdout=StringIO())
+        self.assertEqual(10, users.count())
+        self.assertEqual(10, ActivityReport.objects.count())
+
+    def test_clear_keeps_other_users(self):
+        # A real user registered between two generated ones
+        users = [
+            User.objects.create_user(username=name)
+            for name in ('load-a', 'jhon', 'load-b')]
+        ActivityReport.objects.record(
+            [(user.id, timezone.now()) for user in users])
+
+        self.assertEqual(2, dataset.clear())
+        self.assertEqual(['jhon'], list(
+            User.objects.values_list('username', flat=True)))
+        self.assertEqual(
+            [users[1].id],
+            list(ActivityReport.objects.values_list('user_id', flat=True)))
+        self.assertEqual(
+            [users[1].id],
+            list(DailyActivity.objects.values_list('user_id', flat=True)))
+
+
+class LoadTestTest(APITransactionTestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, percentile(values, 0.5))
+        self.assertEqual(95, percentile(values, 0.95))
+        self.assertEqual(100, percentile(values, 0.99 + 0.01))
+        self.assertEqual(7, percentile([7], 0.99))
+
+    def test_compare(self):
+        baseline = {'user-list': {'p95': 10.0, 'throughput': 100.0, 'errors': 0}}
+        self.assertEqual([], compare(
+            {'user-list': {'p95': 11.0, 'throughput': 90.0, 'errors': 0}},
+            baseline))
+        self.assertEqual(3, len(compare(
+            {'user-list': {'p95': 13.0, 'throughput': 70.0, 'errors': 1}},
+            baseline)))
+
+    def test_loadtest_baseline(self):
+        call_command(
+            'generate_dataset', users=5, events=100, stdout=StringIO())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            options = {
+                'routes': ['user-list', 'report-day'], 'requests': 10,
+                'concurrency': 2, 'warmup': 0, 'baseline': path,
+                'stdout': StringIO()}
+
+            call_command('loadtest', save_baseline=True, **options)
+            with open(path) as baseline_file:
+                baseline = json.load(baseline_file)
+            self.assertEqual(['report-day', 'user-list'], sorted(baseline))
+            self.assertEqual(10, baseline['user-list']['requests'])
+            self.assertEqual(0, baseline['user-list']['errors'])
+
+            baseline['user-list']['p95'] = 0.0001
+            with open(path, 'w') as baseline_file:
+                json.dump(baseline, baseline_file)
+            with self.assertRaises(CommandError):
+                call_command('loadtest', stderr=StringIO(), **options)
+
+
+class AsyncViewsTest(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as',
+            first_name='Jhön', last_name='Doe')
+        Token.objects.get_or_create(user=self.user1)
+        self.user2 = User.objects.create_user(
+            username='jhon1', email='jhon1@example.com', password='12345678as')
+        ActivityReport.objects.record([
+            (self.user1.id, datetime.datetime(
+                2020, 12, 18, 9, tzinfo=datetime.timezone.utc)),
+            (self.user2.id, datetime.datetime(
+                2020, 12, 18, 10, tzinfo=datetime.timezone.utc)),
+            (self.user2.id, datetime.datetime(
+                2020, 11, 18, 10, tzinfo=datetime.timezone.utc)),
+        ])
+        self.client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user1.auth_token.key)
+
+    def test_docs_root(self):
+        with self.settings(ROOT_URLCONF='user_api.asgi_urls'):
+            self.assertEqual('schema-swagger-ui', resolve('/').url_name)
+            self.assertEqual(
+                'api-root', resolve('/.json').url_name)
+            self.assertEqual(200, self.client.get('/').status_code)
+
+    async def test_stream_under_asgi(self):
+        url = '/activityReport/day/?format=csv'
+        expected = await sync_to_async(
+            lambda: self.body(self.client.get(url)))()
+        headers = {'Authorization': 'Token ' + self.user1.auth_token.key}
+        with self.settings(ROOT_URLCONF='user_api.asgi_urls'):
+            response = await AsyncClient().get(url, headers=headers)
+            # Async content is sent as it is read rather than buffered
+            self.assertTrue(response.is_async)
+            content = b''.join(
+                [chunk async for chunk in response.streaming_content])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(expected, content)
+
+    def assertSameResponse(self, url, client=None, **extra):
+        client = client or self.client
+        expected = client.get(url, **extra)
+        with self.settings(ROOT_URLCONF='user_api.asgi_urls'):
+            response = client.get(url, **extra)
+        self.assertEqual(expected.status_code, response.status_code)
+        self.assertEqual(self.body(expected), self.body(response))
+        return response
+
+    def body(self, response):
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def test_same_responses(self):
+        for url in [
+                '/user/', '/user/%s/' % self.user1.id, '/user/0/',
+                '/user/?fields=id,last_name', '/user/?fields=nope',
+                '/user/?page_size=1&cursor=bad',
+                '/user/abc/', '/activityReport/day/',
+                '/activityReport/month/?fill=true',
+                '/activityReport/hour/?from=2020-12-18&to=2020-12-18',
+                '/activityReport/day/?from=2020-12-19&to=2020-12-18',
+                '/activityReport/day/?page_size=1&fill=true',
+                '/activityReport/day/?layout=columns',
+                '/activityReport/hour/?layout=columns&page_size=1',
+                '/activityReport/day/?layout=other',
+                '/activityReport/day/?cursor=bad']:
+            self.assertSameResponse(url)
+
+        for url in [
+                '/activityReport/day/?page_size=1',
+                '/user/?page_size=1&fields=username']:
+            while url:
+                url = self.assertSameResponse(url).json()['next']
+
+    def test_same_authentication_errors(self):
+        self.assertSameResponse('/user/', client=APIClient())
+        self.assertSameResponse(
+            '/user/', client=APIClient(HTTP_AUTHORIZATION='Token bad'))
+        self.assertSameResponse(
+            '/user/', client=APIClient(HTTP_AUTHORIZATION='Bearer bad'))
+        response = self.assertSameResponse(
+            '/user/', client=APIClient(HTTP_AUTHORIZATION='Token'))
+        self.assertEqual(401, response.status_code)
+        self.assertEqual('Token', response['WWW-Authenticate'])
+
+    def test_signed_token(self):
+        client = APIClient(
+            HTTP_AUTHORIZATION='Bearer ' + issue_signed_token(self.user1))
+        response = self.assertSameResponse('/user/', client=client)
+        self.assertEqual(200, response.status_code)
+
+        revoke_tokens(self.user1.id)
+        revocations.loaded_at = None
+        response = self.assertSameResponse('/user/', client=client)
+        self.assertEqual('Token has been revoked.', response.json()['detail'])
+
+    def test_other_requests_use_viewsets(self):
+        response = self.assertSameResponse(
+            '/activityReport/day/', HTTP_ACCEPT='text/csv')
+        self.assertEqual('text/csv', response['Content-Type'])
+
+        with self.settings(ROOT_URLCONF='user_api.asgi_urls'):
+            response = self.client.post(
+                '/user/', dumps({
+                    'username': 'jhon2', 'email': 'jhon2@example.com',
+                    'first_name': 'Jhon', 'last_name': 'Doe',
+                    'password': '12345678as',
+                    'password_confirmation': '12345678as'}),
+                content_type='application/json')
+        self.assertEqual(201, response.status_code)
+
+
+class ConnectionPoolTest(APITestCase):
+
+    def test_pool_metrics(self):
+        self.assertEqual(['default'], [alias for alias, pool in pools()])
+
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('db_pool_connections{alias="default"', body)
+        self.assertIn('db_pool_utilization{alias="default"', body)
+        self.assertIn('db_pool_wait_seconds_total{alias="default"', body)
+
+    def test_fork_keeps_parent_connection(self):
+        User.objects.create_user(username='jhon', password='12345678as')
+
+        pid = os.fork()
+        if pid == 0:
+            # Child: the inherited pool and connection are forgotten
+            ok = not pools() and connection.connection is None
+            gc.collect()
+            os._exit(0 if ok else 1)
+
+        pid, status = os.waitpid(pid, 0)
+        self.assertEqual(0, os.waitstatus_to_exitcode(status))
+        self.assertTrue(User.objects.filter(username='jhon').exists())
+
+
+class UserFastPathTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as',
+            first_name='Jhön \u2028 "漢"', last_name='Doe\u2029\n')
+        Token.objects.get_or_create(user=self.user)
+        User.objects.create_user(
+            username='jhon1', email='jhon1@example.com', password='12345678as')
+        self.client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+
+    def test_same_bytes(self):
+        users = User.objects.filter(is_active=True).order_by('id')
+        self.assertEqual(
+            JSONRenderer().render({
+                'next': None,
+                'results': UserModelSerializer(users, many=True).data}),
+            self.client.get('/user/').content)
+        self.assertEqual(
+            JSONRenderer().render(UserModelSerializer(self.user).data),
+            self.client.get('/user/%s/' % self.user.id).content)
+
+        response = self.client.post(
+            '/user/login/',
+            dumps({'username': 'jhon', 'password': '12345678as'}),
+            content_type='application/json')
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(
+            JSONRenderer().render({
+                'user': UserModelSerializer(self.user).data,
+                'access_token': self.user.auth_token.key}),
+            response.content)
+
+    def test_retrieve_not_found(self):
+        response = self.client.get('/user/0/')
+        self.assertEqual(404, response.status_code)
+        self.assertEqual(
+            'No User matches the given query.', response.json()['detail'])
+        self.assertEqual(404, self.client.get('/user/abc/').status_code)
+
+    def test_renderer(self):
+        data = {
+            'date': datetime.datetime(
+                2020, 12, 18, 9, 5, 1, 123456, tzinfo=datetime.timezone.utc),
+            'day': datetime.date(2020, 12, 18),
+            'amount': decimal.Decimal('1.10'),
+            1: ['\u2028', None, True],
+        }
+        self.assertEqual(
+            JSONRenderer().render(data), FastJSONRenderer().render(data))
+        # Too large for orjson
+        self.assertEqual(
+            b'[1180591620717411303424]', FastJSONRenderer().render([2 ** 70]))
+        self.assertEqual(
+            JSONRenderer().render(data, 'application/json; indent=2'),
+            FastJSONRenderer().render(data, 'application/json; indent=2'))
+        self.assertEqual(b'', FastJSONRenderer().render(None))
+
+
+class SchemaTest(APITestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'openapi.json')
+        schema._schema = None
+        self.addCleanup(setattr, schema, '_schema', None)
+
+    def test_generate_and_serve(self):
+        with override_settings(OPENAPI_SCHEMA_FILE=self.path):
+            call_command('generate_schema', stdout=StringIO())
+            with open(self.path, 'rb') as f:
+                content = f.read()
+            self.assertIn('/user/{id}/', json.loads(content)['paths'])
+
+            response = self.client.get('/openapi.json')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(content, response.content)
+            self.assertEqual('public, max-age=86400', response['Cache-Control'])
+
+            response = self.client.get(
+                '/openapi.json', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(304, response.status_code)
+
+    def test_schema_read_once(self):
+        with override_settings(OPENAPI_SCHEMA_FILE=self.path):
+            with open(self.path, 'wb') as f:
+                f.write(b'{"paths": {}}')
+            self.assertEqual(b'{"paths": {}}', self.client.get(
+                '/openapi.json').content)
+            os.remove(self.path)
+            self.assertEqual(b'{"paths": {}}', self.client.get(
+                '/openapi.json').content)
+
+    def test_debug_generates(self):
+        with override_settings(OPENAPI_SCHEMA_FILE=self.path, DEBUG=True):
+            with open(self.path, 'wb') as f:
+                f.write(b'{"paths": {}}')
+            response = self.client.get('/openapi.json')
+            self.assertIn('/user/', response.json()['paths'])
+            self.assertFalse(response.has_header('ETag'))
+
+    def test_ui_pages(self):
+        response = self.client.get('/')
+        self.assertEqual(200, response.status_code)
+        self.assertIn(b'/openapi.json', response.content)
+        response = self.client.get('/redoc/')
+        self.assertEqual(200, response.status_code)
+        self.assertIn(b'/openapi.json', response.content)
+
+
+class WarmUpTest(APITestCase):
+
+    def test_warm_up(self):
+        self.addCleanup(setattr, schema, '_schema', None)
+        self.assertIn(UserViewSet, views())
+        warm_up()
+        connect()
+        self.assertEqual(200, self.client.get('/openapi.json').status_code)
+
+
+class ActiveUsersTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+        Token.objects.get_or_create(user=self.user)
+        self.client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+
+    def login(self, user, *dates):
+        ActivityReport.objects.record([
+            (user.id, datetime.datetime(
+                date.year, date.month, date.day, 12,
+                tzinfo=datetime.timezone.utc))
+            for date in dates])
+
+    def test_login_updates_sketch(self):
+        data = {'username': 'jhon', 'password': '12345678as'}
+        for i in range(2):
+            self.client.post(
+                '/user/login/', dumps(data), content_type='application/json')
+
+        response = self.client.get('/activityReport/active-users/')
+        self.assertEqual(200, response.status_code)
+        today = timezone.localdate().isoformat()
+        self.assertDictEqual(
+            {'from': today, 'to': today, 'active_users': 1,
+             'standard_error': sketches.STANDARD_ERROR},
+            response.json())
+        self.assertListEqual(
+            ['day', 'month'],
+            list(ActiveUserSketch.objects.order_by('span').values_list(
+                'span', flat=True)))
+
+    def test_buckets(self):
+        other = User.objects.create_user(
+            username='jhon1', email='jhon1@example.com', password='12345678as')
+        self.login(
+            self.user, datetime.date(2020, 12, 1), datetime.date(2020, 12, 18),
+            datetime.date(2021, 1, 5))
+        self.login(other, datetime.date(2020, 12, 18), datetime.date(2020, 12, 31))
+
+        response = self.client.get(
+            '/activityReport/active-users/'
+            '?from=2020-12-02&to=2021-01-31&bucket=month')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, response.json()['active_users'])
+        self.assertListEqual(
+            [{'date': '12/2020', 'active_users': 2},
+             {'date': '01/2021', 'active_users': 1}],
+            response.json()['buckets'])
+
+        response = self.client.get(
+            '/activityReport/active-users/'
+            '?from=2020-12-14&to=2020-12-31&bucket=week')
+        self.assertListEqual(
+            [2, 0, 1],
+            [row['active_users'] for row in response.json()['buckets']])
+
+    def test_estimate(self):
+        first_id, last_id = dataset.generate_users(3000)
+        dataset.generate_events(first_id, last_id, 20000, days=60)
+
+        today = timezone.localdate()
+        for days in (0, 6, 29, 60):
+            date_from = today - datetime.timedelta(days=days)
+            exact = ActivityReport.objects.filter(
+                date__gte=date_from).values('user_id').distinct().count()
+            estimate = reports.active_users(
+                date_from, today)['active_users']
+            self.assertLess(
+                abs(estimate - exact), 3 * sketches.STANDARD_ERROR * exact)
+
+    def test_rebuild(self):
+        self.login(self.user, datetime.date(2020, 12, 18))
+        ActiveUserSketch.objects.all().delete()
+
+        call_command('rebuild_daily_activity', stdout=StringIO())
+
+        self.assertEqual(1, reports.active_users(
+            datetime.date(2020, 12, 1),
+            datetime.date(2020, 12, 31))['active_users'])
+
+    def test_merge(self):
+        first, second, both = (
+            sketches.Sketch.from_bytes(b'\x01' + bytes(2047) + b'\x01'),
+            sketches.Sketch.from_bytes(b'\x02'),
+            sketches.Sketch())
+        both.update(first)
+        both.update(second)
+        self.assertEqual(
+            b'\x03' + bytes(2047) + b'\x01' + bytes(2047), both.to_bytes())
+        self.assertEqual(2, both.estimate())
+        self.assertEqual(0, sketches.Sketch().estimate())
+
+    def test_invalid_query(self):
+        response = self.client.get(
+            '/activityReport/active-users/?from=2021-01-02&to=2021-01-01')
+        self.assertEqual(400, response.status_code)
+        response = self.client.get(
+            '/activityReport/active-users/?bucket=hour')
+        self.assertEqual(400, response.status_code)
+
+
+class ActiveUserSketchLockTest(APITransactionTestCase):
+
+    def test_repeat_login_does_not_wait(self):
+        users = [
+            User.objects.create_user(
+                username='jhon%d' % number,
+                email='jhon%d@example.com' % number, password='12345678as')
+            for number in range(2)]
+        now = timezone.now()
+        ActivityReport.objects.record([(user.id, now) for user in users])
+
+        recorded = threading.Event()
+        done = threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    ActivityReport.objects.record([(users[0].id, now)])
+                    recorded.set()
+                    done.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            self.assertTrue(recorded.wait(10))
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = '1s'")
+                ActivityReport.objects.record([(users[1].id, now)])
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual(4, ActivityReport.objects.count())
+
+
+class TopUsersTest(APITestCase):
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                username='jhon%d' % number,
+                email='jhon%d@example.com' % number, password='12345678as')
+            for number in range(4)]
+        Token.objects.get_or_create(user=self.users[0])
+        self.client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.users[0].auth_token.key)
+
+    def login(self, user, date, times=1):
+        for i in range(times):
+            ActivityReport.objects.record([(user.id, datetime.datetime(
+                date.year, date.month, date.day, 12,
+                tzinfo=datetime.timezone.utc))])
+
+    def test_top(self):
+        self.login(self.users[1], datetime.date(2020, 12, 18), 3)
+        self.login(self.users[0], datetime.date(2020, 12, 19), 2)
+        self.login(self.users[0], datetime.date(2021, 1, 5))
+
+        response = self.client.get(
+            '/activityReport/top/?from=2020-12-01&to=2021-01-31&limit=1')
+        self.assertEqual(200, response.status_code)
+        self.assertDictEqual({
+            'from': '2020-12-01', 'to': '2021-01-31', 'exact': False,
+            'results': [{'user': 'jhon0', 'count': 3, 'error': 0}],
+        }, response.json())
+
+        response = self.client.get(
+            '/activityReport/top/?from=2020-12-18&to=2020-12-31&exact=true')
+        self.assertListEqual(
+            [{'user': 'jhon1', 'count': 3, 'error': 0},
+             {'user': 'jhon0', 'count': 2, 'error': 0}],
+            response.json()['results'])
+
+    @mock.patch.object(TopUserCounter, 'CAPACITY', 2)
+    def test_bounds(self):
+        days = [datetime.date(2020, 12, day) for day in (1, 2, 3)]
+        for day in days:
+            for user, times in zip(self.users, (5, 3, 2, 1)):
+                self.login(user, day, times)
+            self.login(self.users[3], day, 3)
+
+        for date_from, date_to in (
+                (days[0], days[0]), (days[0], days[2]),
+                (datetime.date(2020, 12, 1), datetime.date(2020, 12, 31))):
+            exact = dict(
+                (user, count) for user, count, error in reports.top_users(
+                    date_from, date_to, 4, exact=True))
+            top = reports.top_users(date_from, date_to, 4)
+            self.assertIn('jhon0', [user for user, count, error in top])
+            for user, count, error in top:
+                self.assertLessEqual(count - error, exact[user])
+                self.assertLessEqual(exact[user], count)
+            self.assertLessEqual(
+                TopUserCounter.objects.filter(span='day', date=date_from).count(),
+                3)
+
+    def test_rebuild(self):
+        self.login(self.users[1], datetime.date(2020, 12, 18), 2)
+        TopUserCounter.objects.all().delete()
+
+        call_command('rebuild_daily_activity', stdout=StringIO())
+
+        self.assertListEqual(
+            [('jhon1', 2, 0)],
+            reports.top_users(
+                datetime.date(2020, 12, 1), datetime.date(2020, 12, 31)))
+
+    def test_invalid_query(self):
+        response = self.client.get('/activityReport/top/?limit=0')
+        self.assertEqual(400, response.status_code)
+        response = self.client.get(
+            '/activityReport/top/?from=2021-01-02&to=2021-01-01')
+        self.assertEqual(400, response.status_code)
+
+
+class UserActivityTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+        Token.objects.get_or_create(user=self.user)
+        self.client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+        other = User.objects.create_user(
+            username='jhon1', email='jhon1@example.com', password='12345678as')
+        ActivityReport.objects.record([
+            (user.id, datetime.datetime(
+                2020, month, day, hour, tzinfo=datetime.timezone.utc))
+            for user, month, day, hour in (
+                (self.user, 12, 18, 10), (self.user, 12, 18, 9),
+                (other, 12, 18, 11), (self.user, 12, 21, 8),
+                (self.user, 1, 5, 8))])
+        self.url = '/user/%s/activity/' % self.user.id
+
+    def test_events(self):
+        response = self.client.get(self.url + '?page_size=2&from=2020-02-01')
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(
+            ['2020-12-18T09:00:00Z', '2020-12-18T10:00:00Z'],
+            [row['logged_at'] for row in response.json()['results']])
+
+        response = self.client.get(response.json()['next'])
+        self.assertListEqual(
+            ['2020-12-21T08:00:00Z'],
+            [row['logged_at'] for row in response.json()['results']])
+        self.assertIsNone(response.json()['next'])
+
+    def test_buckets(self):
+        response = self.client.get(self.url + '?bucket=month&page_size=1')
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(
+            [{'date': '01/2020', 'count': 1}], response.json()['results'])
+
+        response = self.client.get(response.json()['next'])
+        self.assertDictEqual(
+            {'next': None, 'results': [{'date': '12/2020', 'count': 3}]},
+            response.json())
+
+        response = self.client.get(
+            self.url + '?bucket=day&from=2020-12-01&to=2020-12-20')
+        self.assertListEqual(
+            [{'date': '18/12/2020', 'count': 2}], response.json()['results'])
+
+        response = self.client.get(self.url + '?bucket=hour&to=2020-01-31')
+        self.assertListEqual(
+            [{'date': '05/01/2020 08:00', 'count': 1}],
+            response.json()['results'])
+
+    def test_no_user_join(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url + '?bucket=week')
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('auth_user', queries.captured_queries[-1]['sql'])
+        self.assertIn('user_activityreport', queries.captured_queries[-1]['sql'])
+
+    def test_invalid(self):
+        response = self.client.get('/user/%s/activity/' % (self.user.id + 100))
+        self.assertEqual(404, response.status_code)
+        response = self.client.get(self.url + '?bucket=minute')
+        self.assertEqual(400, response.status_code)
+        response = self.client.get(self.url + '?cursor=bad')
+        self.assertEqual(404, response.status_code)
+
+
+class ExportJobTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jhon', email='jhon@example.com', password='12345678as')
+        Token.objects.get_or_create(user=self.user)
+        self.client = APIClient(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key)
+        for date in (datetime.date(2020, 12, 18), datetime.date(2021, 1, 5)):
+            report = ActivityReport.objects.create(user=self.user)
+            report.date = date
+            report.save()
+        call_command('rebuild_daily_activity', stdout=StringIO())
+
+        directory = tempfile.mkdtemp()
+        settings = override_settings(EXPORT_DIR=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def submit(self, **data):
+        return self.client.post(
+            '/activityReport/export/', dumps(data),
+            content_type='application/json')
+
+    def test_export(self):
+        response = self.submit(bucket='month')
+        self.assertEqual(202, response.status_code)
+        self.assertEqual('queued', response.json()['status'])
+        self.assertIsNone(response.json()['download'])
+        job_id = response.json()['id']
+
+        # Identical requests share the job
+        response = self.submit(bucket='month', format='csv')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(job_id, response.json()['id'])
+        response = self.client.get(
+            '/activityReport/export/%s/download/' % job_id)
+        self.assertEqual(409, response.status_code)
+
+        out = StringIO()
+        call_command('export_reports', stdout=out)
+        self.assertIn('Ran 1 exports', out.getvalue())
+
+        response = self.client.get('/activityReport/export/%s/' % job_id)
+        self.assertEqual('done', response.json()['status'])
+        self.assertEqual(2, response.json()['rows'])
+        response = self.client.get(response.json()['download'])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            self.client.get('/activityReport/month/?format=csv').getvalue(),
+            gzip.decompress(response.getvalue()))
+
+    def test_ndjson(self):
+        job_id = self.submit(
+            bucket='day', format='ndjson', to='2020-12-31').json()['id']
+        exports.process()
+
+        response = self.client.get(
+            '/activityReport/export/%s/download/' % job_id)
+        self.assertEqual(
+            [{'user': 'jhon', 'date': '18/12/2020', 'count': 1}],
+            [json.loads(line) for line in gzip.decompress(
+                response.getvalue()).splitlines()])
+
+    def test_expire(self):
+        job_id = self.submit(bucket='year').json()['id']
+        exports.process()
+        job = ExportJob.objects.get(pk=job_id)
+        self.assertTrue(os.path.exists(exports.path(job)))
+
+        ExportJob.objects.update(
+            expires_at=datetime.datetime(
+                2020, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(1, exports.expire())
+        self.assertFalse(os.path.exists(exports.path(job)))
+        response = self.client.get(
+            '/activityReport/export/%s/download/' % job_id)
+        self.assertEqual(410, response.status_code)
+
+        response = self.submit(bucket='year')
+        self.assertEqual(202, response.status_code)
+        self.assertNotEqual(job_id, response.json()['id'])
+
+    async def test_download_under_asgi(self):
+        response = await sync_to_async(self.submit)(bucket='year')
+        job_id = response.json()['id']
+        await sync_to_async(exports.process)()
+        job = await ExportJob.objects.aget(pk=job_id)
+        with open(exports.path(job), 'rb') as stream:
+            expected = stream.read()
+
+        response = await AsyncClient().get(
+            '/activityReport/export/%s/download/' % job_id,
+            headers={'Authorization': 'Token ' + self.user.auth_token.key})
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.is_async)
+        self.assertEqual(str(len(expected)), response['Content-Length'])
+        self.assertEqual(expected, b''.join(
+            [chunk async for chunk in response.streaming_content]))
+
+    def test_missing_file(self):
+        job_id = self.submit(bucket='year').json()['id']
+        exports.process()
+        os.remove(exports.path(ExportJob.objects.get(pk=job_id)))
+
+        response = self.client.get(
+            '/activityReport/export/%s/download/' % job_id)
+        self.assertEqual(410, response.status_code)
+        self.assertEqual('expired', ExportJob.objects.get(pk=job_id).status)
+
+    def test_failed_and_stale(self):
+        job, created = exports.submit(exports.job_params({
+            'bucket': 'minute', 'fill': False, 'format': 'csv'}))
+        with self.assertLogs('user.exports', 'ERROR'):
+            exports.process()
+        job.refresh_from_db()
+        self.assertEqual('failed', job.status)
+        self.assertIn('minute', job.error)
+
+        job_id = self.submit(bucket='day').json()['id']
+        self.assertEqual(job_id, exports.claim().id)
+        self.assertIsNone(exports.claim())
+        self.assertEqual(0, exports.requeue_stale(60))
+        self.assertEqual(1, exports.requeue_stale(0))
+        self.assertEqual('queued', ExportJob.objects.get(pk=job_id).status)
+
+    def test_invalid(self):
+        self.assertEqual(400, self.submit().status_code)
+        self.assertEqual(400, self.submit(bucket='day', format='xml').status_code)
+        self.assertEqual(
+            404, self.client.get('/activityReport/export/999/').status_code)
+
+
+class ExportHeartbeatTest(APITransactionTestCase):
+
+    def test_heartbeat(self):
+        job, created = exports.submit(exports.job_params({
+            'bucket': 'day', 'fill': False, 'format': 'csv'}))
+        job = exports.claim()
+        started = job.updated_at
+
+        with exports.Heartbeat(job, 0.01) as beat:
+            beat.rows = 5
+            time.sleep(0.2)
+        job.refresh_from_db()
+        self.assertEqual(5, job.rows)
+        self.assertGreater(job.updated_at, started)
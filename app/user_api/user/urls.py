@@ -1,5 +1,8 @@
-from django.urls import include, path
+from functools import partial
+
+from django.urls import re_path
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from . import views as user_views
 
 router = DefaultRouter()
@@ -7,5 +10,34 @@ router.register(r'user', user_views.UserViewSet, basename='user')
 router.register(
     r'activityReport', user_views.ActivityReportViewSet,
     basename='activityReport')
+router.register(
+    r'activityReport/export', user_views.ExportJobViewSet, basename='export')
+
+
+def async_urlpatterns():
+    """Router URLs with native async views for the read endpoints
+
+    The async views hand the requests they do not serve to the viewset.
+    Routes keep the router order, ``user/login/`` must be matched before
+    the user detail route. They replace ``user.urls`` where the project
+    includes it, so ``/`` stays the docs page rather than the API root.
+    """
+    views = {
+        'user-list': async_views.user_list,
+        'user-detail': async_views.user_detail,
+    }
+    for bucket in ('hour', 'day', 'week', 'month', 'year'):
+        views['activityReport-' + bucket] = partial(
+            async_views.report, bucket=bucket)
+
+    patterns = []
+    for url in router.urls:
+        if url.name in views and 'format' not in url.pattern.regex.groupindex:
+            url = re_path(
+                url.pattern.regex.pattern,
+                async_views.dispatch(views[url.name], url.callback),
+                name=url.name)
+        patterns.append(url)
+    return patterns
 
 urlpatterns = router.urls
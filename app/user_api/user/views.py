@@ -1,24 +1,81 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
-from django.db.models import Count
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
 
-from rest_framework import status, viewsets, permissions
+from rest_framework import mixins, status, viewsets, permissions
+from rest_framework.generics import get_object_or_404
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from .serializers import (
     UserLoginSerializer, UserModelSerializer,
-    UserCreateSerializer, UserUpdateSerializer, ActivityReportSerializer,
-    ActivityReportDaySerializer, ActivityReportMonthSerializer)
-from .models import ActivityReport
+    UserCreateSerializer, UserUpdateSerializer, UserBulkCreateSerializer,
+    ActivityReportSerializer,
+    ActivityReportQuerySerializer, ActivityReportBucketSerializer,
+    ActiveUsersQuerySerializer, TopUsersQuerySerializer,
+    UserActivityQuerySerializer, ExportJobCreateSerializer,
+    ExportJobSerializer,
+    UserListQuerySerializer, USER_FIELDS, user_data, user_values)
+from .bulk import bulk_create_users
+from .events import get_event_writer
+from .exports import job_params, mark_expired, path, submit
+from .metrics import LOGIN_EVENT_WRITE
+from .models import ActivityReport, ExportJob
+from .pagination import (
+    ReportKeysetPagination, UserActivityPagination, UserKeysetPagination)
+from .purge import soft_delete
+from .renderers import (
+    CSVRenderer, FastJSONRenderer, NDJSONRenderer, StreamingRenderer)
+from .reports import BucketReport, UserActivity, active_users, top_users
 from .mixins import MixedPermissionMixin
 
 
+def is_asgi(request):
+    """Whether the request is served by Django's ASGI handler
+
+    The handler reads the content of streaming responses with a sync
+    iterator in full before sending any of it, so they need async iterators.
+    """
+    return isinstance(request._request, ASGIRequest)
+
+
+async def file_chunks(stream, chunk_size=FileResponse.block_size):
+    """Async iterator over the content of a file, read in a thread"""
+    read = sync_to_async(stream.read, thread_sensitive=False)
+    while True:
+        chunk = await read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
 class UserViewSet (MixedPermissionMixin, viewsets.ModelViewSet):
 
     queryset = User.objects.filter(is_active=True)
     serializer_class = UserModelSerializer
+    renderer_classes = [FastJSONRenderer]
+    pagination_class = UserKeysetPagination
     permission_classes_by_action = {'create': [permissions.AllowAny]}
 
+    def list(self, request, *args, **kwargs):
+        """Active users by id, ``fields`` selects the columns returned"""
+        params = UserListQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        fields = params.validated_data['fields']
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(user_values(queryset, fields))
+        return self.get_paginated_response(
+            [user_data(row, fields) for row in page])
+
+    def retrieve(self, request, *args, **kwargs):
+        row = get_object_or_404(
+            user_values(self.get_queryset()), pk=kwargs['pk'])
+        return Response(user_data(row))
+
     @action(
         detail=False, methods=['post'],
         permission_classes=[permissions.AllowAny])
@@ -27,17 +84,60 @@ class UserViewSet (MixedPermissionMixin, viewsets.ModelViewSet):
         serializer = UserLoginSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user, token = serializer.save()
-       
+
         # Save activity report
-        ActivityReport.objects.create(user=user)
+        with LOGIN_EVENT_WRITE.time():
+            get_event_writer().record(user)
 
         data = {
-             'user': UserModelSerializer(user).data,
+             'user': user_data(
+                 getattr(user, field) for field in USER_FIELDS),
              'access_token': token
         }
 
         return Response(data, status=status.HTTP_201_CREATED)
 
+    @action(
+        detail=True, methods=['get'],
+        pagination_class=UserActivityPagination)
+    def activity(self, request, pk=None):
+        """Login events of the user, or their counts per ``bucket``
+
+        The user is looked up on its own, the events are read from their
+        covering index without joining it.
+        """
+        params = UserActivityQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        user_id = get_object_or_404(
+            self.get_queryset().values_list('id', flat=True), pk=pk)
+        bucket = params.validated_data.get('bucket')
+        activity = UserActivity(
+            user_id, bucket=bucket,
+            date_from=params.validated_data.get('from'),
+            date_to=params.validated_data.get('to'))
+
+        page = self.paginate_queryset(activity)
+        if bucket is None:
+            data = [
+                {'id': row['id'], 'logged_at': row['logged_at']}
+                for row in page]
+        else:
+            data = [
+                {'date': row['label'], 'count': row['count']}
+                for row in page]
+        return self.get_paginated_response(data)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create a batch of users, reporting the result of each one"""
+        serializer = UserBulkCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = bulk_create_users(serializer.validated_data)
+
+        if all(result['status'] == 201 for result in results):
+            return Response(results, status=status.HTTP_201_CREATED)
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
     def create(self, request, *args, **kwargs):
         serializer = UserCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -48,7 +148,7 @@ class UserViewSet (MixedPermissionMixin, viewsets.ModelViewSet):
 
     def update(self, request, *args, **kwargs):
         try:
-            user = User.objects.get(pk=kwargs.get('pk'))
+            user = self.get_queryset().get(pk=kwargs.get('pk'))
         except User.DoesNotExist:
             return Response(
                 {'detail': 'Invalid user id.'},
@@ -61,26 +161,174 @@ class UserViewSet (MixedPermissionMixin, viewsets.ModelViewSet):
 
         return Response(data, status=status.HTTP_201_CREATED)
 
+    def destroy(self, request, *args, **kwargs):
+        """Deactivate the user, ``purge_users`` deletes it afterwards"""
+        soft_delete(self.get_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class ActivityReportViewSet (viewsets.GenericViewSet):
 
     queryset = ActivityReport.objects.all()
     serializer_class = ActivityReportSerializer
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [
+        CSVRenderer, NDJSONRenderer]
+    pagination_class = ReportKeysetPagination
+
+    def handle_exception(self, exc):
+        # The CSV and NDJSON renderers only know report rows, errors are
+        # rendered as JSON
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        if isinstance(renderer, StreamingRenderer):
+            self.request.accepted_renderer = FastJSONRenderer()
+            self.request.accepted_media_type = (
+                self.request.accepted_renderer.media_type)
+        return super().handle_exception(exc)
+
+    def report(self, request, bucket):
+        """Login counts per user and bucket"""
+        params = ActivityReportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        report = BucketReport(
+            bucket,
+            date_from=params.validated_data.get('from'),
+            date_to=params.validated_data.get('to'),
+            user=params.validated_data.get('user'),
+            fill=params.validated_data['fill'])
+        context = {
+            'bucket': bucket, 'layout': params.validated_data['layout']}
+
+        renderer = request.accepted_renderer
+        if isinstance(renderer, StreamingRenderer):
+            # Stream the rows as they come out of the database cursor
+            serializer = ActivityReportBucketSerializer(context=context)
+            if is_asgi(request):
+                content = renderer.astream(
+                    serializer.aiter_representation(report.arows()))
+            else:
+                content = renderer.stream(
+                    serializer.iter_representation(report.rows()))
+            return StreamingHttpResponse(
+                content, content_type=renderer.media_type)
+
+        page = self.paginate_queryset(report)
+        if page is not None:
+            serializer = ActivityReportBucketSerializer(
+                page, context=context)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = ActivityReportBucketSerializer(
+            report.rows(), context=context)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def hour(self, request):
+        return self.report(request, 'hour')
 
     @action(detail=False, methods=['get'])
     def day(self, request):
-        queryset = ActivityReport.objects.all().values(
-            'user__username', 'date'
-        ).annotate(count=Count('date')).order_by('date')
+        return self.report(request, 'day')
 
-        serializer = ActivityReportDaySerializer(queryset)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    @action(detail=False, methods=['get'])
+    def week(self, request):
+        return self.report(request, 'week')
 
     @action(detail=False, methods=['get'])
     def month(self, request):
-        queryset = ActivityReport.objects.all().values(
-            'user__username', 'date'
-        ).annotate(count=Count('date__month')).order_by('date')
+        return self.report(request, 'month')
 
-        serializer = ActivityReportMonthSerializer(queryset)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    @action(detail=False, methods=['get'])
+    def year(self, request):
+        return self.report(request, 'year')
+
+    def date_range(self, params):
+        """``from`` and ``to`` of the query, defaulting to today"""
+        date_to = params.validated_data.get('to') or timezone.localdate()
+        date_from = params.validated_data.get('from') or date_to
+        return date_from, max(date_from, date_to)
+
+    @action(detail=False, methods=['get'], url_path='active-users',
+            renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES)
+    def active_users(self, request):
+        """Estimated distinct users who logged in between ``from`` and ``to``
+
+        Both default to today. ``bucket`` adds the count of every day,
+        week, month or year of the range.
+        """
+        params = ActiveUsersQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        date_from, date_to = self.date_range(params)
+        return Response(active_users(
+            date_from, date_to, params.validated_data.get('bucket')))
+
+    @action(detail=False, methods=['get'],
+            renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES)
+    def top(self, request):
+        """The ``limit`` users who logged in the most
+
+        Logins between ``from`` and ``to`` are counted, both default to
+        today. Counts are upper bounds, higher than the exact count by at
+        most ``error``, unless ``exact`` is set.
+        """
+        params = TopUsersQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        date_from, date_to = self.date_range(params)
+        exact = params.validated_data['exact']
+        rows = top_users(
+            date_from, date_to, params.validated_data['limit'], exact)
+        return Response({
+            'from': date_from,
+            'to': date_to,
+            'exact': exact,
+            'results': [
+                {'user': user, 'count': count, 'error': error}
+                for user, count, error in rows],
+        })
+
+
+class ExportJobViewSet (mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Activity reports computed by the ``export_reports`` worker
+
+    Submit the report parameters, poll the job until it is done, then
+    download the gzipped CSV or NDJSON file.
+    """
+
+    queryset = ExportJob.objects.all()
+    serializer_class = ExportJobSerializer
+
+    def create(self, request, *args, **kwargs):
+        """Queue a report export, or return the job of an identical one"""
+        serializer = ExportJobCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job, created = submit(job_params(serializer.validated_data))
+        data = self.get_serializer(job).data
+
+        return Response(
+            data,
+            status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status == ExportJob.DONE:
+            try:
+                stream = open(path(job), 'rb')
+            except FileNotFoundError:
+                # Removed outside of ``expire``, the job is expired too
+                mark_expired(job)
+            else:
+                response = FileResponse(
+                    stream, as_attachment=True, filename=job.file,
+                    content_type='application/gzip')
+                if is_asgi(request):
+                    # Headers stay the ones of the file, which the response
+                    # still closes
+                    response.streaming_content = file_chunks(stream)
+                return response
+        if job.status != ExportJob.EXPIRED:
+            return Response(
+                {'detail': 'The export is not done.'},
+                status=status.HTTP_409_CONFLICT)
+        return Response(
+            {'detail': 'The export has expired.'},
+            status=status.HTTP_410_GONE)
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from . import schema
+
+
+def views():
+    """DRF view classes routed by the URL configuration"""
+    pending = list(get_resolver().url_patterns)
+    classes = []
+    while pending:
+        pattern = pending.pop(0)
+        if hasattr(pattern, 'url_patterns'):
+            pending.extend(pattern.url_patterns)
+            continue
+        cls = getattr(pattern.callback, 'cls', None)
+        if cls is not None and cls not in classes:
+            classes.append(cls)
+    return classes
+
+
+def warm_up():
+    """Do the work the first requests of a process would otherwise pay for
+
+    Builds the URL resolver and its reverse lookup tables, imports the
+    classes named in the DRF settings, builds the fields of the serializers
+    of every view and loads the OpenAPI schema. Run once in the server
+    process before forking, the workers inherit the result.
+    """
+    resolver = get_resolver()
+    resolver.reverse_dict
+    for name in api_settings.import_strings:
+        getattr(api_settings, name)
+
+    for view in views():
+        for renderer in getattr(view, 'renderer_classes', ()):
+            renderer()
+        serializer_class = getattr(view, 'serializer_class', None)
+        if serializer_class and issubclass(
+                serializer_class, serializers.Serializer):
+            serializer_class().fields
+
+    if not settings.DEBUG:
+        schema.load()
+
+
+def connect():
+    """Open the database connections, filling the pools, and release them"""
+    for connection in connections.all():
+        connection.ensure_connection()
+        connection.close()
@@ -0,0 +1,14 @@
+from django.urls import include, path
+
+from user import urls as user_urls
+from user.urls import async_urlpatterns
+
+from .urls import urlpatterns as sync_urlpatterns
+
+# Same routes in the same order, the async views take over the viewset ones
+# where the user URLs are included, after the admin and docs pages
+urlpatterns = [
+   path('', include(async_urlpatterns()))
+   if getattr(pattern, 'urlconf_name', None) is user_urls else pattern
+   for pattern in sync_urlpatterns
+]
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,9 +24,14 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = '3#^didgo3jqk&vg9al9mkjdu@j6hoc0xr(8el+wopr8bf7!*qj'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Debug also keeps every SQL query in memory, the production entrypoint sets
+# DJANGO_DEBUG=0
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = []
+# Comma separated, e.g. 'api.example.com,.example.org'
+ALLOWED_HOSTS = [
+    host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',')
+    if host]
 
 
 # Application definition
@@ -44,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'user.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,7 +60,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# asgi.py sets ASYNC_VIEWS=1 to serve the read endpoints (user list and
+# detail, activity reports) with native async views. Under WSGI every async
+# view would need its own event loop
 ROOT_URLCONF = 'user_api.urls'
+if os.environ.get('ASYNC_VIEWS') == '1':
+    ROOT_URLCONF = 'user_api.asgi_urls'
 
 TEMPLATES = [
     {
@@ -79,12 +91,25 @@ WSGI_APPLICATION = 'user_api.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'django.db.backends.postgresql',
         'NAME': 'thaloz',
         'HOST': 'db',
         'PORT': '5432',
         'USER': 'thaloz',
-        'PASSWORD': 'thaloz'
+        'PASSWORD': 'thaloz',
+        # Pooled connections are checked before being handed out
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # psycopg_pool.ConnectionPool options, per process. Connections
+            # idle for max_idle seconds are closed down to min_size
+            'pool': {
+                'min_size': 2,
+                'max_size': 10,
+                'timeout': 10,
+                'max_idle': 300,
+                'max_lifetime': 3600,
+            },
+        },
     }
 }
 
@@ -135,11 +160,21 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # The first class sets the WWW-Authenticate header of 401 responses
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',
+        'user.authentication.SignedTokenAuthentication',
     )
 }
 
+# Signed access tokens, sent as 'Authorization: Bearer <token>'. When
+# enabled, login issues them instead of authtoken keys
+SIGNED_TOKEN = {
+    'ENABLED': False,
+    'MAX_AGE': 24 * 60 * 60,
+    'REVOCATION_REFRESH': 30,
+}
+
 # Swagger configuration
 SWAGGER_SETTINGS = {
     'api_version': '1.0',
@@ -155,9 +190,42 @@ SWAGGER_SETTINGS = {
     },
     'USE_SESSION_AUTH': True,
     'JSON_EDITOR': True,
+    'SPEC_URL': 'schema-json',
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': 'schema-json',
 }
 
+# OpenAPI schema written by the generate_schema command at build time and
+# served as a static file outside DEBUG
+OPENAPI_SCHEMA_FILE = BASE_DIR / 'openapi.json'
+OPENAPI_SCHEMA_MAX_AGE = 24 * 60 * 60
+
 # Login URLs for admin backend
 LOGIN_URL = '/admin/login'
 LOGOUT_URL = '/admin/logout'
 LOGIN_REDIRECT_URL = '/admin'
+
+# Login events writer. Use 'user.events.BufferedEventWriter' with the
+# 'spool_dir', 'max_events' and 'max_delay' options to batch the inserts
+LOGIN_EVENT_WRITER = {
+    'BACKEND': 'user.events.SyncEventWriter',
+    'OPTIONS': {},
+}
+
+# Bulk user creation: largest accepted batch and processes used to hash
+# the passwords (None uses every available core)
+BULK_CREATE_MAX_USERS = 1000
+BULK_CREATE_HASH_WORKERS = None
+
+# Monthly partitioning of ActivityReport. The conversion runs with the
+# migrations when enabled, or later with 'activity_partitions --convert'.
+# 'activity_partitions' also drops partitions older than the retention
+ACTIVITY_REPORT_PARTITIONING = False
+ACTIVITY_REPORT_RETENTION_MONTHS = None
+
+# Report exports: the export_reports worker writes the files to EXPORT_DIR,
+# they are deleted EXPORT_TTL seconds after the export is done
+EXPORT_DIR = Path(os.environ.get('EXPORT_DIR', BASE_DIR / 'exports'))
+EXPORT_TTL = 24 * 60 * 60
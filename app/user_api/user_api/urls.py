@@ -1,26 +1,31 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import permissions
+from drf_yasg.renderers import ReDocRenderer, SwaggerUIRenderer
 from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+
+from user.metrics import metrics_view
+from user.schema import info, schema_view as openapi_view
 
 schema_view = get_schema_view(
-   openapi.Info(
-      title="User API",
-      default_version='v1',
-      description="An API for users",
-      contact=openapi.Contact(email="feus2006@gmail.com"),
-      license=openapi.License(name="BSD License"),
-   ),
+   info,
    public=True,
    permission_classes=(permissions.AllowAny,),
 )
 
+# The pages only load the UI, the schema itself is served by openapi_view
+ui_cache_timeout = 0 if settings.DEBUG else 24 * 60 * 60
+
 urlpatterns = [
    path('admin/', admin.site.urls),
-   path('', schema_view.with_ui(
-      'swagger', cache_timeout=0), name='schema-swagger-ui'),
-   path('redoc/', schema_view.with_ui(
-      'redoc', cache_timeout=0), name='schema-redoc'),
+   path('metrics', metrics_view, name='metrics'),
+   path('openapi.json', openapi_view, name='schema-json'),
+   path('', schema_view.as_cached_view(
+      ui_cache_timeout, renderer_classes=[SwaggerUIRenderer]),
+      name='schema-swagger-ui'),
+   path('redoc/', schema_view.as_cached_view(
+      ui_cache_timeout, renderer_classes=[ReDocRenderer]),
+      name='schema-redoc'),
    path('', include('user.urls')),
 ]